@@ -0,0 +1,73 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+from settings import settings
+
+
+class AdmissionRejected(Exception):
+    """Запрос отклонен: очередь переполнена или дедлайн истек в очереди."""
+
+
+class AdmissionController:
+    """
+    Ограничивает число одновременно обрабатываемых запросов и длину очереди.
+
+    Запросы сверх MAX_CONCURRENT_REQUESTS ждут в очереди, пока она не длиннее
+    MAX_QUEUED_REQUESTS; остальные отклоняются сразу, чтобы при перегрузке
+    деградировали лишние запросы, а не все одновременно.
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self, deadline: float) -> AsyncIterator[None]:
+        """
+        Занимает слот обработки до истечения дедлайна.
+
+        Аргументы:
+            deadline (float): Момент (time.time()), после которого ждать бессмысленно.
+
+        Исключения:
+            AdmissionRejected: Если очередь заполнена или слот не освободился до дедлайна.
+        """
+        if self.in_flight >= self.max_concurrent and self.queued >= self.max_queued:
+            self.rejected += 1
+            raise AdmissionRejected('Сервис перегружен, повторите запрос позже')
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=max(deadline - time.time(), 0))
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise AdmissionRejected('Истекло время ожидания в очереди')
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает текущую загрузку и число отклоненных запросов."""
+        return {
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'max_concurrent': self.max_concurrent,
+            'max_queued': self.max_queued,
+        }
+
+
+# Общий для процесса (воркера) контроллер допуска
+admission = AdmissionController(settings.MAX_CONCURRENT_REQUESTS, settings.MAX_QUEUED_REQUESTS)
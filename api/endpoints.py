@@ -1,19 +1,51 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import os
+import secrets
+import time
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from pydantic import BaseModel, Field
 
+from api.admission import AdmissionRejected, admission
 from rag.pipeline.graph import chain
+from rag.pipeline.resources import memory_footprint
+from rag.pipeline.retrieval_cache import retrieval_cache
+from rag.pipeline.sessions import session_manager
+from settings import settings
+from utils.logger import dropped_records
+from utils.memory_profiler import heap_snapshot, path_size_mb, peak_rss_mb, rss_mb, stop_heap_tracing
 
 router = APIRouter(prefix='/api', tags=['question'])
 
 
+class SearchFilters(BaseModel):
+    """
+    Необязательные фильтры поиска по метаданным чанков.
+
+    Attributes:
+        industry (Optional[List[str]]): Отрасли кейсов (retail, finance, food, ...).
+        source (Optional[List[str]]): URL кейсов, по которым искать.
+    """
+    industry: Optional[List[str]] = Field(None, description='Отрасли кейсов')
+    source: Optional[List[str]] = Field(None, description='URL кейсов')
+
+
 class QuestionRequest(BaseModel):
     """
     Модель для запроса вопроса к API.
 
     Attributes:
         question (str): Текст вопроса, который будет передан в цепочку обработки.
+        filters (Optional[SearchFilters]): Фильтры, сужающие множество кандидатов для поиска.
+        session_id (Optional[str]): Идентификатор сессии диалога; без него вопрос обрабатывается
+            без учета предыдущих реплик.
     """
     question: str = Field(..., min_length=1, description='Текст вопроса для обработки')
+    filters: Optional[SearchFilters] = Field(None, description='Фильтры поиска по метаданным')
+    session_id: Optional[str] = Field(
+        None, min_length=1, max_length=128, description='Идентификатор сессии диалога'
+    )
 
 
 @router.post('/ask', response_model=dict)
@@ -25,20 +57,108 @@ async def ask_question(query: QuestionRequest) -> dict:
         query (QuestionRequest): Объект с полем question, содержащим текст вопроса.
 
     Возвращает:
-        dict: Словарь с ключом 'answer', содержащий ответ от цепочки обработки.
+        dict: Словарь с ключом 'answer', содержащий ответ от цепочки обработки,
+            и 'session_id', если вопрос задан в рамках сессии.
 
     Исключения:
         HTTPException: Если произошла ошибка при обработке вопроса
-            (400 для некорректного ввода, 500 для внутренних ошибок).
+            (400 для некорректного ввода, 429 при перегрузке, 504 при истечении дедлайна,
+            500 для внутренних ошибок).
     """
+    # Дедлайн запроса передается в состояние графа, генерация укладывается в остаток бюджета
+    deadline = time.time() + settings.REQUEST_DEADLINE_S
     try:
-        # Передаем вопрос в асинхронную цепочку обработки
-        result = await chain.ainvoke({'user_input': query.question})
-        return {'answer': result['answer']}
+        async with admission.slot(deadline):
+            # Передаем вопрос в асинхронную цепочку обработки
+            filters = query.filters.model_dump(exclude_none=True) if query.filters else {}
+            payload = {'user_input': query.question, 'filters': filters, 'deadline': deadline}
+
+            # Страховочный таймаут на всю цепочку: узлы сами укладываются в дедлайн
+            timeout = max(deadline - time.time(), 0) + settings.GENERATION_RESERVE_S
 
+            # Вопрос в рамках сессии: история и найденные ранее чанки берутся из чекпойнта
+            if query.session_id:
+                result = await asyncio.wait_for(session_manager.ask(query.session_id, payload), timeout)
+                return {'answer': result['answer'], 'session_id': query.session_id}
+
+            result = await asyncio.wait_for(chain.ainvoke(payload), timeout)
+            return {'answer': result['answer']}
+
+    except AdmissionRejected as ar:
+        # Перегрузка: клиенту стоит повторить запрос позже
+        raise HTTPException(status_code=429, detail=str(ar), headers={'Retry-After': '1'})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail='Ответ не успел сформироваться до дедлайна')
     except ValueError as ve:
         # Ошибки валидации или некорректные данные
         raise HTTPException(status_code=400, detail=f'Некорректный запрос: {str(ve)}')
     except Exception as e:
         # Общие ошибки цепочки обработки
-        raise HTTPException(status_code=500, detail=f'Ошибка обработки: {str(e)}')
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f'Ошибка обработки: {str(e)}')
+
+
+@router.get('/metrics', response_model=dict)
+async def metrics() -> dict:
+    """
+    Возвращает метрики сервиса.
+
+    Возвращает:
+        dict: Доля попаданий и сэкономленное время кэша поиска по эмбеддингам и чанкам.
+    """
+    return {
+        'retrieval_cache': retrieval_cache.stats(),
+        'sessions': await session_manager.stats(),
+        'admission': admission.stats(),
+    }
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """
+    Проверяет токен администратора из заголовка X-Admin-Token.
+
+    Исключения:
+        HTTPException: 404, если ADMIN_TOKEN не задан (админские эндпоинты отключены),
+            403 при неверном токене.
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail='Not Found')
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail='Неверный токен администратора')
+
+
+@router.get('/admin/memory', response_model=dict, dependencies=[Depends(require_admin)])
+async def admin_memory(
+    snapshot: bool = Query(False, description='Снять снапшот кучи через tracemalloc'),
+    top: int = Query(20, ge=1, le=200, description='Сколько мест аллокаций вернуть'),
+    stop_tracing: bool = Query(False, description='Выключить tracemalloc после снапшота'),
+) -> dict:
+    """
+    Возвращает потребление памяти воркером по компонентам.
+
+    Отчет относится к воркеру, обработавшему запрос (поле process.pid).
+
+    Аргументы:
+        snapshot (bool): Снять снапшот кучи Python. Первый вызов только включает
+            tracemalloc, крупнейшие аллокации видны в следующих вызовах.
+        top (int): Сколько мест аллокаций вернуть в снапшоте.
+        stop_tracing (bool): Выключить tracemalloc, чтобы вернуть скорость аллокаций.
+
+    Возвращает:
+        dict: RSS процесса, модель, индекс, кэши, сессии, очередь логов
+            и, если запрошен, снапшот кучи.
+    """
+    report = {
+        'process': {'pid': os.getpid(), 'rss_mb': round(rss_mb(), 1), 'peak_rss_mb': round(peak_rss_mb(), 1)},
+        **await asyncio.to_thread(memory_footprint),
+        'caches': {'retrieval': await asyncio.to_thread(retrieval_cache.memory_usage)},
+        'sessions': {
+            **await session_manager.stats(),
+            'disk_mb': round(path_size_mb(settings.SESSION_DB_PATH), 2),
+        },
+        'logging': {'dropped_records': dropped_records()},
+    }
+    if snapshot:
+        report['heap'] = await asyncio.to_thread(heap_snapshot, top)
+    if stop_tracing:
+        stop_heap_tracing()
+    return report
@@ -0,0 +1,133 @@
+"""
+Инкрементальный обход по sitemap на локальных фикстурах.
+
+Фикстуры (benchmarks/fixtures/crawl) — robots.txt, индекс sitemap, sitemap кейсов
+и блога и страницы кейсов. Сервер раздает их в двух ревизиях сайта: во второй у
+одного кейса обновлен lastmod без изменения текста, другой кейс переписан, третий
+удален (404), появился новый. У страницы без lastmod сервер поддерживает ETag.
+Обход выполняется трижды: первый запуск, повтор без изменений и запуск после
+перехода на вторую ревизию; для каждого выводится число запросов, рендерингов и итог.
+
+Запуск:
+    python -m benchmarks.bench_crawl --renderer static
+"""
+import argparse
+import hashlib
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+
+from data_extraction.crawl_planner import CrawlPlanner, fetch_static_text
+from data_extraction.web_processor import WebTextProcessor
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures" / "crawl"
+
+# Страницы, удаленные во второй ревизии сайта
+REMOVED_IN_V2 = {"/cases/qiwi-poisk-anomalij"}
+
+
+class SitemapHandler(SimpleHTTPRequestHandler):
+    """Раздает фикстуры текущей ревизии сайта с поддержкой ETag и HEAD."""
+
+    base = ""
+    revision = 1
+    requests = 0
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _resolve(self, path: str) -> Optional[Path]:
+        """Находит файл фикстуры для пути с учетом ревизии (файлы *.v2.* заменяют исходные)."""
+        if self.revision == 2 and path in REMOVED_IN_V2:
+            return None
+        name = path.lstrip("/") or "index"
+        if not Path(name).suffix:
+            name += ".html"
+        candidates = [FIXTURES_DIR / name]
+        if self.revision == 2:
+            stem = FIXTURES_DIR / name
+            candidates.insert(0, stem.with_name(f"{stem.stem}.v2{stem.suffix}"))
+        return next((candidate for candidate in candidates if candidate.is_file()), None)
+
+    def _respond(self, with_body: bool) -> None:
+        SitemapHandler.requests += 1
+        path = self._resolve(self.path.split("?")[0])
+        if path is None:
+            self.send_error(404)
+            return
+
+        body = path.read_text(encoding="utf-8").replace("{{BASE}}", self.base).encode("utf-8")
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        content_type = {".xml": "application/xml", ".txt": "text/plain"}.get(path.suffix, "text/html")
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        self._respond(with_body=True)
+
+    def do_HEAD(self) -> None:
+        self._respond(with_body=False)
+
+
+def serve_fixtures() -> ThreadingHTTPServer:
+    """Запускает HTTP-сервер фикстур в фоновом потоке на свободном порту."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(SitemapHandler, directory=str(FIXTURES_DIR)))
+    SitemapHandler.base = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Инкрементальный обход по sitemap на локальных фикстурах")
+    parser.add_argument("--renderer", choices=["playwright", "static"], default="static")
+    args = parser.parse_args()
+
+    server = serve_fixtures()
+    render = fetch_static_text if args.renderer == "static" else WebTextProcessor().process_url
+    rendered = []
+
+    def fetch_page(url: str) -> Optional[str]:
+        rendered.append(url)
+        return render(url)
+
+    print(f"{'запуск':<22} {'запросов':>9} {'рендеров':>9} {'новых':>6} {'измен.':>7} "
+          f"{'удал.':>6} {'без изм.':>9} {'ошибок':>7}")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            planner = CrawlPlanner(
+                SitemapHandler.base,
+                fetch_page=fetch_page,
+                state_path=Path(tmp) / "crawl_state.json",
+                output_json=Path(tmp) / "cases.json",
+                report_path=Path(tmp) / "crawl_report.json",
+            )
+            for label, revision in (("первый обход", 1), ("повтор без изменений", 1), ("ревизия 2", 2)):
+                SitemapHandler.revision = revision
+                SitemapHandler.requests = 0
+                rendered.clear()
+                report = planner.run()
+                print(
+                    f"{label:<22} {SitemapHandler.requests:>9} {len(rendered):>9} {len(report['new']):>6} "
+                    f"{len(report['changed']):>7} {len(report['deleted']):>6} {report['unchanged']:>9} "
+                    f"{len(report['failed']):>7}"
+                )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
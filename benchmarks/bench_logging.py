@@ -0,0 +1,77 @@
+"""
+Накладные расходы логирования на один запрос: синхронный StreamHandler против очереди.
+
+Имитирует логи одного запроса к /api/ask: несколько служебных строк,
+полный промпт и полный ответ. Вывод направляется в /dev/null или в файл,
+чтобы мерить стоимость форматирования и записи, а не терминала.
+
+Запуск:
+    python -m benchmarks.bench_logging --requests 2000
+"""
+import argparse
+import logging
+import os
+import time
+
+from utils.logger import NonBlockingQueueHandler, flush_logs, log_payload, setup_logger
+
+PROMPT = "Контекст кейса EORA. " * 200  # ~4 КБ, как промпт с тремя разделами
+ANSWER = "Ответ ассистента со ссылками [1](https://eora.ru/cases/...). " * 40
+
+
+def _legacy_logger(stream) -> logging.Logger:
+    """Логгер в исходной конфигурации: синхронная запись каждой строки целиком."""
+    logger = logging.getLogger("bench_legacy")
+    logger.handlers.clear()
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(
+        "[%(asctime)s] [%(name)s] [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+    ))
+    logger.addHandler(handler)
+    return logger
+
+
+def simulate_legacy(logger: logging.Logger, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        logger.info("🔎 Найдено 3 чанков по сегменту 'Что вы можете сделать для ритейлеров?'")
+        logger.info(f"prompt: {PROMPT}")
+        logger.info("Отправляем запрос в OpenAI API")
+        logger.info(f"📨 Ответ: {ANSWER}")
+        logger.info("📨 Ответ успешно сгенерирован за 2.31 секунд.")
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def simulate_queued(logger: logging.Logger, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        logger.info("🔎 Найдено 3 чанков по сегменту 'Что вы можете сделать для ритейлеров?'")
+        log_payload(logger, "prompt", PROMPT)
+        logger.info("Отправляем запрос в OpenAI API")
+        log_payload(logger, "📨 Ответ", ANSWER)
+        logger.info("📨 Ответ успешно сгенерирован за %.2f секунд.", 2.31)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Накладные расходы логирования на запрос")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--sink", default=os.devnull, help="Куда писать логи исходной конфигурации")
+    args = parser.parse_args()
+
+    with open(args.sink, "w", encoding="utf-8") as sink:
+        legacy_us = simulate_legacy(_legacy_logger(sink), args.requests)
+
+    logger = setup_logger("bench_queued")
+    queued_us = simulate_queued(logger, args.requests)
+    flush_logs()
+    dropped = sum(h.dropped for h in logger.handlers if isinstance(h, NonBlockingQueueHandler))
+
+    print(f"Синхронный StreamHandler: {legacy_us:8.1f} мкс/запрос")
+    print(f"Очередь + сэмплирование:  {queued_us:8.1f} мкс/запрос (отброшено записей: {dropped})")
+
+
+if __name__ == "__main__":
+    main()
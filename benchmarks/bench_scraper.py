@@ -0,0 +1,112 @@
+"""
+Сравнение полного и экономного рендеринга страниц скрейпером на локальных фикстурах.
+
+Фикстуры (benchmarks/fixtures/scraper) повторяют структуру страниц кейсов:
+меню, формы, cookie-баннер, картинки, шрифты, видео, сторонняя аналитика и
+виджет чата. Страницы раздаются локальным HTTP-сервером с адреса 127.0.0.1,
+а «сторонние» ресурсы — с localhost, поэтому для скрейпера это другой хост.
+Картинки, шрифты и видео генерируются на лету заданного размера.
+
+Запуск:
+    python -m benchmarks.bench_scraper --repeats 3
+"""
+import argparse
+import statistics
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from data_extraction.web_processor import WebTextProcessor
+from settings import settings
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures" / "scraper"
+
+# Синтетические ресурсы: путь -> (Content-Type, размер в байтах)
+ASSETS = {
+    "/assets/hero.jpg": ("image/jpeg", 400 * 1024),
+    "/assets/screen-1.jpg": ("image/jpeg", 250 * 1024),
+    "/assets/cover.jpg": ("image/jpeg", 300 * 1024),
+    "/assets/diagram.jpg": ("image/jpeg", 150 * 1024),
+    "/assets/font.woff2": ("font/woff2", 120 * 1024),
+    "/assets/demo.mp4": ("video/mp4", 2 * 1024 * 1024),
+    "/analytics/tag.js": ("application/javascript", 90 * 1024),
+    "/widget/loader.js": ("application/javascript", 150 * 1024),
+}
+FONTS_CSS = b"@font-face { font-family: Brand; src: url(/assets/font.woff2); } body { font-family: Brand; }"
+WIDGET_HTML = b"<html><body><img src='/assets/hero.jpg'><p>Chat</p></body></html>"
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """Раздает фикстуры, подставляя адрес стороннего хоста, и синтетические ресурсы."""
+
+    third_party = ""
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send(self, content_type: str, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        path = self.path.split("?")[0]
+        if path in ASSETS:
+            content_type, size = ASSETS[path]
+            body = b"/*" + b"x" * (size - 4) + b"*/" if content_type.endswith("javascript") else b"\0" * size
+            self._send(content_type, body)
+        elif path == "/assets/fonts.css":
+            self._send("text/css", FONTS_CSS)
+        elif path == "/widget/chat.html":
+            self._send("text/html; charset=utf-8", WIDGET_HTML)
+        elif path.endswith(".html") and (FIXTURES_DIR / path.lstrip("/")).is_file():
+            html = (FIXTURES_DIR / path.lstrip("/")).read_text(encoding="utf-8")
+            self._send("text/html; charset=utf-8", html.replace("{{THIRD_PARTY}}", self.third_party).encode("utf-8"))
+        else:
+            self.send_error(404)
+
+
+def serve_fixtures() -> ThreadingHTTPServer:
+    """Запускает HTTP-сервер фикстур в фоновом потоке на свободном порту."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(FixtureHandler, directory=str(FIXTURES_DIR)))
+    FixtureHandler.third_party = f"http://localhost:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Полный и экономный рендеринг страниц скрейпером")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--settle-ms", type=int, default=settings.SCRAPER_SETTLE_MS,
+                        help="Фиксированное ожидание рендеринга в полном режиме")
+    parser.add_argument("--show-text", action="store_true", help="Показать текст, извлеченный в каждом режиме")
+    args = parser.parse_args()
+
+    settings.SCRAPER_SETTLE_MS = args.settle_ms
+    server = serve_fixtures()
+    processor = WebTextProcessor()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(f"{'страница':<18} {'режим':<6} {'мс/стр':>8} {'КБ':>8} {'запросов':>9} {'прервано':>9} {'символов':>9}")
+    try:
+        for page in sorted(p.name for p in FIXTURES_DIR.glob("*.html")):
+            for lean in (False, True):
+                runs = [processor.render_page(f"{base}/{page}", lean=lean) for _ in range(args.repeats)]
+                text, stats = runs[-1]
+                ms = statistics.median(run_stats["ms"] for _, run_stats in runs)
+                print(
+                    f"{page:<18} {'lean' if lean else 'full':<6} {ms:>8.0f} {stats['bytes'] / 1024:>8.0f} "
+                    f"{stats['requests']:>9} {stats['blocked']:>9} {stats['chars']:>9}"
+                )
+                if args.show_text:
+                    print(text, end="\n\n")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
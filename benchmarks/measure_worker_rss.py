@@ -0,0 +1,92 @@
+"""
+Замер памяти воркеров gunicorn с загрузкой модели до fork() и без неё.
+
+Запуск:
+    python -m benchmarks.measure_worker_rss --workers 4
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+import psutil
+
+from settings import settings
+
+
+def _wait_until_ready(port: int, timeout: float) -> None:
+    """Ждёт, пока API начнёт отвечать на запросы."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return
+        except Exception:
+            time.sleep(1)
+    raise RuntimeError(f"API не поднялось за {timeout:.0f} секунд")
+
+
+def measure(workers: int, preload: bool, port: int, timeout: float) -> list[dict]:
+    """
+    Запускает gunicorn и снимает RSS/PSS/USS каждого воркера.
+
+    Аргументы:
+        workers (int): Число воркеров.
+        preload (bool): Загружать ли модель в мастере до fork().
+        port (int): Порт для запуска.
+        timeout (float): Сколько секунд ждать готовности.
+
+    Возвращает:
+        list[dict]: Замеры памяти по воркерам в МБ.
+    """
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": str(workers),
+        "PRELOAD_MODEL": str(preload).lower(),
+        "SERVER_PORT": str(port),
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "main:app"],
+        cwd=settings.BASE_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_until_ready(port, timeout)
+        time.sleep(2)  # даём всем воркерам закончить инициализацию
+        rows = []
+        for child in psutil.Process(proc.pid).children():
+            memory = child.memory_full_info()
+            rows.append({
+                "pid": child.pid,
+                "rss": memory.rss / 1024**2,
+                "pss": getattr(memory, "pss", 0) / 1024**2,
+                "uss": memory.uss / 1024**2,
+            })
+        return rows
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Память воркеров с preload и без")
+    parser.add_argument("--workers", type=int, default=settings.WEB_CONCURRENCY)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    for preload in (False, True):
+        rows = measure(args.workers, preload, args.port, args.timeout)
+        print(f"\npreload={preload}, воркеров: {len(rows)}")
+        print(f"{'pid':>8} {'RSS, МБ':>10} {'PSS, МБ':>10} {'USS, МБ':>10}")
+        for row in rows:
+            print(f"{row['pid']:>8} {row['rss']:>10.1f} {row['pss']:>10.1f} {row['uss']:>10.1f}")
+        print(f"Сумма PSS: {sum(r['pss'] for r in rows):.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,528 @@
+"""
+Инкрементальный обход страниц кейсов по sitemap.xml с обнаружением изменений.
+
+Страницы находятся через robots.txt (директивы Sitemap) или /sitemap.xml, включая
+индексы sitemap и сжатые .xml.gz. Для каждого URL в файле состояния хранятся
+lastmod из sitemap, валидаторы HTTP (ETag, Last-Modified) и отпечаток очищенного
+текста. Рендерятся только новые страницы, страницы с новым lastmod и страницы без
+lastmod, которые не ответили 304 на условный запрос; измененной считается страница
+с новым отпечатком текста. Пропавшие из sitemap страницы проверяются запросом HEAD
+и при ответе 404/410 попадают в отчет как удаленные.
+
+Результат сливается в датасет settings.OUTPUT_JSON, а отчет со списками new /
+changed / deleted пишется в settings.CRAWL_REPORT_PATH — по нему ингест
+обновляет только затронутые документы (python -m data_ingestion.ingestor --crawl-report).
+
+Запуск:
+    python -m data_extraction.crawl_planner --base-url https://eora.ru
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.message import Message
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+from xml.etree import ElementTree
+
+from data_extraction.extractor import extract_urls_from_pdf
+from data_extraction.web_processor import WebTextProcessor
+from settings import settings
+from utils.logger import setup_logger
+
+# Инициализация логгера
+logger = setup_logger("crawler")
+
+# Вложенность индексов sitemap, глубже которой обход не идет
+MAX_SITEMAP_DEPTH = 3
+
+# Ответ HTTP: статус, заголовки и тело
+Response = Tuple[int, Message, bytes]
+
+
+def http_request(url: str, method: str = "GET", headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Выполняет HTTP-запрос краулера; ответы 3xx/4xx/5xx возвращаются, а не выбрасываются.
+
+    Аргументы:
+        url (str): Адрес.
+        method (str): GET или HEAD.
+        headers (Optional[Dict[str, str]]): Дополнительные заголовки (например, условные).
+
+    Возвращает:
+        Response: Статус, заголовки и тело ответа.
+
+    Исключения:
+        OSError: При сетевой ошибке или таймауте.
+    """
+    request = urllib.request.Request(
+        url, method=method, headers={"User-Agent": settings.CRAWL_USER_AGENT, **(headers or {})}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=settings.CRAWL_TIMEOUT_S) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, b""
+
+
+def fingerprint(text: str) -> str:
+    """Отпечаток текста страницы: SHA-256 без учета переносов и повторных пробелов."""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class HostLimiter:
+    """Ограничивает число одновременных запросов к одному хосту и выдерживает Crawl-delay."""
+
+    def __init__(self, per_host: int, delays: Optional[Dict[str, float]] = None) -> None:
+        self.per_host = per_host
+        self.delays = delays or {}
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        """Занимает слот хоста на время запроса (и паузы Crawl-delay после него)."""
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.per_host))
+        with semaphore:
+            try:
+                yield
+            finally:
+                if self.delays.get(host):
+                    time.sleep(self.delays[host])
+
+
+def load_robots(base_url: str) -> RobotFileParser:
+    """
+    Загружает robots.txt сайта.
+
+    Аргументы:
+        base_url (str): Корень сайта.
+
+    Возвращает:
+        RobotFileParser: Правила обхода; без robots.txt (4xx) разрешено всё.
+
+    Исключения:
+        RuntimeError: Если robots.txt недоступен из-за ошибки сервера.
+    """
+    robots_url = urljoin(base_url, "/robots.txt")
+    parser = RobotFileParser(robots_url)
+    status, _, body = http_request(robots_url)
+    if status >= 500:
+        raise RuntimeError(f"robots.txt недоступен: HTTP {status}")
+    parser.parse(body.decode("utf-8", errors="replace").splitlines() if status == 200 else [])
+    return parser
+
+
+def parse_sitemap(body: bytes) -> Tuple[Dict[str, Optional[str]], List[str]]:
+    """
+    Разбирает sitemap или индекс sitemap.
+
+    Аргументы:
+        body (bytes): Содержимое файла (XML или XML в gzip).
+
+    Возвращает:
+        Tuple[Dict[str, Optional[str]], List[str]]: Страницы с их lastmod и адреса вложенных sitemap.
+
+    Исключения:
+        ValueError: Если файл не является sitemap.
+    """
+    if body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    try:
+        root = ElementTree.fromstring(body)
+    except ElementTree.ParseError as e:
+        raise ValueError(f"Некорректный XML sitemap: {e}")
+
+    # Пространство имен sitemaps.org отбрасывается, сравниваются локальные имена тегов
+    def local(tag: str) -> str:
+        return tag.rsplit("}", 1)[-1]
+
+    kind = local(root.tag)
+    if kind not in ("urlset", "sitemapindex"):
+        raise ValueError(f"Ожидался urlset или sitemapindex, получен {kind}")
+
+    pages: Dict[str, Optional[str]] = {}
+    children: List[str] = []
+    for item in root:
+        fields = {local(field.tag): (field.text or "").strip() for field in item}
+        if not fields.get("loc"):
+            continue
+        if kind == "sitemapindex":
+            children.append(fields["loc"])
+        else:
+            pages[fields["loc"]] = fields.get("lastmod") or None
+    return pages, children
+
+
+def discover_pages(
+    sitemap_urls: List[str], limiter: HostLimiter, include: re.Pattern
+) -> Tuple[Dict[str, Optional[str]], bool]:
+    """
+    Обходит sitemap (вместе с вложенными индексами) и отбирает страницы кейсов.
+
+    Аргументы:
+        sitemap_urls (List[str]): Корневые sitemap.
+        limiter (HostLimiter): Ограничитель запросов по хостам.
+        include (re.Pattern): Шаблон пути страниц, которые попадают в обход.
+
+    Возвращает:
+        Tuple[Dict[str, Optional[str]], bool]: Страницы с lastmod и признак того, что
+            все sitemap загружены; по неполному списку удаления не определяются.
+    """
+    pages: Dict[str, Optional[str]] = {}
+    complete = True
+    queue = [(url, 0) for url in sitemap_urls]
+    seen = set()
+    while queue:
+        url, depth = queue.pop(0)
+        if url in seen or depth > MAX_SITEMAP_DEPTH:
+            continue
+        seen.add(url)
+        try:
+            with limiter.slot(url):
+                status, _, body = http_request(url)
+            if status != 200:
+                raise RuntimeError(f"HTTP {status}")
+            found, children = parse_sitemap(body)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить sitemap {url}: {e}")
+            complete = False
+            continue
+        pages.update((page, lastmod) for page, lastmod in found.items() if include.search(urlparse(page).path))
+        queue.extend((child, depth + 1) for child in children)
+    return pages, complete
+
+
+def load_state(path: Path) -> Dict[str, Dict[str, Any]]:
+    """Загружает состояние обхода {url: {lastmod, etag, last_modified, fingerprint, checked_at}}."""
+    if not path.exists():
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("pages", {})
+
+
+def save_json(path: Path, data: Any) -> None:
+    """Сохраняет JSON, подменяя файл атомарно."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def requeue_pages(urls: Iterable[str], report_path: Path, state_path: Path) -> None:
+    """
+    Возвращает страницы, которые ингест не смог загрузить, в очередь следующего обхода.
+
+    Запись состояния страницы удаляется, поэтому следующий обход обработает её
+    как новую; в отчете страница переносится из new/changed в failed.
+
+    Аргументы:
+        urls (Iterable[str]): URL незагруженных страниц.
+        report_path (Path): Отчет обхода.
+        state_path (Path): Состояние обхода.
+    """
+    urls = set(urls)
+    if not urls:
+        return
+
+    if state_path.exists():
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+        pages = state.get("pages", {})
+        if urls & set(pages):
+            for url in urls:
+                pages.pop(url, None)
+            save_json(state_path, state)
+
+    if report_path.exists():
+        with open(report_path, encoding="utf-8") as f:
+            report = json.load(f)
+        for outcome in ("new", "changed"):
+            report[outcome] = [url for url in report.get(outcome, []) if url not in urls]
+        report["failed"] = list(dict.fromkeys(report.get("failed", []) + sorted(urls)))
+        save_json(report_path, report)
+    logger.warning(f"Ингест не загрузил {len(urls)} документов, они повторятся при следующем обходе")
+
+
+def plan_crawl(
+    discovered: Dict[str, Optional[str]],
+    state: Dict[str, Dict[str, Any]],
+    complete: bool,
+    disallowed: Iterable[str] = (),
+) -> Dict[str, List[str]]:
+    """
+    Распределяет URL по действиям обхода.
+
+    Аргументы:
+        discovered (Dict[str, Optional[str]]): Найденные страницы и их lastmod.
+        state (Dict[str, Dict[str, Any]]): Состояние прошлого обхода.
+        complete (bool): Загружены ли все sitemap.
+        disallowed (Iterable[str]): Страницы из sitemap, закрытые robots.txt: они
+            не обходятся, но и не считаются пропавшими.
+
+    Возвращает:
+        Dict[str, List[str]]: fetch — рендерить (новые и с новым lastmod),
+            revalidate — проверить условным запросом (lastmod нет), skip — без изменений,
+            missing — пропали из sitemap (кандидаты на удаление).
+    """
+    plan: Dict[str, List[str]] = {"fetch": [], "revalidate": [], "skip": [], "missing": []}
+    for url, lastmod in discovered.items():
+        entry = state.get(url)
+        if entry is None or not entry.get("fingerprint"):
+            plan["fetch"].append(url)
+        elif lastmod is None:
+            plan["revalidate"].append(url)
+        elif lastmod != entry.get("lastmod"):
+            plan["fetch"].append(url)
+        else:
+            plan["skip"].append(url)
+    if complete:
+        excluded = set(disallowed)
+        plan["missing"] = [url for url in state if url not in discovered and url not in excluded]
+    return plan
+
+
+class CrawlPlanner:
+    """
+    Планировщик инкрементального обхода: находит страницы, обрабатывает изменившиеся
+    и сливает результат в датасет кейсов.
+    """
+
+    def __init__(
+        self,
+        base_url: str = settings.CRAWL_BASE_URL,
+        fetch_page: Optional[Callable[[str], Optional[str]]] = None,
+        state_path: Path = settings.CRAWL_STATE_PATH,
+        output_json: Path = settings.OUTPUT_JSON,
+        report_path: Path = settings.CRAWL_REPORT_PATH,
+        seed_urls: Optional[List[str]] = None,
+    ) -> None:
+        """
+        Аргументы:
+            base_url (str): Корень сайта с robots.txt и sitemap.xml.
+            fetch_page (Optional[Callable[[str], Optional[str]]]): Получение очищенного текста
+                страницы; по умолчанию WebTextProcessor.process_url (рендеринг в Playwright).
+            state_path (Path): Файл состояния обхода.
+            output_json (Path): Датасет {url: текст}.
+            report_path (Path): Отчет последнего обхода для ингеста.
+            seed_urls (Optional[List[str]]): Дополнительные страницы вне sitemap (например, из PDF).
+        """
+        self.base_url = base_url
+        self.fetch_page = fetch_page or WebTextProcessor().process_url
+        self.state_path = state_path
+        self.output_json = output_json
+        self.report_path = report_path
+        self.seed_urls = seed_urls or []
+        self.include = re.compile(settings.CRAWL_INCLUDE_PATTERN)
+
+    def _revalidate(self, url: str, entry: Dict[str, Any], limiter: HostLimiter) -> Tuple[int, Message]:
+        """Условный запрос по сохраненным ETag и Last-Modified."""
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        with limiter.slot(url):
+            status, response_headers, _ = http_request(url, headers=headers)
+        return status, response_headers
+
+    def crawl_page(
+        self, url: str, lastmod: Optional[str], entry: Dict[str, Any], baseline: Optional[str],
+        revalidate: bool, limiter: HostLimiter,
+    ) -> Tuple[str, Dict[str, Any], Optional[str]]:
+        """
+        Проверяет и при необходимости рендерит одну страницу.
+
+        Аргументы:
+            url (str): Адрес страницы.
+            lastmod (Optional[str]): lastmod из sitemap.
+            entry (Dict[str, Any]): Запись состояния страницы (пустая для новой).
+            baseline (Optional[str]): Отпечаток текущего текста страницы в датасете.
+            revalidate (bool): Сначала проверить страницу условным запросом.
+            limiter (HostLimiter): Ограничитель запросов по хостам.
+
+        Возвращает:
+            Tuple[str, Dict[str, Any], Optional[str]]: Итог (new, changed, unchanged,
+                deleted, failed), обновленная запись состояния и текст, если он изменился.
+        """
+        entry = {**entry, "lastmod": lastmod, "checked_at": datetime.now(timezone.utc).isoformat()}
+
+        if revalidate:
+            status, headers = self._revalidate(url, entry, limiter)
+            if status == 304:
+                return "unchanged", entry, None
+            if status in (404, 410):
+                return "deleted", entry, None
+            if status >= 400:
+                return "failed", entry, None
+            entry["etag"] = headers.get("ETag")
+            entry["last_modified"] = headers.get("Last-Modified")
+
+        with limiter.slot(url):
+            text = self.fetch_page(url)
+        if not text or not text.strip():
+            return "failed", entry, None
+
+        entry["fingerprint"] = fingerprint(text)
+        if entry["fingerprint"] == baseline:
+            return "unchanged", entry, None
+        return ("changed" if baseline else "new"), entry, text
+
+    def confirm_deleted(self, url: str, limiter: HostLimiter) -> Optional[bool]:
+        """Проверяет пропавшую из sitemap страницу: True — удалена, False — жива, None — неизвестно."""
+        try:
+            with limiter.slot(url):
+                status, _, _ = http_request(url, method="HEAD")
+        except OSError as e:
+            logger.warning(f"Не удалось проверить {url}: {e}")
+            return None
+        if status in (404, 410):
+            return True
+        return False if status < 400 else None
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Выполняет один инкрементальный обход.
+
+        Возвращает:
+            Dict[str, Any]: Отчет: списки new, changed, deleted, failed, orphaned (живые
+                страницы вне sitemap, оставлены в датасете), число unchanged и время обхода.
+        """
+        start = time.perf_counter()
+        robots = load_robots(self.base_url)
+        delay = robots.crawl_delay(settings.CRAWL_USER_AGENT)
+        limiter = HostLimiter(
+            settings.CRAWL_PER_HOST_CONCURRENCY, {urlparse(self.base_url).netloc: float(delay or 0)}
+        )
+
+        sitemaps = robots.site_maps() or [urljoin(self.base_url, "/sitemap.xml")]
+        discovered, complete = discover_pages(sitemaps, limiter, self.include)
+        for url in self.seed_urls:
+            discovered.setdefault(url, None)
+        disallowed = [url for url in discovered if not robots.can_fetch(settings.CRAWL_USER_AGENT, url)]
+        for url in disallowed:
+            del discovered[url]
+
+        state = load_state(self.state_path)
+        dataset: Dict[str, str] = {}
+        if self.output_json.exists():
+            with open(self.output_json, encoding="utf-8") as f:
+                dataset = json.load(f)
+
+        plan = plan_crawl(discovered, state, complete, disallowed)
+        logger.info(
+            f"Найдено страниц: {len(discovered)}, рендеринг: {len(plan['fetch'])}, "
+            f"условная проверка: {len(plan['revalidate'])}, без изменений: {len(plan['skip'])}, "
+            f"пропали из sitemap: {len(plan['missing'])}"
+        )
+        if not complete:
+            logger.warning("Не все sitemap загружены: удаленные страницы в этом обходе не определяются")
+
+        report: Dict[str, Any] = {
+            "new": [], "changed": [], "deleted": [], "failed": [], "orphaned": [],
+            "unchanged": len(plan["skip"]), "disallowed": disallowed,
+        }
+        with ThreadPoolExecutor(max_workers=settings.CRAWL_MAX_WORKERS) as pool:
+            futures = {
+                pool.submit(
+                    self.crawl_page, url, discovered[url], state.get(url, {}),
+                    state.get(url, {}).get("fingerprint") or (fingerprint(dataset[url]) if url in dataset else None),
+                    # Страницы без lastmod проверяются по валидаторам HTTP, в том числе при первом обходе
+                    discovered[url] is None, limiter,
+                ): url
+                for url in plan["fetch"] + plan["revalidate"]
+            }
+            deletions = {pool.submit(self.confirm_deleted, url, limiter): url for url in plan["missing"]}
+
+            gone: List[str] = []
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    outcome, entry, text = future.result()
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке {url}: {e}")
+                    report["failed"].append(url)
+                    continue
+                if outcome == "failed":
+                    report["failed"].append(url)  # запись состояния не меняется, страница повторится
+                elif outcome == "deleted":
+                    gone.append(url)
+                elif outcome == "unchanged":
+                    state[url] = entry
+                    report["unchanged"] += 1
+                else:
+                    state[url] = entry
+                    dataset[url] = text
+                    report[outcome].append(url)
+
+            for future in as_completed(deletions):
+                confirmed = future.result()
+                if confirmed:
+                    gone.append(deletions[future])
+                elif confirmed is False:
+                    report["orphaned"].append(deletions[future])
+
+        for url in gone:
+            report["deleted"].append(url)
+            state.pop(url, None)
+            dataset.pop(url, None)
+
+        # Датасет пишется раньше состояния: после сбоя между ними страницы просто обработаются повторно
+        if report["new"] or report["changed"] or report["deleted"]:
+            save_json(self.output_json, dataset)
+        save_json(self.state_path, {"base_url": self.base_url, "pages": state})
+
+        report["seconds"] = round(time.perf_counter() - start, 2)
+        report["finished_at"] = datetime.now(timezone.utc).isoformat()
+        save_json(self.report_path, report)
+        logger.info(
+            f"Обход завершен за {report['seconds']} с: новых {len(report['new'])}, "
+            f"измененных {len(report['changed'])}, удаленных {len(report['deleted'])}, "
+            f"без изменений {report['unchanged']}, ошибок {len(report['failed'])}"
+        )
+        return report
+
+
+def fetch_static_text(url: str) -> Optional[str]:
+    """
+    Получает очищенный текст страницы без браузера: HTML из ответа сервера
+    проходит те же фильтры WebTextProcessor. Подходит для страниц без JS-рендеринга.
+    """
+    status, headers, body = http_request(url)
+    if status != 200:
+        logger.warning(f"HTTP {status} при загрузке {url}")
+        return None
+    processor = WebTextProcessor()
+    html = body.decode(headers.get_content_charset() or "utf-8", errors="replace")
+    return "\n".join(processor.clean_text("\n".join(processor.clean_html(html))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Инкрементальный обход кейсов по sitemap.xml")
+    parser.add_argument("--base-url", default=settings.CRAWL_BASE_URL)
+    parser.add_argument("--renderer", choices=["playwright", "static"], default="playwright",
+                        help="playwright — рендеринг с JS, static — только HTML ответа сервера")
+    parser.add_argument("--seed-pdf", action="store_true",
+                        help="Добавить к sitemap ссылки из PDF (settings.PDF_PATH)")
+    args = parser.parse_args()
+
+    seeds = extract_urls_from_pdf(settings.PDF_PATH) if args.seed_pdf else []
+    CrawlPlanner(
+        args.base_url,
+        fetch_page=fetch_static_text if args.renderer == "static" else None,
+        seed_urls=seeds,
+    ).run()
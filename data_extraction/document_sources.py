@@ -0,0 +1,324 @@
+"""
+Извлечение текста из локальных документов (PDF, DOCX, HTML) в датасет базы знаний.
+
+Каталог обходится рекурсивно, текст извлекается постранично в пуле процессов
+(большие PDF делятся на диапазоны страниц), попутно собираются ссылки из
+аннотаций PDF, гиперссылок DOCX и тегов <a>. Результат потоково пишется в JSON
+формата {источник: текст}, который читает iterate_cases; источник — путь файла
+относительно каталога (или URL под DOCUMENTS_PUBLIC_URL), без путей сервера.
+Файлы, не изменившиеся с прошлого запуска (mtime и размер, а при их изменении —
+SHA-256), берутся из кэша без повторного извлечения.
+
+Запуск:
+    python -m data_extraction.document_sources data/sources --links-out data/links.txt
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+import fitz
+from bs4 import BeautifulSoup
+
+from settings import settings
+from utils.logger import setup_logger
+
+try:
+    import docx
+except ImportError:  # python-docx нужен только для .docx
+    docx = None
+
+# Инициализация логгера
+logger = setup_logger("document_sources")
+
+URL_PATTERN = re.compile(r'https?://[^\s)\]>"\']+')
+
+# Результат извлечения части файла: тексты страниц по порядку и найденные ссылки
+Extracted = Tuple[List[str], List[str]]
+
+
+def extract_pdf_pages(path: str, start: int, end: int) -> Extracted:
+    """
+    Извлекает текст и ссылки страниц PDF из диапазона [start, end).
+
+    Аргументы:
+        path (str): Путь к PDF.
+        start (int): Первая страница.
+        end (int): Страница, следующая за последней.
+
+    Возвращает:
+        Extracted: Тексты страниц и ссылки из аннотаций и текста.
+    """
+    pages: List[str] = []
+    links: List[str] = []
+    with fitz.open(path) as doc:
+        for number in range(start, min(end, doc.page_count)):
+            page = doc.load_page(number)
+            text = page.get_text()
+            pages.append(text)
+            links.extend(link["uri"] for link in page.get_links() if link.get("uri"))
+            links.extend(URL_PATTERN.findall(text))
+    return pages, links
+
+
+def extract_docx(path: str, start: int = 0, end: int = 0) -> Extracted:
+    """Извлекает абзацы, таблицы и гиперссылки документа DOCX."""
+    document = docx.Document(path)
+    parts = [paragraph.text for paragraph in document.paragraphs]
+    for table in document.tables:
+        for row in table.rows:
+            parts.append(" | ".join(cell.text.strip() for cell in row.cells))
+    links = [
+        rel.target_ref
+        for rel in document.part.rels.values()
+        if rel.reltype.endswith("/hyperlink") and rel.target_ref.startswith(("http://", "https://"))
+    ]
+    text = "\n".join(part for part in parts if part.strip())
+    return [text], links + URL_PATTERN.findall(text)
+
+
+def extract_html(path: str, start: int = 0, end: int = 0) -> Extracted:
+    """Извлекает текст сохраненной HTML-страницы без служебных тегов и её внешние ссылки."""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        soup = BeautifulSoup(f.read(), "html.parser")
+    try:
+        links = [a["href"] for a in soup.find_all("a", href=True) if a["href"].startswith(("http://", "https://"))]
+        for tag in soup(["script", "style", "noscript", "nav", "form", "footer", "header"]):
+            tag.decompose()
+        text = soup.get_text(separator="\n").replace("\u00A0", " ")
+    finally:
+        soup.decompose()
+    return [text], links
+
+
+EXTRACTORS: Dict[str, Callable[[str, int, int], Extracted]] = {
+    ".pdf": extract_pdf_pages,
+    ".docx": extract_docx,
+    ".html": extract_html,
+    ".htm": extract_html,
+}
+
+
+class ExtractionCache:
+    """Кэш извлеченного текста по файлам (SQLite), ключ — путь, актуальность — mtime/размер/SHA-256."""
+
+    def __init__(self, path: Path = settings.EXTRACTION_CACHE_PATH) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files "
+            "(path TEXT PRIMARY KEY, mtime REAL, size INTEGER, sha256 TEXT, text TEXT, links TEXT)"
+        )
+
+    def get(self, path: Path) -> Optional[Tuple[str, List[str]]]:
+        """
+        Возвращает закэшированный результат, если файл не менялся.
+
+        При совпадении mtime и размера файл не читается; иначе сравнивается SHA-256
+        (например, после копирования или checkout с тем же содержимым).
+        """
+        row = self._conn.execute(
+            "SELECT mtime, size, sha256, text, links FROM files WHERE path = ?", (str(path),)
+        ).fetchone()
+        if row is None:
+            return None
+        mtime, size, sha256, text, links = row
+        stat = path.stat()
+        if stat.st_mtime != mtime or stat.st_size != size:
+            if stat.st_size != size or file_sha256(path) != sha256:
+                return None
+            self._conn.execute("UPDATE files SET mtime = ? WHERE path = ?", (stat.st_mtime, str(path)))
+            self._conn.commit()
+        return text, json.loads(links)
+
+    def set(self, path: Path, text: str, links: List[str]) -> None:
+        stat = path.stat()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files (path, mtime, size, sha256, text, links) VALUES (?, ?, ?, ?, ?, ?)",
+            (str(path), stat.st_mtime, stat.st_size, file_sha256(path), text, json.dumps(links)),
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_documents(directory: Path) -> List[Path]:
+    """Возвращает поддерживаемые документы каталога (рекурсивно) в стабильном порядке."""
+    files = []
+    for path in sorted(directory.rglob("*")):
+        if not path.is_file() or path.suffix.lower() not in EXTRACTORS:
+            continue
+        if path.suffix.lower() == ".docx" and docx is None:
+            logger.warning(f"{path.name} пропущен: для DOCX установите python-docx")
+            continue
+        files.append(path.resolve())
+    return files
+
+
+def document_source(path: Path, directory: Path) -> str:
+    """
+    Возвращает стабильный источник документа для метаданных и цитирования.
+
+    Аргументы:
+        path (Path): Путь к документу.
+        directory (Path): Каталог документов (SOURCES_DIR).
+
+    Возвращает:
+        str: URL под DOCUMENTS_PUBLIC_URL, если он задан, иначе путь относительно каталога.
+    """
+    relative = Path(path).resolve().relative_to(Path(directory).resolve()).as_posix()
+    if settings.DOCUMENTS_PUBLIC_URL:
+        return f"{settings.DOCUMENTS_PUBLIC_URL.rstrip('/')}/{quote(relative)}"
+    return relative
+
+
+def plan_tasks(path: Path) -> List[Tuple[int, int]]:
+    """Делит файл на задачи пула: PDF — по диапазонам страниц, остальные форматы — целиком."""
+    if path.suffix.lower() != ".pdf":
+        return [(0, 0)]
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+    step = settings.EXTRACTION_PAGES_PER_TASK
+    return [(start, start + step) for start in range(0, page_count, step)] or [(0, 0)]
+
+
+def extract_documents(
+    paths: List[Path], cache: ExtractionCache, workers: Optional[int] = None
+) -> Iterator[Tuple[Path, str, List[str]]]:
+    """
+    Извлекает текст документов в пуле процессов, отдавая файлы по мере готовности.
+
+    Аргументы:
+        paths (List[Path]): Документы.
+        cache (ExtractionCache): Кэш результатов по файлам.
+        workers (Optional[int]): Число процессов; по умолчанию settings.EXTRACTION_WORKERS или число CPU.
+
+    Возвращает:
+        Iterator[Tuple[Path, str, List[str]]]: Путь, текст (страницы через перенос строки) и ссылки.
+    """
+    pending: List[Path] = []
+    for path in paths:
+        cached = cache.get(path)
+        if cached is None:
+            pending.append(path)
+        else:
+            yield path, *cached
+    if not pending:
+        return
+    logger.info(f"Извлекается {len(pending)} файлов из {len(paths)}, остальные взяты из кэша")
+
+    workers = workers or settings.EXTRACTION_WORKERS or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        parts: Dict[Path, List[Optional[Extracted]]] = {}
+        for path in pending:
+            try:
+                tasks = plan_tasks(path)
+            except Exception as e:
+                logger.error(f"Не удалось открыть {path}: {e}")
+                continue
+            parts[path] = [None] * len(tasks)
+            extractor = EXTRACTORS[path.suffix.lower()]
+            for index, (start, end) in enumerate(tasks):
+                futures[pool.submit(extractor, str(path), start, end)] = (path, index)
+
+        failed: Set[Path] = set()
+        for future in as_completed(futures):
+            path, index = futures[future]
+            if path in failed:
+                continue
+            try:
+                parts[path][index] = future.result()
+            except Exception as e:
+                logger.error(f"Ошибка при извлечении текста из {path}: {e}")
+                failed.add(path)
+                continue
+
+            # Файл готов, когда извлечены все его части
+            if all(part is not None for part in parts[path]):
+                file_parts = parts.pop(path)
+                pages = [page.strip() for part_pages, _ in file_parts for page in part_pages if page.strip()]
+                links = list(dict.fromkeys(link for _, part_links in file_parts for link in part_links))
+                text = "\n".join(pages)
+                cache.set(path, text, links)
+                yield path, text, links
+
+
+def build_documents_dataset(
+    directory: Path, output_json: Path, workers: Optional[int] = None
+) -> List[str]:
+    """
+    Строит датасет {источник: текст} из документов каталога (см. document_source).
+
+    JSON пишется потоково во временный файл и подменяется атомарно, поэтому
+    в памяти одновременно находится только текст одного файла.
+
+    Аргументы:
+        directory (Path): Каталог с документами.
+        output_json (Path): Путь к выходному JSON (формат iterate_cases).
+        workers (Optional[int]): Число процессов пула.
+
+    Возвращает:
+        List[str]: Уникальные ссылки, найденные в документах.
+
+    Исключения:
+        FileNotFoundError: Если каталог не существует.
+    """
+    if not directory.is_dir():
+        raise FileNotFoundError(f"Каталог {directory} не найден")
+
+    paths = find_documents(directory)
+    cache = ExtractionCache()
+    links: Dict[str, None] = {}
+    written = 0
+
+    output_json.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_json.with_name(f"{output_json.name}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("{")
+            for path, text, file_links in extract_documents(paths, cache, workers):
+                links.update(dict.fromkeys(file_links))
+                if not text.strip():
+                    logger.warning(f"В {path.name} не найден текст, пропущено")
+                    continue
+                f.write(("," if written else "") + "\n  ")
+                f.write(f"{json.dumps(document_source(path, directory))}: {json.dumps(text, ensure_ascii=False)}")
+                written += 1
+            f.write("\n}\n")
+        os.replace(tmp_path, output_json)
+    finally:
+        cache.close()
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    logger.info(f"Готово: {written} документов из {len(paths)} сохранено в {output_json}, ссылок: {len(links)}")
+    return list(links)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Извлечение текста из PDF, DOCX и HTML в датасет базы знаний")
+    parser.add_argument("directory", type=Path, nargs="?", default=settings.SOURCES_DIR)
+    parser.add_argument("--output", type=Path, default=settings.DOCUMENTS_JSON)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--links-out", type=Path, help="Сохранить найденные ссылки (по одной в строке)")
+    args = parser.parse_args()
+
+    found_links = build_documents_dataset(args.directory, args.output, args.workers)
+    if args.links_out:
+        args.links_out.write_text("\n".join(found_links) + "\n", encoding="utf-8")
@@ -33,6 +33,8 @@ def extract_urls_from_pdf(pdf_path: Path) -> List[str]:
                 text = page.get_text()
                 page_urls = re.findall(r'https?://[^\s)]+', text)
                 urls.extend(page_urls)
+                # Ссылки-аннотации: URL может быть скрыт за текстом ссылки
+                urls.extend(link['uri'] for link in page.get_links() if link.get('uri', '').startswith('http'))
         return list(set(urls))
     except Exception as e:
         raise RuntimeError(f'Ошибка при обработке PDF-файла {pdf_path}: {str(e)}')
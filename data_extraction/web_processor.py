@@ -1,8 +1,70 @@
-from typing import Iterator, Set
-from playwright.sync_api import sync_playwright
+import time
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from playwright.sync_api import Request, Route, sync_playwright
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 from bs4 import BeautifulSoup
 import re
 
+from settings import settings
+from utils.logger import setup_logger
+
+# Инициализация логгера
+logger = setup_logger("web_processor")
+
+# Полный режим: весь видимый текст страницы
+FULL_PAGE_JS = """
+    () => {
+        document.querySelectorAll('script, style, noscript')
+            .forEach(el => el.remove());
+        return document.body.innerText;
+    }
+"""
+
+# Служебные элементы, которые удаляются из DOM до извлечения текста
+NOISE_SELECTORS = [
+    'script', 'style', 'noscript', 'template', 'iframe', 'svg', 'canvas',
+    'nav', 'header:not(article header)', 'footer:not(article footer)', 'aside',
+    'form', 'button', 'input', 'select', 'textarea',
+    '[role="navigation"]', '[role="banner"]', '[role="contentinfo"]', '[role="dialog"]', '[aria-hidden="true"]',
+    '#t-header', '#t-footer', '.t-menu', '.t-popup', '.t-form', '[class*="cookie"]', '[id*="cookie"]',
+]
+
+# Экономный режим: текст только содержательных блоков (article/main, разделы страницы
+# с достаточным объемом текста и низкой долей ссылок), без навигации, форм и баннеров
+MAIN_CONTENT_JS = """
+    ([noiseSelectors, minChars, maxLinkDensity]) => {
+        document.querySelectorAll(noiseSelectors.join(',')).forEach(el => el.remove());
+        const root = document.querySelector('article, main, [role="main"]') || document.body;
+
+        // Верхнеуровневые разделы внутри корня (Tilda собирает страницу из блоков .t-rec)
+        const blockSelector = 'section, .t-rec';
+        const blocks = Array.from(root.querySelectorAll(blockSelector)).filter(el => {
+            const parent = el.parentElement.closest(blockSelector);
+            return !parent || !root.contains(parent);
+        });
+
+        const isContent = el => {
+            const text = el.innerText.trim();
+            if (text.length < minChars) return false;
+            const linkChars = Array.from(el.querySelectorAll('a'))
+                .reduce((sum, a) => sum + a.innerText.trim().length, 0);
+            return linkChars / text.length <= maxLinkDensity;
+        };
+
+        const kept = blocks.filter(isContent);
+        return kept.length ? kept.map(el => el.innerText).join('\\n') : root.innerText;
+    }
+"""
+MIN_BLOCK_CHARS = 80
+MAX_LINK_DENSITY = 0.5
+
+
+def _matches_host(host: str, domain: str) -> bool:
+    """Проверяет, что host совпадает с domain или является его поддоменом."""
+    return host == domain or host.endswith(f'.{domain}')
+
 
 class WebTextProcessor:
     """Класс для извлечения и очистки текста с веб-страниц."""
@@ -35,42 +97,128 @@ class WebTextProcessor:
         # Фразы, с которых не должны начинаться строки
         self._skip_starts: Set[str] = {'email', 'submit', 'телефон', 'форма', 'контакты'}
 
-    def extract_text(self, url: str) -> str:
+    @staticmethod
+    def _should_block(request: Request, site: str) -> bool:
         """
-        Извлекает текст с веб-страницы по указанному URL с использованием Playwright.
+        Решает, нужно ли прервать запрос страницы в экономном режиме.
 
         Аргументы:
-            url (str): URL веб-страницы для извлечения текста.
+            request (Request): Запрос Playwright.
+            site (str): Домен страницы без www.
 
         Возвращает:
-            str: Очищенный текст страницы, разделенный переносами строк.
+            bool: True для ненужных типов ресурсов и сторонних хостов (аналитика, виджеты).
+        """
+        if request.resource_type in settings.SCRAPER_BLOCKED_RESOURCES:
+            return True
+        host = urlparse(request.url).hostname
+        if not host:
+            return False  # data: и blob: не ходят в сеть
+        return not (
+            _matches_host(host, site)
+            or any(_matches_host(host, allowed) for allowed in settings.SCRAPER_ALLOWED_HOSTS)
+        )
+
+    @staticmethod
+    def _transferred_bytes(request: Request) -> int:
+        """Байты ответа (заголовки и тело), полученные по запросу."""
+        try:
+            sizes = request.sizes()
+            return sizes['responseHeadersSize'] + sizes['responseBodySize']
+        except Exception:
+            return 0
+
+    def render_page(self, url: str, lean: Optional[bool] = None) -> Tuple[str, Dict[str, Any]]:
+        """
+        Рендерит страницу в Playwright и извлекает её текст.
+
+        В экономном режиме запросы к картинкам, шрифтам, видео и сторонним хостам
+        прерываются, ожидание рендеринга заканчивается при затишье сети, а основной
+        контент выделяется прямо в странице, так что из браузера передается только он.
+
+        Аргументы:
+            url (str): URL веб-страницы.
+            lean (Optional[bool]): Экономный режим; по умолчанию settings.SCRAPER_LEAN_MODE.
+
+        Возвращает:
+            Tuple[str, Dict[str, Any]]: Текст страницы и статистика загрузки: время (ms),
+                полученные байты (bytes), число завершенных (requests) и прерванных (blocked)
+                запросов, длина текста (chars).
 
         Исключения:
-            RuntimeError: Если не удается запустить браузер, получить содержимое или страница вернула ошибку.
+            RuntimeError: Если страница вернула ошибку HTTP.
         """
-        try:
-            with sync_playwright() as playwright:
-                browser = playwright.chromium.launch()
+        lean = settings.SCRAPER_LEAN_MODE if lean is None else lean
+        start = time.perf_counter()
+        finished = []
+        blocked = 0
+
+        with sync_playwright() as playwright:
+            browser = playwright.chromium.launch()
+            try:
                 page = browser.new_page()
+                page.on('requestfinished', finished.append)
+
+                if lean:
+                    site = (urlparse(url).hostname or '').removeprefix('www.')
+
+                    def handle_route(route: Route) -> None:
+                        nonlocal blocked
+                        if self._should_block(route.request, site):
+                            blocked += 1
+                            route.abort()
+                        else:
+                            route.continue_()
+
+                    page.route('**/*', handle_route)
 
                 # Получаем response и проверяем статус
-                response = page.goto(url)
-                if response.status >= 400:
+                response = page.goto(url, wait_until='domcontentloaded' if lean else 'load')
+                if response is not None and response.status >= 400:
                     raise RuntimeError(f"Ошибка HTTP {response.status} при обращении к {url}")
 
-                page.wait_for_timeout(3000)  # Ожидание рендеринга (3 секунды)
-
-                # Извлекаем текст, исключая ненужные теги
-                text = page.evaluate("""
-                    () => {
-                        document.querySelectorAll('script, style, noscript')
-                            .forEach(el => el.remove());
-                        return document.body.innerText;
-                    }
-                """)
+                if lean:
+                    try:
+                        page.wait_for_load_state('networkidle', timeout=settings.SCRAPER_IDLE_TIMEOUT_MS)
+                    except PlaywrightTimeoutError:
+                        pass  # сеть не затихла (long-polling виджетов) — извлекаем то, что есть
+                    text = page.evaluate(MAIN_CONTENT_JS, [NOISE_SELECTORS, MIN_BLOCK_CHARS, MAX_LINK_DENSITY])
+                else:
+                    page.wait_for_timeout(settings.SCRAPER_SETTLE_MS)  # Ожидание рендеринга
+                    text = page.evaluate(FULL_PAGE_JS)
+
+                stats = {
+                    'ms': (time.perf_counter() - start) * 1000,
+                    'bytes': sum(self._transferred_bytes(request) for request in finished),
+                    'requests': len(finished),
+                    'blocked': blocked,
+                    'chars': len(text),
+                }
+            finally:
                 browser.close()
 
-                return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+        return text, stats
+
+    def extract_text(self, url: str) -> str:
+        """
+        Извлекает текст с веб-страницы по указанному URL с использованием Playwright.
+
+        Аргументы:
+            url (str): URL веб-страницы для извлечения текста.
+
+        Возвращает:
+            str: Очищенный текст страницы, разделенный переносами строк.
+
+        Исключения:
+            RuntimeError: Если не удается запустить браузер, получить содержимое или страница вернула ошибку.
+        """
+        try:
+            text, stats = self.render_page(url)
+            logger.debug(
+                f"{url}: {stats['ms']:.0f} мс, {stats['bytes'] / 1024:.0f} КБ, "
+                f"прервано запросов: {stats['blocked']}, символов: {stats['chars']}"
+            )
+            return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
 
         except Exception as e:
             raise RuntimeError(f'Ошибка при извлечении текста с {url}: {str(e)}')
@@ -0,0 +1,288 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from settings import settings
+
+# Имена файлов докстора: склеенные тексты документов и индекс смещений
+TEXTS_FILE = 'texts.bin'
+INDEX_FILE = 'index.json'
+
+# Указатель на последнюю опубликованную версию: тексты и индекс лежат вместе в каталоге версии.
+# Читатели открывают версию, которую называют метаданные опубликованной коллекции,
+# CURRENT нужен снапшотам и коллекциям старого формата без этой ссылки
+CURRENT_FILE = 'CURRENT'
+# Сколько предыдущих версий хранить для читателей, успевших прочитать старый указатель
+KEEP_PREVIOUS_VERSIONS = 1
+
+
+def current_dir(path: Path) -> Optional[Path]:
+    """
+    Возвращает каталог опубликованной версии докстора.
+
+    Аргументы:
+        path (Path): Корень докстора.
+
+    Возвращает:
+        Optional[Path]: Каталог версии, корень для докстора старого формата
+            (файлы прямо в корне) или None, если докстор не создан.
+    """
+    path = Path(path)
+    pointer = path / CURRENT_FILE
+    if pointer.exists():
+        return path / pointer.read_text(encoding='utf-8').strip()
+    if (path / INDEX_FILE).exists() and (path / TEXTS_FILE).exists():
+        return path
+    return None
+
+
+def docstore_version(path: Path) -> Optional[str]:
+    """
+    Возвращает версию опубликованного докстора без его открытия.
+
+    Аргументы:
+        path (Path): Корень докстора.
+
+    Возвращает:
+        Optional[str]: Имя каталога версии (для старого формата — время
+            изменения индекса) или None, если докстор не создан.
+    """
+    version_dir = current_dir(path)
+    if version_dir is None:
+        return None
+    if version_dir == Path(path):
+        return str((version_dir / INDEX_FILE).stat().st_mtime)
+    return version_dir.name
+
+
+def text_hash(text: str) -> str:
+    """Возвращает короткий хэш текста документа: по нему чанк сверяется с версией докстора."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _new_version_dir(path: Path) -> Path:
+    version_dir = path / f'v-{time.time_ns()}'
+    version_dir.mkdir(parents=True)
+    return version_dir
+
+
+def stage_docstore(source: Path, path: Path = settings.DOCSTORE_PATH) -> str:
+    """
+    Копирует готовые файлы докстора (например, из снапшота) в новую неопубликованную версию.
+
+    Аргументы:
+        source (Path): Каталог с texts.bin и index.json.
+        path (Path): Корень докстора.
+
+    Возвращает:
+        str: Версия докстора (см. publish_docstore).
+    """
+    version_dir = _new_version_dir(Path(path))
+    try:
+        for name in (TEXTS_FILE, INDEX_FILE):
+            shutil.copyfile(Path(source) / name, version_dir / name)
+    except Exception:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    return version_dir.name
+
+
+def publish_docstore(version: str, path: Path = settings.DOCSTORE_PATH) -> None:
+    """
+    Переключает указатель CURRENT на версию и удаляет устаревшие версии.
+
+    Вызывается после публикации коллекции, метаданные которой ссылаются на эту
+    версию: до этого момента читатели её не видят.
+
+    Аргументы:
+        version (str): Версия докстора (DocStoreWriter.version или stage_docstore).
+        path (Path): Корень докстора.
+    """
+    path = Path(path)
+    tmp_pointer = path / f'{CURRENT_FILE}.tmp'
+    tmp_pointer.write_text(version, encoding='utf-8')
+    os.replace(tmp_pointer, path / CURRENT_FILE)
+
+    # Открытые читателями mmap старых версий остаются валидными и после удаления файлов
+    versions = sorted(p for p in path.glob('v-*') if p.is_dir() and p.name != version)
+    for stale in versions[:max(len(versions) - KEEP_PREVIOUS_VERSIONS, 0)]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def discard_docstore(version: str, path: Path = settings.DOCSTORE_PATH) -> None:
+    """
+    Удаляет неопубликованную версию докстора (сборка прервана или не дала данных).
+
+    Аргументы:
+        version (str): Версия докстора.
+        path (Path): Корень докстора.
+    """
+    shutil.rmtree(Path(path) / version, ignore_errors=True)
+
+
+class DocStoreWriter:
+    """
+    Записывает полные тексты документов в один бинарный файл и индекс смещений.
+
+    Тексты хранятся один раз в UTF-8, чанки и родительские фрагменты ссылаются
+    на них байтовыми смещениями. Каждая запись создает новый каталог версии (version);
+    закрытие только завершает его. Версия становится видна читателям, когда
+    опубликована ссылающаяся на неё коллекция, поэтому новые тексты не читаются
+    по смещениям чанков старой коллекции.
+    """
+
+    def __init__(self, path: Path = settings.DOCSTORE_PATH) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._dir = _new_version_dir(self.path)
+        self.version = self._dir.name
+        self._texts = open(self._dir / TEXTS_FILE, 'wb')
+        self._offset = 0
+        self._index: Dict[str, dict] = {}
+
+    def add(self, doc_id: str, text: str, source: str, parents: List[Tuple[int, int]]) -> None:
+        """
+        Добавляет документ и границы его родительских фрагментов.
+
+        Аргументы:
+            doc_id (str): Идентификатор документа.
+            text (str): Полный текст документа.
+            source (str): URL документа.
+            parents (List[Tuple[int, int]]): Байтовые границы родительских фрагментов
+                относительно начала документа.
+        """
+        data = text.encode('utf-8')
+        self._texts.write(data)
+        self._index[doc_id] = {
+            'offset': self._offset,
+            'length': len(data),
+            'source': source,
+            'hash': text_hash(text),
+            'parents': [list(span) for span in parents],
+        }
+        self._offset += len(data)
+
+    def close(self) -> None:
+        """Завершает запись версии; публикует её publish_docstore вместе с коллекцией."""
+        self._texts.close()
+        with open(self._dir / INDEX_FILE, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False)
+
+    def abort(self) -> None:
+        """Прерывает запись: незавершенная версия удаляется, опубликованная не меняется."""
+        self._texts.close()
+        discard_docstore(self.version, self.path)
+
+    def __enter__(self) -> 'DocStoreWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class DocStore:
+    """
+    Докстор только для чтения поверх memory-mapped файла с текстами.
+
+    Фрагменты читаются срезом mmap по байтовым смещениям, без загрузки
+    всех текстов в память процесса; страницы файла разделяются между воркерами.
+    """
+
+    def __init__(self, path: Path = settings.DOCSTORE_PATH, version: Optional[str] = None) -> None:
+        self.path = Path(path)
+        # Версия, на которую ссылается коллекция, иначе — последняя опубликованная
+        version_dir = self.path / version if version else current_dir(self.path)
+        if version_dir is None or not (version_dir / INDEX_FILE).exists():
+            raise FileNotFoundError(f'Докстор в {self.path} не найден (версия {version or "CURRENT"})')
+        index_path = version_dir / INDEX_FILE
+        texts_path = version_dir / TEXTS_FILE
+
+        # Версия — имя каталога (для старого формата — время изменения индекса)
+        self.version = version_dir.name if version_dir != self.path else str(index_path.stat().st_mtime)
+        with open(index_path, encoding='utf-8') as f:
+            self.index: Dict[str, dict] = json.load(f)
+
+        self._file = open(texts_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap: Optional[mmap.mmap] = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        )
+
+    def read(self, doc_id: str, start: int, end: int) -> str:
+        """
+        Возвращает фрагмент документа по байтовым смещениям.
+
+        Аргументы:
+            doc_id (str): Идентификатор документа.
+            start (int): Начало фрагмента относительно начала документа.
+            end (int): Конец фрагмента относительно начала документа.
+
+        Возвращает:
+            str: Текст фрагмента.
+
+        Исключения:
+            KeyError: Если документа нет в доксторе.
+        """
+        entry = self.index[doc_id]
+        start = max(0, start)
+        end = min(entry['length'], end)
+        if self._mmap is None or end <= start:
+            return ''
+        base = entry['offset']
+        # Границы могут попасть внутрь многобайтового символа — такие байты отбрасываем
+        return self._mmap[base + start:base + end].decode('utf-8', errors='ignore')
+
+    def parent_span(self, doc_id: str, parent_index: int) -> Optional[Tuple[int, int]]:
+        """Возвращает байтовые границы родительского фрагмента или None."""
+        parents = self.index.get(doc_id, {}).get('parents', [])
+        if 0 <= parent_index < len(parents):
+            start, end = parents[parent_index]
+            return start, end
+        return None
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+def locate_spans(text: str, pieces: List[str]) -> List[Tuple[int, int]]:
+    """
+    Находит байтовые границы последовательных (возможно перекрывающихся) фрагментов в тексте.
+
+    Аргументы:
+        text (str): Исходный текст документа.
+        pieces (List[str]): Фрагменты в порядке следования, полученные сплиттером.
+
+    Возвращает:
+        List[Tuple[int, int]]: Границы (start, end) каждого фрагмента в байтах UTF-8.
+    """
+    spans: List[Tuple[int, int]] = []
+    char_cursor = 0
+    byte_cursor = 0
+    for piece in pieces:
+        position = text.find(piece, char_cursor)
+        if position < 0:
+            # Сплиттер мог изменить пробелы — ищем по началу фрагмента
+            position = text.find(piece[:30], char_cursor)
+        if position < 0:
+            position = char_cursor
+
+        start = byte_cursor + len(text[char_cursor:position].encode('utf-8'))
+        spans.append((start, start + len(piece.encode('utf-8'))))
+
+        # Следующий фрагмент начинается не раньше текущего (сплиттер даёт перекрытие)
+        byte_cursor = start
+        char_cursor = position
+        if position < len(text):
+            byte_cursor += len(text[position].encode('utf-8'))
+            char_cursor = position + 1
+    return spans
@@ -1,15 +1,39 @@
-from typing import List
-import psutil
+import argparse
+import json
+import tempfile
+import uuid
+from bisect import bisect_right
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from chromadb.api.models import Collection
 
 from llama_index.core import Document
 from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.utils import get_tokenizer
 
 from sentence_transformers import SentenceTransformer
 
-from data_ingestion.loader import iterate_cases
+from data_ingestion.docstore import DocStoreWriter, discard_docstore, locate_spans, publish_docstore, text_hash
+from data_ingestion.loader import iterate_all_cases
+from data_ingestion.metadata import make_doc_id
+from data_ingestion.projection import PCAProjection
 from settings import settings
-from utils.chroma_client import get_chroma_collection, get_chroma_client
+from utils.chroma_client import (
+    bump_collection_version,
+    call_with_retries,
+    create_staging_collection,
+    delete_collection,
+    get_chroma_client,
+    get_chroma_collection,
+    get_collection_docstore_version,
+    get_collection_projection_path,
+)
+from utils.index_snapshot import export_snapshot, import_snapshot, publish_index
 from utils.logger import setup_logger
+from utils.memory_profiler import MemoryProfiler
 
 # Инициализация логгера
 logger = setup_logger("chroma")
@@ -22,85 +46,324 @@ class KnowledgeBaseBuilder:
         #Инициализация клиента Chroma DB
         self.client = get_chroma_client()
 
-        # Получение или создание коллекции ChromaDB
-        self.collection = get_chroma_collection(self.client)
+        # Получение или создание коллекции ChromaDB (ингест — единственный, кто её создает)
+        self.collection = get_chroma_collection(self.client, create=True)
 
         # Загрузка модели для создания эмбеддингов
         self.embedder = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
 
-    def chunk_document(self, doc: Document) -> List[Document]:
+        # Токенизатор, которым SentenceSplitter меряет длину чанков
+        self.tokenizer = get_tokenizer()
+
+        # Профилирование памяти по фазам (включается MEMORY_PROFILING)
+        self.profiler = MemoryProfiler(settings.MEMORY_PROFILING, settings.MEMORY_PROFILE_TOP)
+
+    def split_parents(self, doc: Document) -> List[Tuple[int, int]]:
+        """
+        Разбивает документ на крупные родительские фрагменты (разделы).
+
+        Args:
+            doc: Объект Document для разбиения.
+
+        Returns:
+            Байтовые границы родительских фрагментов в тексте документа.
+        """
+        splitter = SentenceSplitter(chunk_size=settings.PARENT_CHUNK_SIZE, chunk_overlap=0)
+        return locate_spans(doc.text, splitter.split_text(doc.text))
+
+    def chunk_document(
+        self, doc: Document, parents: Optional[List[Tuple[int, int]]] = None
+    ) -> List[Document]:
         """
         Разбивает документ на чанки фиксированного размера.
 
         Args:
             doc: Объект Document для разбиения.
+            parents: Границы родительских фрагментов документа (см. split_parents).
 
         Returns:
-            Список объектов Document, каждый из которых содержит чанк текста и метаданные.
+            Список объектов Document, каждый из которых содержит чанк текста и метаданные
+            документа, дополненные позицией чанка, его длиной в токенах, байтовыми
+            границами в доксторе, хэшем текста документа, номером родительского
+            фрагмента и id соседних чанков.
         """
         # Инициализация разделителя текста на чанки
         splitter = SentenceSplitter(chunk_size=settings.CHUNK_SIZE, chunk_overlap=settings.CHUNK_OVERLAP)
 
-        # Разбиение текста на чанки
+        # Разбиение текста на чанки и поиск их границ в исходном тексте
         chunks = splitter.split_text(doc.text)
+        spans = locate_spans(doc.text, chunks)
+        parent_starts = [start for start, _ in parents or []]
+
+        # Создание объектов Document для каждого чанка с индексируемыми метаданными
+        doc_id = make_doc_id(doc.metadata.get("source", doc.text[:100]))
+        doc_hash = text_hash(doc.text)
+        return [
+            Document(
+                text=chunk,
+                metadata={
+                    **doc.metadata,
+                    "doc_id": doc_id,
+                    "doc_hash": doc_hash,
+                    "chunk_index": index,
+                    "chunk_count": len(chunks),
+                    "token_count": len(self.tokenizer(chunk)),
+                    "start": start,
+                    "end": end,
+                    # Родитель — последний раздел, начинающийся не позже чанка
+                    "parent_index": max(bisect_right(parent_starts, start) - 1, 0),
+                    "prev_id": f"{doc_id}_{index - 1}" if index > 0 else "",
+                    "next_id": f"{doc_id}_{index + 1}" if index + 1 < len(chunks) else "",
+                },
+            )
+            for index, (chunk, (start, end)) in enumerate(zip(chunks, spans))
+        ]
+
+    def project_collection(self, dim: int) -> Tuple[Collection, PCAProjection]:
+        """
+        Понижает размерность векторов коллекции PCA-проекцией, обученной по всему корпусу.
 
-        # Создание объектов Document для каждого чанка
-        return [Document(text=chunk, metadata=doc.metadata) for chunk in chunks]
+        Векторы выгружаются во временный снапшот (memmap на диске), по ним строится
+        проекция, и из снапшота собирается новая неопубликованная коллекция уже
+        с проецированными векторами; исходная коллекция удаляется. Публикует
+        коллекцию вместе с проекцией вызывающий (см. publish_index).
 
-    def ingest(self) -> None:
-        """Загружает документы в ChromaDB, разбивая их на чанки и создавая эмбеддинги."""
+        Args:
+            dim: Размерность проекции.
+
+        Returns:
+            Новая коллекция и проекция, через которую должны проходить эмбеддинги запросов.
+        """
+        with tempfile.TemporaryDirectory(dir=settings.CHROMA_DB_PATH.parent) as tmp:
+            export_snapshot(self.collection, Path(tmp))
+            projection = PCAProjection.fit(
+                np.load(Path(tmp) / "embeddings.npy", mmap_mode="r"), dim, settings.EMBEDDING_MODEL_NAME
+            )
+            collection = import_snapshot(Path(tmp), verify=False, projection=projection, publish=False)
+        delete_collection(self.client, self.collection.name)
+
+        logger.info(
+            f"Векторы спроецированы {projection.input_dim} -> {projection.dim}, "
+            f"объясненная дисперсия {projection.explained_variance:.1%}"
+        )
+        return collection, projection
+
+    @contextmanager
+    def discard_on_error(self, incremental: bool, docstore_version: str) -> Iterator[None]:
+        """
+        Удаляет неопубликованные коллекцию и версию докстора, если ингест прервался исключением.
+
+        Удаляется текущая собираемая коллекция (self.collection: исходная или уже
+        спроецированная), если она не стала опубликованной, и версия докстора, если
+        на неё не ссылается опубликованная коллекция. Ошибка после переключения
+        указателя опубликованное не трогает.
+
+        Args:
+            incremental: Инкрементальный ингест пишет в опубликованную коллекцию, её не удаляем.
+            docstore_version: Версия докстора этого ингеста.
+        """
+        try:
+            yield
+        except BaseException:
+            try:
+                live = get_chroma_collection(self.client)
+            except Exception:
+                # Что опубликовано, неизвестно: лучше оставить лишнее, чем удалить опубликованное
+                live = None
+            if live is not None:
+                if not incremental and live.name != self.collection.name:
+                    delete_collection(self.client, self.collection.name)
+                if get_collection_docstore_version(live) != docstore_version:
+                    discard_docstore(docstore_version)
+            raise
+
+    def delete_sources(self, sources: Iterable[str]) -> None:
+        """
+        Удаляет из коллекции все чанки указанных источников.
+
+        Args:
+            sources: URL документов (метаданные source).
+        """
+        for source in sources:
+            call_with_retries(self.collection.delete, where={"source": source})
+
+    def ingest(
+        self,
+        changed_sources: Optional[Set[str]] = None,
+        deleted_sources: Iterable[str] = (),
+        tracked_sources: Optional[Set[str]] = None,
+    ) -> List[str]:
+        """
+        Загружает документы в ChromaDB, разбивая их на чанки и создавая эмбеддинги.
+
+        Полная загрузка собирает новую коллекцию рядом с опубликованной, которая
+        обслуживает запросы до конца ингеста, и публикует её вместе с проекцией
+        одним переключением указателя. Инкрементальная дописывает в опубликованную.
+
+        Args:
+            changed_sources: Инкрементальный режим: эмбеддинги пересчитываются для
+                документов с этими URL, их старые чанки удаляются. None — полная загрузка.
+            deleted_sources: URL документов, чанки которых нужно удалить из коллекции.
+            tracked_sources: URL, изменения которых отслеживает обход сайта. Только
+                такие документы вне changed_sources лишь переписываются в докстор;
+                остальные (например, локальные документы) эмбеддятся заново.
+
+        Returns:
+            Источники, чанки которых не удалось записать. В инкрементальном режиме
+            их прежние чанки остаются в коллекции.
+        """
         # Подсчет общего количества обработанных чанков
 
         total_chunks = 0
         batch_size = 100  # Размер батча для обработки эмбеддингов
+        incremental = changed_sources is not None
+        tracked_sources = tracked_sources or set()
+        failed_sources: List[str] = []
+        projection = None
 
-        # Обработка кейсов по одному через итератор
-        for doc in iterate_cases(json_path=settings.OUTPUT_JSON):
-            try:
-                # Разбиение документа на чанки
-                doc_chunks = self.chunk_document(doc)
-                chunks = [chunk.text for chunk in doc_chunks]
-                metadatas = [chunk.metadata for chunk in doc_chunks]
+        self.collection = get_chroma_collection(self.client, create=True)
+        if incremental:
+            # Новые чанки проецируются уже обученной проекцией, переобучение — при полной загрузке
+            projection_path = get_collection_projection_path(self.collection)
+            if projection_path is not None:
+                projection = PCAProjection.load(projection_path)
+        else:
+            self.collection = create_staging_collection(self.client)
+            logger.info(f"Полная загрузка в новую коллекцию '{self.collection.name}'")
 
-                # Обработка чанков батчами
-                for i in range(0, len(chunks), batch_size):
-                    batch_chunks = chunks[i : i + batch_size]
-                    batch_metadatas = metadatas[i : i + batch_size]
+        deleted_sources = list(deleted_sources)
+        if deleted_sources:
+            self.delete_sources(deleted_sources)
+            logger.info(f"Удалены чанки {len(deleted_sources)} документов.")
 
-                    # Создание эмбеддингов для батча
+        # Полные тексты документов пишутся в докстор один раз, чанки ссылаются на них смещениями.
+        # Новая версия докстора публикуется только вместе с коллекцией, которая на неё ссылается,
+        # а при ошибке ингеста незавершенная версия удаляется (как и недособранная коллекция)
+        docstore = DocStoreWriter()
+        # Проекция и публикация тоже внутри: при их ошибке неопубликованные коллекция и докстор удаляются
+        with self.discard_on_error(incremental, docstore.version):
+            with docstore:
+                # Обработка кейсов по одному через итератор
+                self.profiler.start()
+                cases = iterate_all_cases()
+                while True:
+                    with self.profiler.phase("load"):
+                        doc = next(cases, None)
+                    if doc is None:
+                        break
+
+                    source = doc.metadata.get("source", "")
                     try:
+                        if incremental and source not in changed_sources and source in tracked_sources:
+                            # Обход подтвердил, что страница не менялась: обновляется только докстор
+                            with self.profiler.phase("write"):
+                                docstore.add(make_doc_id(source), doc.text, source, self.split_parents(doc))
+                            continue
 
-                        batch_embeddings = self.embedder.encode(batch_chunks, normalize_embeddings=True)
-                        logger.info(
-                            f"Потребление памяти после создания эмбеддингов: "
-                            f"{psutil.Process().memory_info().rss / 1024**2:.2f} МБ"
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка при создании эмбеддингов: {e}")
-                        continue
+                        # Разбиение документа на разделы и чанки
+                        with self.profiler.phase("chunk"):
+                            parents = self.split_parents(doc)
+                            doc_chunks = self.chunk_document(doc, parents)
+                            chunks = [chunk.text for chunk in doc_chunks]
+                            metadatas = [chunk.metadata for chunk in doc_chunks]
+                            ids = [f"{chunk.metadata['doc_id']}_{chunk.metadata['chunk_index']}" for chunk in doc_chunks]
 
-                    # Добавление батча в ChromaDB
-                    try:
-                        self.collection.add(
-                            documents=batch_chunks,
-                            metadatas=batch_metadatas,
-                            embeddings=batch_embeddings,
-                            ids=[f"doc_{total_chunks + j}" for j in range(len(batch_chunks))],
-                        )
-                        total_chunks += len(batch_chunks)
+                        if doc_chunks:
+                            with self.profiler.phase("write"):
+                                docstore.add(doc_chunks[0].metadata["doc_id"], doc.text, source, parents)
+
+                        # Сначала эмбеддинги всех батчей: при ошибке старые чанки документа остаются нетронутыми
+                        embedded = []
+                        try:
+                            for i in range(0, len(chunks), batch_size):
+                                with self.profiler.phase("embed"):
+                                    batch_embeddings = self.embedder.encode(
+                                        chunks[i : i + batch_size], normalize_embeddings=True
+                                    )
+                                    if projection is not None:
+                                        batch_embeddings = projection.transform(batch_embeddings)
+                                embedded.append((i, batch_embeddings))
+                        except Exception as e:
+                            logger.error(f"Ошибка при создании эмбеддингов {source}: {e}")
+                            failed_sources.append(source)
+                            continue
+
+                        # Добавление батчей в ChromaDB (id детерминированы, повторный ингест перезаписывает чанки)
+                        for i, batch_embeddings in embedded:
+                            batch_ids = ids[i : i + batch_size]
+                            with self.profiler.phase("write"):
+                                call_with_retries(
+                                    self.collection.upsert,
+                                    documents=chunks[i : i + batch_size],
+                                    metadatas=metadatas[i : i + batch_size],
+                                    embeddings=batch_embeddings,
+                                    ids=batch_ids,
+                                )
+                            total_chunks += len(batch_ids)
+                            self.profiler.record_batch(batch_ids[0], len(batch_ids))
+                        del embedded
+
+                        if incremental and doc_chunks:
+                            # У измененного документа могло стать меньше чанков: удаляются только лишние
+                            with self.profiler.phase("write"):
+                                call_with_retries(
+                                    self.collection.delete,
+                                    where={"$and": [{"source": source}, {"chunk_index": {"$gte": len(doc_chunks)}}]},
+                                )
 
                     except Exception as e:
-                        logger.error(f"Ошибка при добавлении в ChromaDB: {e}")
+                        logger.error(f"Ошибка при обработке документа {source}: {e}")
+                        failed_sources.append(source)
 
-                    # Очистка памяти
-                    del batch_chunks, batch_metadatas, batch_embeddings
+            if incremental:
+                # Новая версия коллекции инвалидирует кэши поиска и одной записью переключает докстор
+                bump_collection_version(self.collection, docstore=docstore.version)
+                publish_docstore(docstore.version)
+            elif not total_chunks:
+                # Пустую сборку не публикуем: опубликованные коллекция и докстор остаются как есть
+                logger.error("Полная загрузка не дала ни одного чанка, коллекция не опубликована.")
+                delete_collection(self.client, self.collection.name)
+                discard_docstore(docstore.version)
+                self.collection = get_chroma_collection(self.client, create=True)
+            else:
+                # Понижение размерности по всему корпусу
+                if settings.EMBEDDING_PROJECTION_DIM:
+                    with self.profiler.phase("project"):
+                        self.collection, projection = self.project_collection(settings.EMBEDDING_PROJECTION_DIM)
+                # Коллекция, её проекция, докстор и новая версия (инвалидирует кэши поиска) публикуются вместе
+                self.collection = publish_index(self.collection, uuid.uuid4().hex, projection, docstore.version)
 
-            except Exception as e:
-                logger.error(f"Ошибка при обработке документа: {e}")
+        # Итог по памяти (фазы и пиковый RSS) и количеству чанков
+        self.profiler.report()
+        logger.info(f"✅ Загружено в коллекцию {total_chunks} чанков.")
+        if failed_sources:
+            logger.error(f"Не удалось загрузить {len(failed_sources)} документов: {failed_sources}")
 
-        # Логирование итогового потребления памяти и количества чанков
-        logger.info(
-            f"Итоговое потребление памяти: "
-            f"{psutil.Process().memory_info().rss / 1024**2:.2f} МБ"
+        # Снапшот для быстрого старта реплик
+        if settings.SNAPSHOT_EXPORT_ON_INGEST:
+            export_snapshot(self.collection, settings.SNAPSHOT_PATH)
+        return failed_sources
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Загрузка базы знаний в ChromaDB")
+    parser.add_argument("--crawl-report", type=Path, nargs="?", const=settings.CRAWL_REPORT_PATH,
+                        help="Инкрементальная загрузка по отчету обхода (data_extraction.crawl_planner)")
+    args = parser.parse_args()
+
+    # Единственный процесс, который пишет в индекс; API-воркеры открывают его только для чтения
+    builder = KnowledgeBaseBuilder()
+    if args.crawl_report:
+        from data_extraction.crawl_planner import load_state, requeue_pages
+
+        with open(args.crawl_report, encoding="utf-8") as f:
+            report = json.load(f)
+        failed = builder.ingest(
+            changed_sources=set(report["new"] + report["changed"]),
+            deleted_sources=report["deleted"],
+            tracked_sources=set(load_state(settings.CRAWL_STATE_PATH)),
         )
-        logger.info(f"✅ Загружено в коллекцию {total_chunks} чанков.")
\ No newline at end of file
+        # Незагруженные страницы повторятся при следующем обходе, а не будут считаться обработанными
+        requeue_pages(failed, args.crawl_report, settings.CRAWL_STATE_PATH)
+    else:
+        builder.ingest()
@@ -4,6 +4,9 @@ from pathlib import Path
 from typing import Generator
 from llama_index.core import Document
 
+from data_ingestion.metadata import detect_industry, extract_title
+from settings import settings
+
 
 def iterate_cases(json_path: Path) -> Generator[Document, None, None]:
     """
@@ -13,10 +16,9 @@ def iterate_cases(json_path: Path) -> Generator[Document, None, None]:
         json_path (Path): Путь к JSON-файлу с данными.
 
     Возвращает:
-        Generator[Tuple[str, str, str], None, None]: Генератор кортежей, где каждый кортеж
-            содержит:
-            - URL (ключ из JSON),
-            - Полный текст с удаленными переносами строк и лишними пробелами.
+        Generator[Document, None, None]: Генератор документов, где каждый содержит:
+            - Полный текст с удаленными переносами строк и лишними пробелами,
+            - Метаданные: URL (source), заголовок (title) и отрасль (industry).
 
     Исключения:
         FileNotFoundError: Если JSON-файл не существует.
@@ -47,5 +49,24 @@ def iterate_cases(json_path: Path) -> Generator[Document, None, None]:
 
         yield Document(
             text=clean_text,
-            metadata={"source": link}
+            metadata={
+                "source": link,
+                "title": extract_title(text),
+                "industry": detect_industry(clean_text, link),
+            }
         )
+
+
+def iterate_all_cases() -> Generator[Document, None, None]:
+    """
+    Возвращает документы всех источников базы знаний.
+
+    Кейсы с сайта (settings.OUTPUT_JSON) дополняются локальными документами
+    (settings.DOCUMENTS_JSON), если их датасет построен.
+
+    Возвращает:
+        Generator[Document, None, None]: Генератор документов в формате iterate_cases.
+    """
+    yield from iterate_cases(json_path=settings.OUTPUT_JSON)
+    if settings.DOCUMENTS_JSON.exists():
+        yield from iterate_cases(json_path=settings.DOCUMENTS_JSON)
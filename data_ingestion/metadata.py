@@ -0,0 +1,62 @@
+import hashlib
+from typing import Dict
+
+# Ключевые слова (основы) для определения отрасли кейса
+INDUSTRY_KEYWORDS: Dict[str, tuple[str, ...]] = {
+    'retail': ('ритейл', 'магазин', 'маркетплейс', 'товар', 'покупател', 'одежд', 'kazanexpress', 'lamoda'),
+    'food': ('пицц', 'ресторан', 'доставк', 'корм', 'еда', 'dodo', 'purina'),
+    'finance': ('банк', 'страхов', 'финанс', 'платеж', 'платёж', 'кредит', 'лотере', 'qiwi'),
+    'industry': ('промышлен', 'завод', 'производств', 'молекул', 'химич', 'оборудован'),
+    'hr': ('собеседован', 'кандидат', 'найм', 'персонал', 'вакан'),
+    'media': ('видео', 'трансляц', 'сказк', 'игрок', 'игров', 'контент', 'ролик'),
+    'travel': ('авиабилет', 'путешеств', 'перелет', 'перелёт'),
+    'agro': ('ферм', 'урожа', 'растени', 'сельск'),
+    'government': ('город', 'госуслуг', 'жител', 'муниципал'),
+    'healthcare': ('медицин', 'здоров', 'родинк', 'врач', 'клиник'),
+}
+
+DEFAULT_INDUSTRY = 'other'
+
+
+def detect_industry(text: str, source: str = '') -> str:
+    """
+    Определяет отрасль кейса по частоте ключевых слов в тексте и URL.
+
+    Аргументы:
+        text (str): Текст кейса.
+        source (str, optional): URL кейса, его слаг тоже учитывается.
+
+    Возвращает:
+        str: Код отрасли из INDUSTRY_KEYWORDS или DEFAULT_INDUSTRY.
+    """
+    haystack = f'{source} {text}'.lower()
+    scores = {
+        industry: sum(haystack.count(keyword) for keyword in keywords)
+        for industry, keywords in INDUSTRY_KEYWORDS.items()
+    }
+    industry, score = max(scores.items(), key=lambda item: item[1])
+    return industry if score > 0 else DEFAULT_INDUSTRY
+
+
+def extract_title(text: str, max_length: int = 200) -> str:
+    """
+    Возвращает заголовок кейса — первую непустую строку исходного текста.
+
+    Аргументы:
+        text (str): Исходный текст кейса с переносами строк.
+        max_length (int, optional): Максимальная длина заголовка.
+
+    Возвращает:
+        str: Заголовок или пустая строка.
+    """
+    for line in text.splitlines():
+        line = line.strip()
+        if line:
+            return line[:max_length]
+    return ''
+
+
+def make_doc_id(source: str) -> str:
+    """Возвращает стабильный короткий идентификатор документа по его источнику."""
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+
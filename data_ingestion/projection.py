@@ -0,0 +1,124 @@
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Имя файла проекции в снапшоте индекса
+PROJECTION_FILE = 'projection.npz'
+
+
+class PCAProjection:
+    """
+    Линейная проекция эмбеддингов на главные компоненты корпуса.
+
+    Векторы центрируются, проецируются на dim первых компонент и заново
+    нормализуются, поэтому квадрат L2 между ними по-прежнему равен 2 - 2 * cos
+    и пороги расстояния поиска сохраняют смысл.
+    """
+
+    def __init__(
+        self,
+        mean: np.ndarray,
+        components: np.ndarray,
+        explained_variance: float,
+        model_name: str = '',
+        mtime: Optional[float] = None,
+    ) -> None:
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.explained_variance = float(explained_variance)
+        self.model_name = model_name
+        self.mtime = mtime
+
+    @property
+    def dim(self) -> int:
+        """Размерность после проекции."""
+        return self.components.shape[0]
+
+    @property
+    def input_dim(self) -> int:
+        """Размерность исходных эмбеддингов."""
+        return self.components.shape[1]
+
+    @classmethod
+    def fit(cls, embeddings: np.ndarray, dim: int, model_name: str = '', batch_size: int = 4096) -> 'PCAProjection':
+        """
+        Строит проекцию по матрице эмбеддингов корпуса.
+
+        Ковариация накапливается батчами, поэтому матрица может быть memmap
+        и не загружается в память целиком.
+
+        Аргументы:
+            embeddings (np.ndarray): Эмбеддинги корпуса, форма (n, input_dim).
+            dim (int): Размерность проекции.
+            model_name (str): Модель, которой посчитаны эмбеддинги.
+            batch_size (int): Строк за один шаг накопления.
+
+        Возвращает:
+            PCAProjection: Обученная проекция.
+
+        Исключения:
+            ValueError: Если dim не меньше исходной размерности или векторов меньше, чем dim.
+        """
+        n, input_dim = embeddings.shape
+        if not 0 < dim < input_dim:
+            raise ValueError(f'Размерность проекции должна быть от 1 до {input_dim - 1}, получено {dim}')
+        if n <= dim:
+            raise ValueError(f'Для проекции на {dim} измерений нужно больше {dim} векторов, есть {n}')
+
+        total = np.zeros(input_dim, dtype=np.float64)
+        gram = np.zeros((input_dim, input_dim), dtype=np.float64)
+        for start in range(0, n, batch_size):
+            batch = np.asarray(embeddings[start:start + batch_size], dtype=np.float64)
+            total += batch.sum(axis=0)
+            gram += batch.T @ batch
+
+        mean = total / n
+        covariance = (gram - n * np.outer(mean, mean)) / (n - 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:dim]
+        explained = eigenvalues[order].sum() / max(eigenvalues.clip(min=0).sum(), 1e-12)
+        return cls(mean, eigenvectors[:, order].T, explained, model_name)
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Проецирует эмбеддинги и нормализует результат.
+
+        Аргументы:
+            embeddings (np.ndarray): Вектор (input_dim,) или матрица (n, input_dim).
+
+        Возвращает:
+            np.ndarray: Нормализованные векторы размерности dim того же ранга, float32.
+        """
+        projected = (np.asarray(embeddings, dtype=np.float32) - self.mean) @ self.components.T
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        return (projected / np.maximum(norms, 1e-12)).astype(np.float32)
+
+    def save(self, path: Path) -> None:
+        """Сохраняет проекцию, подменяя файл атомарно."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                mean=self.mean,
+                components=self.components,
+                explained_variance=np.float64(self.explained_variance),
+                model_name=np.asarray(self.model_name),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'PCAProjection':
+        """Загружает проекцию, сохраненную методом save."""
+        path = Path(path)
+        with np.load(path) as data:
+            return cls(
+                data['mean'],
+                data['components'],
+                float(data['explained_variance']),
+                str(data['model_name']),
+                mtime=path.stat().st_mtime,
+            )
@@ -0,0 +1,396 @@
+"""
+Офлайн-оценка поиска: качество (recall@k, MRR, nDCG) против задержки и размера индекса.
+
+Корпус берется из settings.OUTPUT_JSON, размеченные вопросы — из
+evaluation/questions.json (вопрос -> URL релевантных кейсов). Для каждой
+комбинации параметров прогоняется тот же отбор, что и в find_relevant_chunks
+(select_chunks: порог расстояния, MMR, переранжирование), поверх точного
+поиска в памяти. Эмбеддинги чанков и вопросов кэшируются на диске, поэтому
+повторные прогоны и сетки по параметрам отбора не пересчитывают их.
+С --projection-dims векторы дополнительно проецируются PCA, обученной по
+корпусу (как в ингесте), и в конце печатается отчет recall@k по размерностям.
+Cross-encoder загружается до прогона и оценивает всех кандидатов без бюджета
+времени сервиса; доля упрощенных (degraded) переранжирований попадает в отчет.
+
+Запуск:
+    python -m evaluation.harness --chunk-sizes 100,150,300 --top-k 5,10,20 \
+        --max-distances 1.0,1.3,1.6 --rerankers tfidf,none
+    python -m evaluation.harness --projection-dims 0,128,256,384,512
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.node_parser import SentenceSplitter
+
+from data_ingestion.loader import iterate_all_cases
+from data_ingestion.projection import PCAProjection
+from evaluation.metrics import ndcg_at_k, recall_at_k, reciprocal_rank, unique_in_order
+from rag.pipeline.chunk_selector import RERANKERS, CrossEncoderReranker, select_chunks
+from settings import settings
+from utils.logger import setup_logger
+
+# Инициализация логгера
+logger = setup_logger("evaluation")
+
+QUESTIONS_PATH = Path(__file__).resolve().parent / "questions.json"
+METRIC_KS = (1, 3, 5)
+
+
+class EmbeddingCache:
+    """Дисковый кэш эмбеддингов по тексту и имени модели (SQLite)."""
+
+    def __init__(self, path: Path = settings.EVAL_CACHE_PATH, model_name: str = settings.EMBEDDING_MODEL_NAME) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self._conn = sqlite3.connect(str(path))
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self._embedder = None
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\n{text}".encode("utf-8")).hexdigest()
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        """
+        Возвращает нормализованные эмбеддинги текстов, вычисляя только отсутствующие в кэше.
+
+        Аргументы:
+            texts (Sequence[str]): Тексты.
+            batch_size (int, optional): Размер батча для модели.
+
+        Возвращает:
+            np.ndarray: Матрица (len(texts), dim) типа float32.
+        """
+        keys = [self._key(text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if missing:
+            if self._embedder is None:
+                from sentence_transformers import SentenceTransformer
+
+                self._embedder = SentenceTransformer(self.model_name)
+            logger.info(f"Вычисляются эмбеддинги: {len(missing)} из {len(texts)}")
+            vectors = self._embedder.encode(
+                [texts[i] for i in missing], batch_size=batch_size, normalize_embeddings=True
+            ).astype(np.float32)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(keys[i], vector.tobytes()) for i, vector in zip(missing, vectors)],
+            )
+            self._conn.commit()
+            found.update((keys[i], vector) for i, vector in zip(missing, vectors))
+
+        return np.stack([found[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+
+class CorpusIndex:
+    """Точный поиск в памяти по корпусу чанков, совместимый по расстояниям с Chroma (квадрат L2)."""
+
+    def __init__(self, documents: List[str], metadatas: List[Dict[str, Any]], embeddings: np.ndarray) -> None:
+        self.documents = documents
+        self.metadatas = metadatas
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    @property
+    def size_bytes(self) -> int:
+        """Оценка размера индекса: векторы и тексты чанков."""
+        return self.embeddings.nbytes + sum(len(doc.encode("utf-8")) for doc in self.documents)
+
+    def query(self, query_embedding: np.ndarray, n_results: int) -> Dict[str, Any]:
+        """Возвращает n_results ближайших чанков в формате результата collection.query."""
+        similarity = self.embeddings @ query_embedding
+        n = min(n_results, len(similarity))
+        top = np.argpartition(-similarity, n - 1)[:n]
+        top = top[np.argsort(-similarity[top])]
+        return {
+            "documents": [self.documents[i] for i in top],
+            "metadatas": [self.metadatas[i] for i in top],
+            # Для нормализованных векторов квадрат L2 = 2 - 2 * cos
+            "distances": (2 - 2 * similarity[top]).tolist(),
+            "embeddings": self.embeddings[top],
+        }
+
+
+def build_corpus(chunk_size: int, chunk_overlap: int, cache: EmbeddingCache) -> CorpusIndex:
+    """
+    Разбивает корпус на чанки заданного размера и строит индекс в памяти.
+
+    Аргументы:
+        chunk_size (int): Размер чанка в токенах.
+        chunk_overlap (int): Перекрытие чанков в токенах.
+        cache (EmbeddingCache): Кэш эмбеддингов.
+
+    Возвращает:
+        CorpusIndex: Индекс чанков.
+    """
+    splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    documents: List[str] = []
+    metadatas: List[Dict[str, Any]] = []
+    for doc in iterate_all_cases():
+        for chunk in splitter.split_text(doc.text):
+            documents.append(chunk)
+            metadatas.append({"source": doc.metadata["source"]})
+    return CorpusIndex(documents, metadatas, cache.encode(documents))
+
+
+# Офлайн переранжирование не ограничено бюджетом задержки сервиса (CROSS_ENCODER_BUDGET_MS)
+_offline_rerankers: Dict[str, Any] = {}
+
+
+def offline_reranker(name: str) -> Any:
+    """
+    Возвращает переранжировщик для офлайн-оценки.
+
+    Cross-encoder загружается заранее (а не в фоне, как в сервисе) и работает
+    без бюджета времени, поэтому строки сетки не зависят от нагрузки и прогрева.
+
+    Аргументы:
+        name (str): Имя переранжировщика из RERANKERS.
+
+    Возвращает:
+        Any: Имя для select_chunks или экземпляр CrossEncoderReranker.
+    """
+    if name != "cross_encoder":
+        return name
+    if name not in _offline_rerankers:
+        from rag.pipeline.resources import get_cross_encoder
+
+        get_cross_encoder()
+        _offline_rerankers[name] = CrossEncoderReranker(budget_ms=None)
+    return _offline_rerankers[name]
+
+
+def evaluate(
+    index: CorpusIndex,
+    questions: List[Dict[str, Any]],
+    query_embeddings: np.ndarray,
+    params: Dict[str, Any],
+) -> Dict[str, float]:
+    """
+    Прогоняет размеченные вопросы через поиск с заданными параметрами отбора.
+
+    Аргументы:
+        index (CorpusIndex): Индекс чанков.
+        questions (List[Dict[str, Any]]): Вопросы с полем relevant.
+        query_embeddings (np.ndarray): Эмбеддинги вопросов.
+        params (Dict[str, Any]): Параметры select_chunks (top_k, max_distance, reranker, ...).
+
+    Возвращает:
+        Dict[str, float]: Средние метрики качества и задержки, а также доля
+            упрощенных переранжирований (degraded).
+    """
+    scores: Dict[str, List[float]] = {f"recall@{k}": [] for k in METRIC_KS}
+    scores.update({"mrr": [], "ndcg@5": [], "empty": [], "degraded": []})
+    latencies: List[float] = []
+
+    n_candidates = max(params["top_k"], settings.RETRIEVAL_CANDIDATES)
+    select_params = dict(params)
+    if "reranker" in params:
+        select_params["reranker"] = offline_reranker(params["reranker"])
+    for question, query_embedding in zip(questions, query_embeddings):
+        start = time.perf_counter()
+        results = index.query(query_embedding, n_candidates)
+        chunks = select_chunks(question["question"], query_embedding, **results, **select_params)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        ranked = unique_in_order(chunk["source"] for chunk in chunks)
+        relevant = question["relevant"]
+        for k in METRIC_KS:
+            scores[f"recall@{k}"].append(recall_at_k(ranked, relevant, k))
+        scores["mrr"].append(reciprocal_rank(ranked, relevant))
+        scores["ndcg@5"].append(ndcg_at_k(ranked, relevant, 5))
+        scores["empty"].append(float(not chunks))
+        scores["degraded"].append(float(getattr(chunks, "degraded", False)))
+
+    row = {name: float(np.mean(values)) for name, values in scores.items()}
+    if row["degraded"]:
+        logger.warning(f"{params}: {row['degraded']:.0%} переранжирований упрощены, метрики не отражают модель")
+    row["latency_p50_ms"] = float(np.percentile(latencies, 50))
+    row["latency_p95_ms"] = float(np.percentile(latencies, 95))
+    return row
+
+
+def pareto_front(rows: List[Dict[str, Any]], quality: str = "ndcg@5") -> None:
+    """Отмечает строки, не доминируемые по качеству, задержке и размеру индекса."""
+    def dominates(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+        better_or_equal = (
+            a[quality] >= b[quality]
+            and a["latency_p50_ms"] <= b["latency_p50_ms"]
+            and a["index_mb"] <= b["index_mb"]
+        )
+        strictly_better = (
+            a[quality] > b[quality]
+            or a["latency_p50_ms"] < b["latency_p50_ms"]
+            or a["index_mb"] < b["index_mb"]
+        )
+        return better_or_equal and strictly_better
+
+    for row in rows:
+        row["pareto"] = not any(dominates(other, row) for other in rows if other is not row)
+
+
+def project_corpus(
+    index: CorpusIndex, query_embeddings: np.ndarray, dim: int
+) -> Tuple[CorpusIndex, np.ndarray]:
+    """
+    Проецирует индекс и вопросы PCA, обученной по эмбеддингам корпуса.
+
+    Аргументы:
+        index (CorpusIndex): Индекс чанков в исходной размерности.
+        query_embeddings (np.ndarray): Эмбеддинги вопросов.
+        dim (int): Размерность проекции; 0 — без проекции.
+
+    Возвращает:
+        Tuple[CorpusIndex, np.ndarray]: Индекс и эмбеддинги вопросов в новой размерности.
+    """
+    if not dim:
+        return index, query_embeddings
+    projection = PCAProjection.fit(index.embeddings, dim)
+    logger.info(f"PCA {projection.input_dim} -> {dim}: объясненная дисперсия {projection.explained_variance:.1%}")
+    projected = CorpusIndex(index.documents, index.metadatas, projection.transform(index.embeddings))
+    return projected, projection.transform(query_embeddings)
+
+
+def run_sweep(
+    chunk_configs: List[Tuple[int, int]],
+    selection_grid: Dict[str, List[Any]],
+    questions_path: Path = QUESTIONS_PATH,
+    cache: Optional[EmbeddingCache] = None,
+    projection_dims: Sequence[int] = (0,),
+) -> List[Dict[str, Any]]:
+    """
+    Перебирает сетку параметров чанкинга, размерности и отбора.
+
+    Аргументы:
+        chunk_configs (List[Tuple[int, int]]): Пары (chunk_size, chunk_overlap).
+        selection_grid (Dict[str, List[Any]]): Значения параметров select_chunks.
+        questions_path (Path, optional): Путь к размеченным вопросам.
+        cache (Optional[EmbeddingCache]): Кэш эмбеддингов.
+        projection_dims (Sequence[int], optional): Размерности PCA-проекции; 0 — исходная.
+
+    Возвращает:
+        List[Dict[str, Any]]: Строки результатов с отметкой Парето-оптимальности.
+    """
+    with open(questions_path, encoding="utf-8") as f:
+        questions = json.load(f)
+    cache = cache or EmbeddingCache()
+    query_embeddings = cache.encode([q["question"] for q in questions])
+
+    rows: List[Dict[str, Any]] = []
+    names = list(selection_grid)
+    for chunk_size, chunk_overlap in chunk_configs:
+        full_index = build_corpus(chunk_size, chunk_overlap, cache)
+        for dim in projection_dims:
+            index, projected_queries = project_corpus(full_index, query_embeddings, dim)
+            for values in itertools.product(*(selection_grid[name] for name in names)):
+                params = dict(zip(names, values))
+                row = {
+                    "chunk_size": chunk_size,
+                    "chunk_overlap": chunk_overlap,
+                    "dim": index.embeddings.shape[1],
+                    **params,
+                    "chunks": len(index.documents),
+                    "index_mb": index.size_bytes / 1024**2,
+                    **evaluate(index, questions, projected_queries, params),
+                }
+                rows.append(row)
+                logger.info(f"{params} chunk={chunk_size}/{chunk_overlap} dim={row['dim']}: nDCG@5={row['ndcg@5']:.3f}")
+
+    pareto_front(rows)
+    return rows
+
+
+def format_table(rows: List[Dict[str, Any]]) -> str:
+    """Форматирует результаты как Markdown-таблицу, Парето-оптимальные строки первыми."""
+    if not rows:
+        return ""
+    columns = list(rows[0])
+    ordered = sorted(rows, key=lambda r: (not r["pareto"], -r["ndcg@5"], r["latency_p50_ms"]))
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    for row in ordered:
+        cells = [f"{row[c]:.3f}" if isinstance(row[c], float) else ("✓" if row[c] is True else str(row[c])) for c in columns]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def format_dimension_report(rows: List[Dict[str, Any]]) -> str:
+    """
+    Сводка recall@k по размерностям: лучшая конфигурация отбора для каждой размерности.
+
+    Лучшая выбирается по nDCG@5, чтобы сравнивать размерности при прочих равных.
+    """
+    best: Dict[int, Dict[str, Any]] = {}
+    for row in rows:
+        if row["dim"] not in best or row["ndcg@5"] > best[row["dim"]]["ndcg@5"]:
+            best[row["dim"]] = row
+
+    columns = [f"recall@{k}" for k in METRIC_KS] + ["ndcg@5", "latency_p50_ms", "index_mb"]
+    lines = ["| dim | " + " | ".join(columns) + " |", "|" + "---|" * (len(columns) + 1)]
+    for dim in sorted(best, reverse=True):
+        lines.append(f"| {dim} | " + " | ".join(f"{best[dim][c]:.3f}" for c in columns) + " |")
+    return "\n".join(lines)
+
+
+def _parse_list(value: str, cast) -> List[Any]:
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Оценка качества и задержки поиска с перебором параметров")
+    parser.add_argument("--chunk-sizes", default=str(settings.CHUNK_SIZE))
+    parser.add_argument("--chunk-overlaps", default=str(settings.CHUNK_OVERLAP))
+    parser.add_argument("--top-k", default="10")
+    parser.add_argument("--max-distances", default=str(settings.RETRIEVAL_MAX_DISTANCE))
+    parser.add_argument("--rerank-top-k", default=str(settings.RERANK_TOP_K))
+    parser.add_argument("--per-source-caps", default=str(settings.RETRIEVAL_PER_SOURCE_CAP))
+    parser.add_argument("--rerankers", default=",".join(RERANKERS))
+    parser.add_argument("--projection-dims", default="0", help="Размерности PCA-проекции через запятую, 0 — исходная")
+    parser.add_argument("--questions", type=Path, default=QUESTIONS_PATH)
+    parser.add_argument("--output", type=Path, default=settings.BASE_DIR / "cache" / "eval_results.csv")
+    args = parser.parse_args()
+
+    chunk_configs = [
+        (size, overlap)
+        for size in _parse_list(args.chunk_sizes, int)
+        for overlap in _parse_list(args.chunk_overlaps, int)
+        if overlap < size
+    ]
+    grid = {
+        "top_k": _parse_list(args.top_k, int),
+        "max_distance": _parse_list(args.max_distances, float),
+        "rerank_top_k": _parse_list(args.rerank_top_k, int),
+        "per_source_cap": _parse_list(args.per_source_caps, int),
+        "reranker": _parse_list(args.rerankers, str),
+    }
+    projection_dims = _parse_list(args.projection_dims, int)
+    rows = run_sweep(chunk_configs, grid, args.questions, projection_dims=projection_dims)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(format_table(rows))
+    if len(projection_dims) > 1:
+        print("\nRecall@k по размерностям эмбеддингов:")
+        print(format_dimension_report(rows))
+    print(f"\nРезультаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
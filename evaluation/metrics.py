@@ -0,0 +1,57 @@
+import math
+from typing import Iterable, List, Sequence
+
+
+def unique_in_order(items: Iterable[str]) -> List[str]:
+    """Возвращает элементы без повторов, сохраняя порядок первого появления."""
+    seen = set()
+    result = []
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            result.append(item)
+    return result
+
+
+def recall_at_k(ranked: Sequence[str], relevant: Sequence[str], k: int) -> float:
+    """
+    Доля релевантных источников, попавших в первые k результатов.
+
+    Аргументы:
+        ranked (Sequence[str]): Ранжированные источники без повторов.
+        relevant (Sequence[str]): Релевантные источники.
+        k (int): Глубина.
+
+    Возвращает:
+        float: Значение от 0 до 1.
+    """
+    if not relevant:
+        return 0.0
+    return len(set(ranked[:k]) & set(relevant)) / len(set(relevant))
+
+
+def reciprocal_rank(ranked: Sequence[str], relevant: Sequence[str]) -> float:
+    """Обратный ранг первого релевантного источника (0, если его нет)."""
+    relevant_set = set(relevant)
+    for rank, item in enumerate(ranked, 1):
+        if item in relevant_set:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked: Sequence[str], relevant: Sequence[str], k: int) -> float:
+    """
+    Нормированный DCG с бинарной релевантностью.
+
+    Аргументы:
+        ranked (Sequence[str]): Ранжированные источники без повторов.
+        relevant (Sequence[str]): Релевантные источники.
+        k (int): Глубина.
+
+    Возвращает:
+        float: Значение от 0 до 1.
+    """
+    relevant_set = set(relevant)
+    dcg = sum(1.0 / math.log2(rank + 1) for rank, item in enumerate(ranked[:k], 1) if item in relevant_set)
+    ideal = sum(1.0 / math.log2(rank + 1) for rank in range(1, min(len(relevant_set), k) + 1))
+    return dcg / ideal if ideal else 0.0
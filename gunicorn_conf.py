@@ -0,0 +1,46 @@
+# Конфигурация gunicorn для продакшн-запуска нескольких воркеров:
+#   gunicorn -c gunicorn_conf.py main:app
+import os
+
+import psutil
+
+# В воркерах индекс открыт только для чтения, пересборка — отдельным процессом ингеста
+os.environ.setdefault("READ_ONLY_INDEX", "true")
+
+from settings import settings  # noqa: E402
+from utils.logger import setup_logger  # noqa: E402
+
+# Инициализация логгера
+logger = setup_logger("gunicorn")
+
+bind = f"{settings.SERVER_HOST}:{settings.SERVER_PORT}"
+workers = settings.WEB_CONCURRENCY
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = settings.PRELOAD_MODEL
+timeout = 120
+graceful_timeout = 30
+
+
+def when_ready(server) -> None:
+    """Вызывается в мастере после загрузки приложения и до запуска воркеров."""
+    if settings.PRELOAD_MODEL:
+        from rag.pipeline.resources import preload_shared_resources
+
+        preload_shared_resources()
+
+
+def post_fork(server, worker) -> None:
+    """Ограничивает число потоков torch в каждом воркере."""
+    import torch
+
+    torch.set_num_threads(settings.TORCH_THREADS_PER_WORKER)
+
+
+def post_worker_init(worker) -> None:
+    """Логирует потребление памяти воркера сразу после инициализации."""
+    memory = psutil.Process().memory_full_info()
+    logger.info(
+        f"Воркер {worker.pid}: RSS {memory.rss / 1024**2:.2f} МБ, "
+        f"PSS {getattr(memory, 'pss', 0) / 1024**2:.2f} МБ, "
+        f"USS {memory.uss / 1024**2:.2f} МБ"
+    )
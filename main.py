@@ -1,12 +1,42 @@
-from fastapi import FastAPI
+import uuid
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from api.endpoints import router
 import uvicorn
 
-app = FastAPI(title="EORA Assistant API", version="1.0")
+from rag.pipeline.resources import get_embedder
+from rag.pipeline.sessions import session_manager
+from utils.logger import flush_logs, request_id_var
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Прогрев модели: при запуске через gunicorn с preload она уже загружена в мастере
+    get_embedder()
+    await session_manager.start()
+    yield
+    await session_manager.stop()
+    flush_logs()
+
+
+app = FastAPI(title="EORA Assistant API", version="1.0", lifespan=lifespan)
 
 app.include_router(router)
 
-if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    # Корреляция логов одного запроса: берем X-Request-ID клиента или создаем свой
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
 
+if __name__ == "__main__":
+    # Режим разработки: один процесс с перезагрузкой. Продакшн: gunicorn -c gunicorn_conf.py main:app
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
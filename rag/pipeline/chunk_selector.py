@@ -1,15 +1,23 @@
+import asyncio
 import re
+import time
 import warnings
-from typing import List, Set, Dict
+from typing import Any, Callable, List, Optional, Set, Dict, Union
 
+import numpy as np
 from chromadb.api.models import Collection
 from sentence_transformers import SentenceTransformer
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 from data_extraction.dataset_builder import build_cases_dataset
+from data_ingestion.docstore import DocStore
 from data_ingestion.ingestor import KnowledgeBaseBuilder
+from rag.pipeline.resources import cross_encoder_ready, get_cross_encoder, get_docstore, get_projection, reset_collection
+from rag.pipeline.retrieval_cache import make_key, normalize_question, retrieval_cache
+from rag.pipeline.types import Chunk
 from settings import settings
-from utils.chroma_client import get_chroma_client
+from utils.chroma_client import aquery_collection
+from utils.index_snapshot import MANIFEST_FILE, import_snapshot
 from utils.logger import setup_logger
 
 # Игнорирование предупреждения torch
@@ -22,20 +30,291 @@ warnings.filterwarnings(
 # Инициализация логгера
 logger = setup_logger("chunks")
 
-def find_relevant_chunks(
+def build_where(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Преобразует фильтры запроса в where-условие ChromaDB.
+
+    Args:
+        filters: Словарь {поле метаданных: значение}; значения None пропускаются,
+            списки превращаются в условие $in.
+
+    Returns:
+        Условие where или None, если фильтров нет.
+    """
+    conditions = [
+        {field: {"$in": list(value)} if isinstance(value, (list, tuple, set)) else value}
+        for field, value in (filters or {}).items()
+        if value is not None and value != []
+    ]
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def select_diverse(
+    query_embedding: np.ndarray,
+    candidate_embeddings: np.ndarray,
+    sources: List[str],
+    top_k: int,
+    mmr_lambda: float = 0.7,
+    per_source_cap: Optional[int] = None,
+) -> List[int]:
+    """
+    Выбирает разнообразные кандидаты методом MMR с ограничением числа чанков на источник.
+
+    Args:
+        query_embedding: Нормализованный эмбеддинг запроса, форма (dim,).
+        candidate_embeddings: Нормализованные эмбеддинги кандидатов, форма (n, dim).
+        sources: Источник каждого кандидата.
+        top_k: Сколько кандидатов выбрать.
+        mmr_lambda: Баланс релевантности (1.0) и разнообразия (0.0).
+        per_source_cap: Максимум чанков с одного источника (None — без ограничения).
+
+    Returns:
+        Индексы выбранных кандидатов в порядке выбора.
+    """
+    n = len(candidate_embeddings)
+    if n == 0 or top_k <= 0:
+        return []
+
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    relevance = candidates @ np.asarray(query_embedding, dtype=np.float32)
+    similarity = candidates @ candidates.T
+
+    # Для каждого кандидата — максимальное сходство с уже выбранными
+    max_similarity = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    source_ids = np.unique(np.asarray(sources), return_inverse=True)[1]
+    source_counts = np.zeros(source_ids.max() + 1, dtype=np.int32)
+
+    selected: List[int] = []
+    while len(selected) < top_k and available.any():
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+
+        # Исключаем оставшиеся чанки источника, исчерпавшего лимит
+        source_counts[source_ids[best]] += 1
+        if per_source_cap is not None and source_counts[source_ids[best]] >= per_source_cap:
+            available &= source_ids != source_ids[best]
+
+    return selected
+
+
+def expand_context(chunks: List[Dict[str, Any]], docstore: Optional[DocStore]) -> List[Chunk]:
+    """
+    Расширяет найденные чанки до их родительских разделов и склеивает пересечения.
+
+    Текст разделов читается из докстора по байтовым смещениям. Пересекающиеся
+    фрагменты одного документа объединяются в один, порядок определяется
+    лучшим рангом входящих в него чанков. Чанк, хэш документа которого не совпадает
+    с версией в доксторе (документ переписан инкрементальным ингестом), не расширяется:
+    его смещения указывают в другой текст.
+
+    Args:
+        chunks: Чанки в порядке релевантности с полями doc_id, start, end, parent_index.
+        docstore: Докстор с полными текстами или None.
+
+    Returns:
+        Список чанков с расширенным текстом и источником.
+    """
+    if docstore is None or not settings.CONTEXT_EXPANSION:
+        return [{"text": chunk["text"], "source": chunk["source"]} for chunk in chunks]
+
+    # Спаны по документам: (начало, конец, лучший ранг, источник)
+    spans: Dict[str, List[List[Any]]] = {}
+    passthrough: List[tuple[int, Chunk]] = []
+    for rank, chunk in enumerate(chunks):
+        doc_id = chunk.get("doc_id")
+        entry = docstore.index.get(doc_id)
+        stale = entry is not None and "doc_hash" in chunk and "hash" in entry and chunk["doc_hash"] != entry["hash"]
+        if entry is None or "start" not in chunk or stale:
+            passthrough.append((rank, {"text": chunk["text"], "source": chunk["source"]}))
+            continue
+        start, end = chunk["start"], chunk["end"]
+        parent = docstore.parent_span(doc_id, chunk.get("parent_index", -1))
+        if parent is not None:
+            start, end = min(start, parent[0]), max(end, parent[1])
+        spans.setdefault(doc_id, []).append([start, end, rank, chunk["source"]])
+
+    # Слияние пересекающихся и смежных спанов внутри документа
+    expanded: List[tuple[int, Chunk]] = []
+    for doc_id, doc_spans in spans.items():
+        doc_spans.sort()
+        merged = [doc_spans[0]]
+        for start, end, rank, source in doc_spans[1:]:
+            last = merged[-1]
+            if start <= last[1]:
+                last[1] = max(last[1], end)
+                last[2] = min(last[2], rank)
+            else:
+                merged.append([start, end, rank, source])
+        for start, end, rank, source in merged:
+            expanded.append((rank, {"text": docstore.read(doc_id, start, end).strip(), "source": source}))
+
+    return [chunk for _, chunk in sorted(expanded + passthrough, key=lambda item: item[0])]
+
+
+def select_chunks(
+    question: str,
+    query_embedding: np.ndarray,
+    documents: List[str],
+    metadatas: List[Dict[str, Any]],
+    distances: List[float],
+    embeddings: Any,
+    top_k: int = 10,
+    max_distance: Optional[float] = None,
+    mmr_lambda: Optional[float] = None,
+    per_source_cap: Optional[int] = None,
+    reranker: Union[str, Callable, None] = None,
+    rerank_top_k: Optional[int] = None,
+    deadline: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Отбирает чанки из кандидатов ANN-поиска: фильтр по расстоянию, MMR, переранжирование.
+
+    Вынесено из find_relevant_chunks, чтобы офлайн-оценка прогоняла тот же отбор
+    с другими параметрами. Параметры по умолчанию берутся из settings.
+
+    Args:
+        question: Текст сегмента.
+        query_embedding: Нормализованный эмбеддинг сегмента.
+        documents: Тексты кандидатов.
+        metadatas: Метаданные кандидатов.
+        distances: Расстояния кандидатов до запроса (квадрат L2, как в Chroma).
+        embeddings: Эмбеддинги кандидатов.
+        top_k: Сколько кандидатов оставить после MMR.
+        max_distance: Порог расстояния.
+        mmr_lambda: Вес релевантности в MMR.
+        per_source_cap: Лимит чанков на источник.
+        reranker: Имя переранжировщика из RERANKERS или сам переранжировщик
+            (офлайн-оценка передает cross-encoder без бюджета времени).
+        rerank_top_k: Сколько чанков вернуть после переранжирования.
+        deadline: Дедлайн запроса (time.time()), ограничивает бюджет cross-encoder.
+
+    Returns:
+        Отобранные чанки с полями text, source и позицией в доксторе
+        (RerankedChunks с флагом degraded, если переранжирование упростилось).
+    """
+    max_distance = settings.RETRIEVAL_MAX_DISTANCE if max_distance is None else max_distance
+    mmr_lambda = settings.RETRIEVAL_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    per_source_cap = settings.RETRIEVAL_PER_SOURCE_CAP if per_source_cap is None else per_source_cap
+    reranker = reranker or settings.RERANKER
+    rerank_top_k = rerank_top_k or settings.RERANK_TOP_K
+
+    # Фильтруем по расстоянию
+    keep = np.flatnonzero(np.asarray(distances) <= max_distance)
+    if keep.size == 0:
+        return []
+
+    # Разнообразим выдачу: MMR и лимит чанков на один источник (0 — без лимита)
+    sources = [metadatas[i].get("source", "unknown") for i in keep]
+    selected = select_diverse(
+        query_embedding,
+        np.asarray(embeddings, dtype=np.float32)[keep],
+        sources,
+        top_k=top_k,
+        mmr_lambda=mmr_lambda,
+        per_source_cap=per_source_cap or None,
+    )
+
+    # Склеиваем текст, source и позицию чанка в доксторе
+    chunks_with_sources = [
+        {
+            "text": documents[keep[i]],
+            "source": sources[i],
+            **{
+                field: metadatas[keep[i]][field]
+                for field in ("doc_id", "doc_hash", "start", "end", "parent_index")
+                if field in metadatas[keep[i]]
+            },
+        }
+        for i in selected
+    ]
+
+    # Переранжирование. TF-IDF ничего не возвращает, если слова вопроса не встречаются
+    # в чанках дословно (другой падеж, синоним) — тогда остается порядок MMR
+    reranked = rerank(chunks_with_sources, question, rerank_top_k, reranker, deadline)
+    return reranked or keep_order(chunks_with_sources, question, rerank_top_k)
+
+
+def bootstrap_collection() -> Optional[Collection]:
+    """
+    Наполняет пустую коллекцию: из снапшота, если он есть, иначе полной пересборкой базы.
+
+    Returns:
+        Заново открытая коллекция или None, если индекс открыт только для чтения.
+    """
+    # В продакшн-режиме индекс только для чтения: писать в него может лишь процесс ингеста
+    if settings.READ_ONLY_INDEX:
+        logger.error("Коллекция Chroma пуста, а индекс открыт только для чтения. Запустите ингест отдельно.")
+        return None
+
+    if (settings.SNAPSHOT_PATH / MANIFEST_FILE).exists():
+        # Быстрый путь: загрузка готовых векторов из снапшота без скрейпинга и эмбеддинга
+        logger.warning("🔄 Коллекция Chroma пуста. Загружаю снапшот индекса...")
+        import_snapshot(settings.SNAPSHOT_PATH)
+    else:
+        logger.warning("🔄 Коллекция Chroma пуста. Запускаю пересборку базы...")
+
+        # Шаг 1: Распаковка данных
+        build_cases_dataset(settings.PDF_PATH, settings.OUTPUT_JSON)
+        logger.info("🔄 Векторизация источников...")
+
+        # Шаг 2: Построение базы знаний
+        builder = KnowledgeBaseBuilder()
+        builder.ingest()
+        logger.info("✅ База знаний успешно создана.")
+
+    # Пересоздаем collection, чтобы она увидела изменения
+    return reset_collection()
+
+
+def search_budget(deadline: Optional[float]) -> Optional[float]:
+    """
+    Возвращает время (с), которое поиск может потратить до дедлайна запроса.
+
+    Args:
+        deadline: Момент (time.time()), к которому должен быть готов ответ, или None.
+
+    Returns:
+        Остаток за вычетом запаса на запасной ответ или None, если дедлайна нет.
+    """
+    if not deadline:
+        return None
+    return deadline - time.time() - settings.GENERATION_RESERVE_S
+
+
+async def find_relevant_chunks(
     question: str,
     collection: Collection,
     embedder: SentenceTransformer,
     top_k: int = 10,
-) -> List[str]:
+    filters: Optional[Dict[str, Any]] = None,
+    query_embedding: Optional[np.ndarray] = None,
+    deadline: Optional[float] = None,
+) -> List[Chunk]:
     """
     Семантический поиск релевантных чанков по вопросу пользователя.
 
+    Запрос к Chroma выполняется асинхронно (см. aquery_collection), остальные
+    блокирующие шаги — в пуле потоков, поэтому параллельные ветки поиска
+    не блокируют цикл событий.
+
     Args:
         question: Сегмент (например, "Что вы можете сделать для ритейлеров?").
         collection: Коллекция ChromaDB.
         embedder: Модель эмбеддингов (SentenceTransformer).
         top_k: Сколько самых похожих чанков вернуть.
+        filters: Фильтры по метаданным чанков (например, {"industry": "retail"}),
+            применяются в Chroma до поиска ближайших соседей.
+        query_embedding: Заранее вычисленный эмбеддинг вопроса (например, батчем
+            для всех сегментов); если не передан, вычисляется здесь.
+        deadline: Дедлайн запроса (time.time()); эмбеддинг и запрос к Chroma
+            ограничены оставшимся временем, после дедлайна поиск не начинается.
 
     Returns:
         Список релевантных чанков.
@@ -48,45 +327,118 @@ def find_relevant_chunks(
         logger.warning(f"Недопустимое значение top_k ({top_k}), возвращается пустой список.")
         return []
 
+    # Параметры, от которых зависит результат поиска
+    where = build_where(filters)
+    n_candidates = max(top_k, settings.RETRIEVAL_CANDIDATES)
+
+    def build_key(version: str) -> str:
+        return make_key(
+            normalize_question(question),
+            version,
+            top_k,
+            settings.RETRIEVAL_MAX_DISTANCE,
+            where,
+            n_candidates,
+            settings.RETRIEVAL_MMR_LAMBDA,
+            settings.RETRIEVAL_PER_SOURCE_CAP,
+            settings.RERANKER,
+            settings.RERANK_TOP_K,
+            settings.CROSS_ENCODER_MODEL,
+            settings.CROSS_ENCODER_CANDIDATES,
+            settings.CONTEXT_EXPANSION,
+        )
+
     try:
+        # Результат детерминирован для вопроса и версии коллекции — пробуем кэш
+        # (версия перечитывается у Chroma, в режиме http это сетевой запрос)
+        start_time = time.perf_counter()
+        collection, version = await asyncio.to_thread(retrieval_cache.resolve_collection, collection)
+        cache_key = build_key(version)
+        cached = retrieval_cache.get_chunks(cache_key)
+        if cached is not None:
+            logger.info(f"🔎 {len(cached)} чанков по сегменту '{question}' взяты из кэша.")
+            return cached
+
         # Проверка: коллекция существует, но пуста
-        if collection.count() == 0:
-            logger.warning("🔄 Коллекция Chroma пуста. Запускаю пересборку базы...")
-
-            # Шаг 1: Распаковка данных
-            build_cases_dataset(settings.PDF_PATH, settings.OUTPUT_JSON)
-            logger.info("🔄 Векторизация источников...")
-
-            # Шаг 2: Построение базы знаний
-            builder = KnowledgeBaseBuilder()
-            builder.ingest()
-            logger.info("✅ База знаний успешно создана.")
-
-            # Пересоздаем collection, чтобы она увидела изменения
-            collection = get_chroma_client().get_or_create_collection(settings.CHROMA_COLLECTION_NAME)
-
-        # Создание эмбеддинга и поиск
-        query_embedding = embedder.encode(question, normalize_embeddings=True)
-        results = collection.query(query_embeddings=[query_embedding], n_results=top_k)
-
-        # Извлекаем документы и метаданные
-        documents = results.get("documents", [[]])[0]
-        metadatas = results.get("metadatas", [[]])[0]
-        distances = results["distances"][0]
-
-        # Склеиваем текст, source и фильтруем по расстоянию
-        max_distance = 1.3  # можно сделать настраиваемым через settings
-        chunks_with_sources = [
-            {"text": doc, "source": meta.get("source", "unknown")}
-            for doc, meta, dist in zip(documents, metadatas, distances)
-            if dist <= max_distance
-        ]
-
-        filtered_chunks = rerank_by_tfidf(chunks_with_sources, question)
+        if await asyncio.to_thread(collection.count) == 0:
+            collection = await asyncio.to_thread(bootstrap_collection)
+            if collection is None:
+                return []
+            # Пересборка выставила новую версию: результат сохраняется уже под ней
+            collection, version = await asyncio.to_thread(retrieval_cache.resolve_collection, collection, True)
+            cache_key = build_key(version)
+
+        # Создание эмбеддинга (с кэшем) и поиск кандидатов с предфильтром по метаданным
+        budget = search_budget(deadline)
+        if budget is not None and budget <= 0:
+            logger.warning(f"Бюджет времени исчерпан, поиск по сегменту '{question}' пропущен.")
+            return []
+        if query_embedding is None:
+            query_embedding = await asyncio.wait_for(
+                asyncio.to_thread(
+                    retrieval_cache.get_embedding, question, lambda: embedder.encode(question, normalize_embeddings=True)
+                ),
+                timeout=budget,
+            )
+        raw_embedding = np.asarray(query_embedding, dtype=np.float32)
+
+        for attempt in range(2):
+            # Коллекция в пониженной размерности: запрос проецируется той же PCA
+            projection = get_projection(collection)
+            query_embedding = projection.transform(raw_embedding) if projection is not None else raw_embedding
+            try:
+                results = await asyncio.wait_for(
+                    aquery_collection(
+                        collection,
+                        query_embeddings=[query_embedding.tolist()],
+                        n_results=n_candidates,
+                        where=where,
+                        include=["documents", "metadatas", "distances", "embeddings"],
+                    ),
+                    timeout=search_budget(deadline),
+                )
+                break
+            except asyncio.TimeoutError:
+                raise
+            except Exception:
+                # Коллекция могла быть удалена публикацией новой: перечитываем указатель и повторяем
+                fresh, version = await asyncio.to_thread(retrieval_cache.resolve_collection, collection, True)
+                if attempt or str(fresh.id) == str(collection.id):
+                    raise
+                logger.info(f"Коллекция '{collection.name}' заменена на '{fresh.name}', повторяю поиск.")
+                collection, cache_key = fresh, build_key(version)
+
+        # Отбор кандидатов: фильтр по расстоянию, разнообразие, переранжирование
+        filtered_chunks = await asyncio.to_thread(
+            select_chunks,
+            question,
+            query_embedding,
+            documents=results.get("documents", [[]])[0],
+            metadatas=results.get("metadatas", [[]])[0],
+            distances=results["distances"][0],
+            embeddings=results["embeddings"][0],
+            top_k=top_k,
+            deadline=deadline,
+        )
+        if not filtered_chunks:
+            logger.info(f"🔎 Для сегмента '{question}' не осталось чанков после отбора.")
+            return []
+
+        # Расширение победителей до их разделов
+        degraded = getattr(filtered_chunks, "degraded", False)
+        # (докстор той версии, с которой согласованы смещения чанков коллекции)
+        filtered_chunks = expand_context(filtered_chunks, get_docstore(retrieval_cache.docstore_version))
         logger.info(f"🔎 Найдено {len(filtered_chunks)} чанков по сегменту '{question}' (семантический поиск).")
 
+        # Упрощенный под нагрузкой результат не кэшируем, иначе он переживет нагрузку
+        if not degraded:
+            retrieval_cache.set_chunks(cache_key, filtered_chunks, (time.perf_counter() - start_time) * 1000)
+
         return filtered_chunks
 
+    except asyncio.TimeoutError:
+        logger.warning(f"Поиск по сегменту '{question}' не уложился в дедлайн запроса.")
+        return []
     except Exception as e:
         logger.error(f"❌ Ошибка при семантическом поиске: {e}")
         return []
@@ -151,4 +503,161 @@ def rerank_by_tfidf(
     return [doc for _, doc in scored_docs[:top_k]]
 
 
+def keep_order(chunks: List[Dict[str, str]], question: str, top_k: int = 3) -> List[Dict[str, str]]:
+    """Переранжировщик-заглушка: оставляет порядок MMR и возвращает первые top_k."""
+    return chunks[:top_k]
+
+
+def cheap_scores(chunks: List[Dict[str, str]], question: str) -> np.ndarray:
+    """
+    Дешевая оценка кандидатов для первого шага каскада.
+
+    Складывает априорную оценку по позиции в выдаче MMR (плотный поиск) и долю
+    основ слов вопроса, встречающихся в чанке. Основа — первые 5 букв слова,
+    поэтому «ритейлеров» и «ритейлерам» совпадают без морфологического анализа.
+
+    Args:
+        chunks: Кандидаты в порядке MMR.
+        question: Текст запроса.
+
+    Returns:
+        Оценки кандидатов, больше — лучше.
+    """
+    stems = {word[:5] for word in re.findall(r'\w+', question.lower()) if len(word) > 2}
+    prior = 1.0 - np.arange(len(chunks)) / max(len(chunks), 1)
+    if not stems:
+        return prior
+    overlap = [
+        len(stems & {word[:5] for word in re.findall(r'\w+', chunk['text'].lower())}) / len(stems)
+        for chunk in chunks
+    ]
+    return prior + np.asarray(overlap)
+
 
+class RerankedChunks(list):
+    """
+    Результат переранжирования с пометкой о деградации.
+
+    degraded=True означает, что под нагрузкой переранжирование упростилось
+    (модель не загружена, не хватило бюджета, оценена лишь часть кандидатов),
+    и такой результат не стоит кэшировать наравне с полноценным.
+    """
+
+    def __init__(self, chunks: List[Dict[str, str]], degraded: bool = False) -> None:
+        super().__init__(chunks)
+        self.degraded = degraded
+
+
+# Первый проход модели холодный, а стоимость пары еще неизвестна: оцениваем не больше двух пар
+CROSS_ENCODER_FIRST_PASS_PAIRS = 2
+
+
+class CrossEncoderReranker:
+    """
+    Каскадное переранжирование cross-encoder'ом под бюджет времени.
+
+    Дешевая оценка (cheap_scores) отсекает кандидатов до CROSS_ENCODER_CANDIDATES,
+    оставшиеся пары (вопрос, чанк) оцениваются моделью за один батчевый проход.
+    Размер батча ограничивается так, чтобы проход уложился в остаток бюджета —
+    budget_ms, но не больше времени до дедлайна запроса, — по
+    скользящей оценке стоимости одной пары. Если модель еще загружается или
+    в бюджет не помещаются хотя бы две пары, возвращается порядок дешевой оценки,
+    поэтому результат не бывает пустым; такой результат помечается как degraded.
+    """
+
+    def __init__(self, budget_ms: Optional[float] = settings.CROSS_ENCODER_BUDGET_MS) -> None:
+        # Бюджет на один поиск, мс; None — без бюджета (офлайн-оценка)
+        self.budget_ms = budget_ms
+        # Скользящая оценка времени прохода модели на одну пару, мс
+        self.ms_per_pair: Optional[float] = None
+
+    def __call__(
+        self, chunks: List[Dict[str, str]], question: str, top_k: int = 3, deadline: Optional[float] = None
+    ) -> RerankedChunks:
+        start = time.perf_counter()
+        if not chunks:
+            return RerankedChunks([])
+
+        # Шаг 1: дешевая оценка и отсечение
+        order = np.argsort(-cheap_scores(chunks, question), kind="stable")
+        ranked = [chunks[i] for i in order]
+        n_candidates = min(len(ranked), settings.CROSS_ENCODER_CANDIDATES)
+        if n_candidates < 2:
+            return RerankedChunks(ranked[:top_k])
+        if not cross_encoder_ready():
+            logger.info("Cross-encoder еще загружается, используется дешевая оценка.")
+            return RerankedChunks(ranked[:top_k], degraded=True)
+
+        # Шаг 2: столько пар, сколько помещается в остаток бюджета
+        budget_ms = self.budget_ms
+        request_budget = search_budget(deadline)
+        if request_budget is not None:
+            budget_ms = request_budget * 1000 if budget_ms is None else min(budget_ms, request_budget * 1000)
+        remaining_ms = None if budget_ms is None else budget_ms - (time.perf_counter() - start) * 1000
+        if remaining_ms is None:
+            n_pairs = n_candidates
+        elif self.ms_per_pair:
+            n_pairs = min(n_candidates, int(remaining_ms // self.ms_per_pair))
+        else:
+            n_pairs = min(n_candidates, CROSS_ENCODER_FIRST_PASS_PAIRS) if remaining_ms > 0 else 0
+        if n_pairs < 2:
+            # Оценка могла устареть (например, после медленного первого прохода): понемногу
+            # снижаем её, чтобы модель снова попробовали, а не отключили навсегда
+            if self.ms_per_pair:
+                self.ms_per_pair *= 0.9
+            logger.info(f"Бюджет переранжирования исчерпан ({remaining_ms:.0f} мс), используется дешевая оценка.")
+            return RerankedChunks(ranked[:top_k], degraded=True)
+
+        # Шаг 3: один батчевый проход модели по лучшим кандидатам
+        pass_start = time.perf_counter()
+        try:
+            scores = get_cross_encoder().predict(
+                [(question, chunk['text']) for chunk in ranked[:n_pairs]],
+                batch_size=n_pairs,
+                show_progress_bar=False,
+            )
+        except Exception as e:
+            logger.warning(f"Cross-encoder не отработал, используется дешевая оценка: {e}")
+            return RerankedChunks(ranked[:top_k], degraded=True)
+        pass_ms = (time.perf_counter() - pass_start) * 1000
+        per_pair = pass_ms / n_pairs
+        self.ms_per_pair = per_pair if self.ms_per_pair is None else 0.8 * self.ms_per_pair + 0.2 * per_pair
+
+        rescored = [ranked[i] for i in np.argsort(-np.asarray(scores), kind="stable")]
+        logger.debug(f"Cross-encoder: {n_pairs} из {n_candidates} пар за {pass_ms:.0f} мс")
+        return RerankedChunks((rescored + ranked[n_pairs:])[:top_k], degraded=n_pairs < n_candidates)
+
+
+# Доступные переранжировщики: имя -> функция (chunks, question, top_k)
+RERANKERS: Dict[str, Callable[[List[Dict[str, str]], str, int], List[Dict[str, str]]]] = {
+    "tfidf": rerank_by_tfidf,
+    "cross_encoder": CrossEncoderReranker(),
+    "none": keep_order,
+}
+
+
+def rerank(
+    chunks: List[Dict[str, str]],
+    question: str,
+    top_k: int,
+    reranker: Union[str, Callable, None] = None,
+    deadline: Optional[float] = None,
+) -> List[Dict[str, str]]:
+    """
+    Переранжирует чанки выбранным переранжировщиком.
+
+    Args:
+        chunks: Кандидаты.
+        question: Текст запроса.
+        top_k: Сколько чанков вернуть.
+        reranker: Имя переранжировщика из RERANKERS или сам переранжировщик;
+            по умолчанию settings.RERANKER.
+        deadline: Дедлайн запроса; учитывает его только cross-encoder.
+
+    Returns:
+        Переранжированные чанки.
+    """
+    rerank_fn = reranker if callable(reranker) else RERANKERS[reranker or settings.RERANKER]
+    if isinstance(rerank_fn, CrossEncoderReranker):
+        return rerank_fn(chunks, question, top_k, deadline=deadline)
+    return rerank_fn(chunks, question, top_k)
@@ -1,37 +1,59 @@
 # Создание и настройка графа конвейера
 from langgraph.graph import StateGraph
 
-from rag.pipeline.nodes import input_node, build_prompt_node, search_chunks_node, generate_letter_node, output_node
+from rag.pipeline.nodes import (
+    input_node,
+    rewrite_query_node,
+    split_query_node,
+    fan_out_segments,
+    search_chunks_node,
+    merge_chunks_node,
+    build_prompt_node,
+    generate_letter_node,
+    remember_node,
+    output_node,
+)
 from rag.pipeline.types import LetterState
 graph = StateGraph(LetterState)
 
 """
 Граф для обработки конвейера генерации ответа на вопрос.
 
-Состоит из узлов: input, search, prompt, generate, output.
+Состоит из узлов: input, rewrite, split, search, merge, prompt, generate, remember, output.
+Узел search запускается параллельно для каждого сегмента вопроса, результаты
+объединяются в merge.
 Каждый узел обновляет состояние LetterState, добавляя данные или возвращая итоговый ответ.
 """
 
 # Добавление узлов в граф
 graph.add_node("input", input_node)
+graph.add_node("rewrite", rewrite_query_node)
+graph.add_node("split", split_query_node)
 graph.add_node("search", search_chunks_node)
+graph.add_node("merge", merge_chunks_node)
 graph.add_node("prompt", build_prompt_node)
 graph.add_node("generate", generate_letter_node)
+graph.add_node("remember", remember_node)
 graph.add_node("output", output_node)
 
 # Установка точки входа
 graph.set_entry_point("input")
 
 # Добавление связей между узлами
-graph.add_edge("input", "search")
-graph.add_edge("search", "prompt")
+graph.add_edge("input", "rewrite")
+graph.add_edge("rewrite", "split")
+graph.add_conditional_edges("split", fan_out_segments, ["search", "merge"])
+graph.add_edge("search", "merge")
+graph.add_edge("merge", "prompt")
 graph.add_edge("prompt", "generate")
-graph.add_edge("generate", "output")
+graph.add_edge("generate", "remember")
+graph.add_edge("remember", "output")
 
 # Установка точки выхода
 graph.set_finish_point("output")
 
-# Компиляция графа в исполняемый конвейер
+# Компиляция графа в исполняемый конвейер (без сохранения состояния между запросами;
+# сессионный вариант с чекпойнтером собирается в rag.pipeline.sessions)
 chain = graph.compile()
 """
 Скомпилированный конвейер для генерации ответа на вопрос.
@@ -1,7 +1,8 @@
 import os
+import re
 from pathlib import Path
 from typing import List
-from rag.pipeline.types import Chunk
+from rag.pipeline.types import Chunk, Turn
 
 # Формируем путь к файлу шаблона относительно текущего скрипта
 PROMPT_PATH = Path(os.path.join(os.path.dirname(__file__), 'prompt_template.txt'))
@@ -66,6 +67,9 @@ def attach_links(answer: str, docs: List[Chunk]) -> str:
     """
     Добавляет Markdown-ссылки в ответ, заменяя нумерацию [i] на [i](source).
 
+    Ссылками становятся только http(s)-источники: локальные документы без
+    DOCUMENTS_PUBLIC_URL остаются номером без ссылки.
+
     Аргументы:
         answer (str): Текст ответа, содержащий нумерацию вида [i].
         docs (List[Chunk]): Список словарей с ключами 'text' и 'source'.
@@ -84,7 +88,318 @@ def attach_links(answer: str, docs: List[Chunk]) -> str:
     result = answer
     for i, doc in enumerate(docs, 1):
         source = doc.get('source', '').strip()
-        if source:
+        if source.startswith(('http://', 'https://')):
             result = result.replace(f'[{i}]', f'[{i}]({source})')
 
-    return result
\ No newline at end of file
+    return result
+
+
+# Явные признаки уточняющего вопроса: связка в начале («а для банков?», «и сколько это стоит?»)
+# или голый предложный оборот без сказуемого («для банков?»)
+FOLLOW_UP_CONJUNCTIONS = ('а', 'и')
+FOLLOW_UP_PREPOSITION_MAX_WORDS = 3
+
+
+def is_follow_up(question: str) -> bool:
+    """
+    Эвристически определяет, является ли вопрос уточнением предыдущего.
+
+    Короткий вопрос сам по себе уточнением не считается: «Кто вы?» или
+    «Что такое RAG?» самостоятельны и переписываться не должны.
+
+    Аргументы:
+        question (str): Текст вопроса.
+
+    Возвращает:
+        bool: True, если вопрос начинается со связки «а»/«и» или состоит
+            из одного предложного оборота.
+
+    Пример:
+        >>> [is_follow_up(q) for q in ('а для банков?', 'для страховых?', 'Кто вы?', 'Сколько стоит бот?')]
+        [True, True, False, False]
+    """
+    words = re.findall(r'\w+', question.lower())
+    if not words:
+        return False
+    if words[0] in FOLLOW_UP_CONJUNCTIONS:
+        return True
+    return (
+        words[0] in SEGMENT_PREPOSITIONS
+        and len(words) <= FOLLOW_UP_PREPOSITION_MAX_WORDS
+        and not any(word in SEGMENT_QUESTION_WORDS for word in words)
+    )
+
+
+def rewrite_follow_up(question: str, history: List[Turn]) -> str:
+    """
+    Превращает уточняющий вопрос в самостоятельный запрос без обращения к LLM.
+
+    Уточнение дописывается к самостоятельному запросу предыдущей реплики, а не
+    к ее исходному тексту, поэтому цепочка уточнений не теряет тему.
+
+    Аргументы:
+        question (str): Уточняющий вопрос (например, "а для банков?").
+        history (List[Turn]): История сессии.
+
+    Возвращает:
+        str: Предыдущий запрос, дополненный текущим, или исходный вопрос без истории.
+
+    Пример:
+        >>> history = [{'question': 'а для банков?', 'answer': '...', 'search_query': 'Что вы делали для банков'}]
+        >>> rewrite_follow_up('а для страховых?', history)
+        'Что вы делали для страховых'
+    """
+    if not history:
+        return question
+    previous = (history[-1].get('search_query') or history[-1]['question']).strip().rstrip('?.!')
+    current = question.strip().rstrip('?.!')
+    attached = attach_segment_head(previous, current)
+    return attached if attached != strip_conjunction(current) else f'{previous}. {attached}'
+
+
+def format_history(history: List[Turn], summary: str, answer_chars: int = 300) -> str:
+    """
+    Формирует текст истории диалога для промпта.
+
+    Аргументы:
+        history (List[Turn]): Последние реплики сессии.
+        summary (str): Краткое содержание более ранних реплик.
+        answer_chars (int, optional): Сколько символов каждого ответа включать.
+
+    Возвращает:
+        str: История диалога или пометка о начале диалога.
+    """
+    lines = [f'Ранее: {summary}'] if summary else []
+    for turn in history:
+        lines.append(f"Клиент: {turn['question']}")
+        lines.append(f"Ассистент: {turn['answer'][:answer_chars]}")
+    return '\n'.join(lines) if lines else '(начало диалога)'
+
+
+def compact_history(
+    history: List[Turn],
+    summary: str,
+    question: str,
+    answer: str,
+    max_turns: int,
+    max_summary_chars: int,
+    search_query: str = '',
+) -> tuple[List[Turn], str]:
+    """
+    Добавляет реплику в историю и сворачивает вытесненные реплики в краткое содержание.
+
+    Аргументы:
+        history (List[Turn]): Текущая история.
+        summary (str): Текущее краткое содержание.
+        question (str): Новый вопрос.
+        answer (str): Ответ на него.
+        max_turns (int): Сколько последних реплик хранить целиком.
+        max_summary_chars (int): Предельная длина краткого содержания.
+        search_query (str, optional): Самостоятельный запрос, в который был
+            переписан вопрос; по умолчанию — сам вопрос.
+
+    Возвращает:
+        tuple[List[Turn], str]: Новая история и новое краткое содержание.
+    """
+    history = [*history, {'question': question, 'answer': answer, 'search_query': search_query or question}]
+    overflow, history = history[:-max_turns], history[-max_turns:]
+    if overflow:
+        folded = ' '.join(
+            f"{turn['question'].strip()} — {turn['answer'].strip()[:120]}" for turn in overflow
+        )
+        summary = f'{summary} {folded}'.strip()
+        # Сохраняем самое свежее содержание, отрезая начало
+        summary = summary[-max_summary_chars:]
+    return history, summary
+
+
+def merge_chunk_pool(pool: List[Chunk], chunks: List[Chunk], limit: int) -> List[Chunk]:
+    """
+    Добавляет свежие чанки в пул сессии без дубликатов, оставляя не больше limit самых новых.
+
+    Аргументы:
+        pool (List[Chunk]): Текущий пул чанков сессии.
+        chunks (List[Chunk]): Чанки, найденные в текущей реплике.
+        limit (int): Максимальный размер пула.
+
+    Возвращает:
+        List[Chunk]: Обновленный пул.
+    """
+    seen = set()
+    merged: List[Chunk] = []
+    for chunk in [*chunks, *pool]:
+        key = chunk['text']
+        if key not in seen:
+            seen.add(key)
+            merged.append(chunk)
+    return merged[:limit]
+
+
+# Предлоги, с которых начинаются сегменты вида «... и для логистики»
+SEGMENT_PREPOSITIONS = ('для', 'по', 'в', 'во', 'на', 'о', 'об', 'про', 'с', 'со')
+# Вопросительные слова, с которых начинается самостоятельный подвопрос
+SEGMENT_QUESTION_WORDS = ('как', 'какие', 'какой', 'какая', 'сколько', 'что', 'чем', 'когда', 'где', 'почему', 'зачем')
+# Служебные слова и частые глаголы вопросов: они не образуют собственной именной группы сегмента
+SEGMENT_FUNCTION_WORDS = {
+    'а', 'и', 'также', 'еще', 'ещё', 'вы', 'вас', 'вам', 'мы', 'нас', 'это', 'этого', 'этом', 'они', 'их',
+    'он', 'она', 'оно', 'там', 'тут', 'так', 'же', 'ли', 'у', 'есть', 'был', 'была', 'было', 'были', 'можно',
+    'стоит', 'стоило', 'стоят', 'делали', 'делаете', 'сделали', 'работали', 'работаете', 'использовали', 'используете',
+}
+
+
+def strip_conjunction(segment: str) -> str:
+    """Убирает связку «и»/«а» в начале сегмента."""
+    return re.sub(r'^(?:а|и)\s+', '', segment.strip(), flags=re.IGNORECASE)
+
+
+def attach_segment_head(head: str, segment: str) -> str:
+    """
+    Дополняет сегмент, начинающийся с предлога, началом ведущего сегмента.
+
+    Аргументы:
+        head (str): Ведущий сегмент (например, «что вы сделали для ритейла»).
+        segment (str): Сегмент-хвост (например, «а для логистики»).
+
+    Возвращает:
+        str: Самостоятельный сегмент («что вы сделали для логистики») или
+            сегмент без начальной связки, если дополнить нечем.
+    """
+    segment = strip_conjunction(segment)
+    words = segment.split()
+    head_words = head.split()
+    lowered = [word.lower() for word in head_words]
+    if words and words[0].lower() in SEGMENT_PREPOSITIONS and words[0].lower() in lowered:
+        return ' '.join(head_words[:lowered.index(words[0].lower())] + words)
+    return segment
+
+
+def has_noun_phrase(segment: str) -> bool:
+    """Проверяет, есть ли в сегменте собственная именная группа, а не только связки и местоимения."""
+    return any(
+        len(word) > 2 and word not in SEGMENT_FUNCTION_WORDS
+        and word not in SEGMENT_PREPOSITIONS and word not in SEGMENT_QUESTION_WORDS
+        for word in re.findall(r'\w+', segment.lower())
+    )
+
+
+def split_into_segments(question: str, max_segments: int = 4) -> List[str]:
+    """
+    Разбивает составной вопрос на самостоятельные сегменты для поиска.
+
+    Вопрос делится по концам предложений и по сочинительным связкам («и», «а»,
+    «а также») перед предлогом или вопросительным словом; запятая без связки
+    («Расскажите, что вы делали для банков?») вопрос не делит. Сегмент без
+    собственной именной группы («и как?») присоединяется к предыдущему.
+    Сегмент, начинающийся с предлога («для логистики»), дополняется началом
+    первого сегмента («что вы сделали для логистики»).
+
+    Аргументы:
+        question (str): Вопрос пользователя.
+        max_segments (int, optional): Максимальное число сегментов; лишние
+            присоединяются к последнему.
+
+    Возвращает:
+        List[str]: Сегменты в порядке следования; для простого вопроса — сам вопрос.
+
+    Пример:
+        >>> split_into_segments('Что вы сделали для ритейла и для логистики?')
+        ['Что вы сделали для ритейла', 'Что вы сделали для логистики']
+        >>> split_into_segments('Какие проекты были в ритейле, в которых использовали CV?')
+        ['Какие проекты были в ритейле, в которых использовали CV?']
+    """
+    text = ' '.join(question.split())
+    starts = '|'.join(SEGMENT_PREPOSITIONS + SEGMENT_QUESTION_WORDS)
+    parts = re.split(r'[?;!]+\s*|\.\s+', text)
+    pieces: List[str] = []
+    for part in parts:
+        pieces.extend(
+            re.split(
+                rf',?\s+(?:и|а|а также|а еще|а ещё)\s+(?=(?:{starts})\b)',
+                part,
+                flags=re.IGNORECASE,
+            )
+        )
+
+    segments: List[str] = []
+    for piece in pieces:
+        piece = piece.strip(' ,.')
+        if not re.search(r'\w', piece):
+            continue
+        if segments and not has_noun_phrase(piece):
+            # Подвопрос без своей темы («и как?») уточняет предыдущий сегмент
+            segments[-1] = f'{segments[-1]} и {strip_conjunction(piece)}'
+            continue
+        segments.append(piece)
+    if len(segments) <= 1:
+        return [text]
+
+    # Досоставляем сегменты-«хвосты» началом первого сегмента
+    segments = [segments[0]] + [attach_segment_head(segments[0], segment) for segment in segments[1:]]
+
+    if len(segments) > max_segments:
+        segments = segments[:max_segments - 1] + [' '.join(segments[max_segments - 1:])]
+    return segments
+
+
+def interleave_chunks(results: List[List[Chunk]], limit: int) -> List[Chunk]:
+    """
+    Объединяет результаты поиска по сегментам, чередуя их и удаляя дубликаты.
+
+    Аргументы:
+        results (List[List[Chunk]]): Ранжированные чанки каждого сегмента.
+        limit (int): Максимальное число чанков в итоговом списке.
+
+    Возвращает:
+        List[Chunk]: Чанки, где каждый сегмент представлен своими лучшими результатами.
+    """
+    merged: List[Chunk] = []
+    seen = set()
+    for rank in range(max((len(chunks) for chunks in results), default=0)):
+        for chunks in results:
+            if rank < len(chunks) and chunks[rank]['text'] not in seen:
+                seen.add(chunks[rank]['text'])
+                merged.append(chunks[rank])
+    return merged[:limit]
+
+
+def extractive_answer(question: str, docs: List[Chunk], max_sentences: int = 4) -> str:
+    """
+    Собирает быстрый ответ из предложений найденных фрагментов без обращения к LLM.
+
+    Предложения ранжируются по пересечению основ слов с вопросом; каждое
+    сопровождается ссылкой [i] на свой фрагмент, которую attach_links
+    превращает в Markdown-ссылку.
+
+    Аргументы:
+        question (str): Вопрос пользователя.
+        docs (List[Chunk]): Переранжированные фрагменты в порядке релевантности.
+        max_sentences (int, optional): Сколько предложений включить в ответ.
+
+    Возвращает:
+        str: Ответ с нумерацией [i] или пустая строка, если фрагментов нет.
+    """
+    if not docs:
+        return ''
+
+    def stems(text: str) -> set:
+        return {word[:5] for word in re.findall(r'\w+', text.lower()) if len(word) > 2}
+
+    question_stems = stems(question)
+    candidates = []
+    for i, doc in enumerate(docs, 1):
+        sentences = re.split(r'(?<=[.!?])\s+', doc['text'].strip())
+        for position, sentence in enumerate(sentences):
+            if len(sentence) < 30:
+                continue
+            overlap = len(question_stems & stems(sentence))
+            # При равном пересечении выше ранг фрагмента и ближе к началу
+            candidates.append((-overlap, i, position, sentence.strip()))
+
+    chosen = sorted(candidates)[:max_sentences]
+    if not chosen:
+        chosen = [(0, i, 0, doc['text'].strip()[:300]) for i, doc in enumerate(docs[:max_sentences], 1)]
+
+    # Сохраняем порядок документов и предложений внутри них
+    chosen.sort(key=lambda item: (item[1], item[2]))
+    lines = [f'{sentence} [{index}]' for _, index, _, sentence in chosen]
+    return 'Кратко по материалам наших кейсов:\n\n' + '\n'.join(f'- {line}' for line in lines)
@@ -1,69 +1,279 @@
 
+import asyncio
 import os
 import time
+from typing import List
 
-import psutil
-from sentence_transformers import SentenceTransformer
+import numpy as np
+from langgraph.types import Send
 
-from rag.pipeline.chunk_selector import find_relevant_chunks
+from rag.pipeline.chunk_selector import find_relevant_chunks, rerank, search_budget
 from rag.openai_client import client
-from rag.pipeline.helpers import build_context, load_prompt_template, attach_links
-from rag.pipeline.types import LetterState, Chunk
+from rag.pipeline.helpers import (
+    attach_links,
+    build_context,
+    compact_history,
+    extractive_answer,
+    format_history,
+    is_follow_up,
+    load_prompt_template,
+    merge_chunk_pool,
+    rewrite_follow_up,
+    interleave_chunks,
+    split_into_segments,
+)
+from rag.pipeline.resources import get_collection, get_embedder
+from rag.pipeline.retrieval_cache import retrieval_cache
+from rag.pipeline.types import LetterState, Chunk, SegmentSearch
 from settings import settings
-from utils.chroma_client import get_chroma_client
-from utils.logger import setup_logger
+from utils.logger import log_memory, log_payload, setup_logger
 
 # Инициализация логгера
 logger = setup_logger("letter_pipeline")
 
-# Глобальная инициализация клиента ChromaDB и модели эмбеддингов
-chroma_client = get_chroma_client()
-chroma_collection = chroma_client.get_or_create_collection(settings.CHROMA_COLLECTION_NAME)
-embedder = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
+# Модель эмбеддингов и коллекция ChromaDB берутся из rag.pipeline.resources:
+# модель общая для воркеров, коллекция открывается в каждом процессе после fork()
 openai_client = client
 
 # Определение узлов конвейера
 async def input_node(state: LetterState) -> LetterState:
     """
-    Принимает начальное состояние и возвращает его без изменений.
+    Принимает новый вопрос и сбрасывает поля, относящиеся к одному запросу.
+
+    В сессии состояние хранится в чекпойнте между репликами, поэтому запрос,
+    сегменты, чанки, промпт и ответ предыдущего вопроса нужно сбросить явно.
+    История, краткое содержание и пул чанков сессии сохраняются.
 
     Args:
         state: Состояние конвейера с пользовательскими данными.
 
     Returns:
-        То же состояние без изменений.
+        Частичное обновление состояния со сброшенными полями запроса.
     """
-    # Возврат входного состояния
-    return state
+    return {
+        "search_query": "",
+        "segments": [],
+        "segment_chunks": None,
+        "chunks": [],
+        "prompt": "",
+        "answer": "",
+    }
 
 
-async def search_chunks_node(state: LetterState) -> LetterState:
+async def rewrite_query_node(state: LetterState) -> LetterState:
     """
-    Выполняет семантический поиск релевантных чанков по сегменту.
+    Переписывает уточняющий вопрос в самостоятельный запрос для поиска.
+
+    Переписывание выполняется, только если в сессии есть история и вопрос
+    похож на уточнение; иначе запросом для поиска служит сам вопрос.
 
     Args:
-        state: Состояние конвейера с пользовательскими данными.
+        state: Состояние конвейера с вопросом и историей сессии.
+
+    Returns:
+        Обновленное состояние с полем search_query.
+    """
+    question = state.get("user_input")
+    history = state.get("history") or []
+    if not isinstance(question, str):
+        return {"search_query": ""}
+    if not history or not is_follow_up(question):
+        return {"search_query": question}
+
+    search_query = rewrite_follow_up(question, history)
+    if settings.SESSION_LLM_REWRITE:
+        try:
+            response = await asyncio.wait_for(
+                openai_client.chat.completions.create(
+                    model=settings.SESSION_REWRITE_MODEL,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": "Перепиши последний вопрос клиента в самостоятельный поисковый запрос. "
+                                       "Верни только запрос.",
+                        },
+                        {
+                            "role": "user",
+                            "content": f"{format_history(history, state.get('summary', ''))}\n\n"
+                                       f"Последний вопрос: {question}",
+                        },
+                    ],
+                    temperature=0,
+                ),
+                timeout=settings.SESSION_REWRITE_TIMEOUT_S,
+            )
+            rewritten = response.choices[0].message.content.strip() if response.choices else ""
+            search_query = rewritten or search_query
+        except Exception as e:
+            logger.warning(f"LLM-переписывание запроса не удалось, используется эвристика: {e}")
+
+    logger.info(f"Уточняющий вопрос '{question}' переписан в '{search_query}'")
+    return {"search_query": search_query}
+
+
+async def split_query_node(state: LetterState) -> LetterState:
+    """
+    Делит запрос на сегменты и батчем вычисляет их эмбеддинги.
+
+    Эмбеддинги всех сегментов считаются одним проходом модели, поэтому
+    параллельные ветки поиска выполняют только запросы к Chroma.
+
+    Args:
+        state: Состояние конвейера с запросом для поиска.
 
     Returns:
-        Обновленное состояние с добавленным списком чанков.
+        Частичное обновление состояния с сегментами.
     """
-    # Проверка наличия и корректности сегмента
-    if not isinstance(state.get("user_input"), str):
+    query = state.get("search_query") or state.get("user_input")
+    if not isinstance(query, str) or not query.strip():
         logger.error("user_input отсутствует или некорректен.")
-        return {**state, "chunks": []}
+        return {"segments": []}
+
+    segments = split_into_segments(query, max_segments=settings.MAX_SEGMENTS)
+    if settings.SEGMENT_LLM_SPLIT and len(segments) == 1:
+        segments = await llm_split_segments(query) or segments
+    if len(segments) > 1:
+        logger.info(f"Вопрос разбит на сегменты: {segments}")
+
+    return {"segments": segments}
+
+
+async def llm_split_segments(query: str) -> List[str]:
+    """
+    Делит составной вопрос на подвопросы с помощью LLM.
+
+    Args:
+        query: Запрос для поиска.
+
+    Returns:
+        Список подвопросов или пустой список при ошибке.
+    """
+    try:
+        response = await asyncio.wait_for(
+            openai_client.chat.completions.create(
+                model=settings.SESSION_REWRITE_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "Раздели вопрос клиента на самостоятельные подвопросы, "
+                                   "по одному в строке. Простой вопрос верни как есть.",
+                    },
+                    {"role": "user", "content": query},
+                ],
+                temperature=0,
+            ),
+            timeout=settings.SESSION_REWRITE_TIMEOUT_S,
+        )
+        content = response.choices[0].message.content if response.choices else ""
+        lines = [line.strip(" -•\t") for line in content.splitlines() if line.strip(" -•\t")]
+        return lines[:settings.MAX_SEGMENTS]
+    except Exception as e:
+        logger.warning(f"LLM-разбиение вопроса не удалось: {e}")
+        return []
+
+
+async def fan_out_segments(state: LetterState) -> List[Send]:
+    """
+    Распределяет сегменты по параллельным веткам поиска.
+
+    Args:
+        state: Состояние конвейера с сегментами.
+
+    Returns:
+        Задания Send для узла search — по одному на сегмент; если бюджет
+        времени исчерпан, поиск пропускается и управление сразу переходит к merge.
+    """
+    segments = state.get("segments") or []
+    if not segments:
+        return [Send("merge", state)]
+
+    budget = search_budget(state.get("deadline"))
+    if budget is not None and budget <= 0:
+        logger.warning("Бюджет времени исчерпан до поиска, ответ строится без чанков.")
+        return [Send("merge", state)]
+
+    # Эмбеддинги всех сегментов одним батчем (с учетом кэша запросов)
+    embedder = get_embedder()
+    try:
+        embeddings = await asyncio.wait_for(
+            asyncio.to_thread(
+                retrieval_cache.get_embeddings,
+                segments,
+                lambda batch: embedder.encode(batch, normalize_embeddings=True),
+            ),
+            timeout=budget,
+        )
+    except asyncio.TimeoutError:
+        logger.warning("Эмбеддинги сегментов не уложились в дедлайн, поиск пропущен.")
+        return [Send("merge", state)]
+    return [
+        Send(
+            "search",
+            {
+                "segment": segment,
+                "embedding": embedding.tolist(),
+                "filters": state.get("filters") or {},
+                "deadline": state.get("deadline") or 0.0,
+            },
+        )
+        for segment, embedding in zip(segments, embeddings)
+    ]
+
+
+async def search_chunks_node(task: SegmentSearch) -> LetterState:
+    """
+    Выполняет семантический поиск релевантных чанков по одному сегменту.
+
+    Запускается параллельно для каждого сегмента; поиск асинхронный,
+    поэтому ветки не ждут друг друга.
 
-    # Извлечение сегмента и поиск чанков
-    segment = state["user_input"]
-    chunks = find_relevant_chunks(segment, chroma_collection, embedder)
+    Args:
+        task: Сегмент, его эмбеддинг, фильтры и дедлайн запроса.
 
-    # Логирование потребления памяти
-    logger.info(
-        f"Потребление памяти после поиска чанков: "
-        f"{psutil.Process().memory_info().rss / 1024**2:.2f} МБ"
+    Returns:
+        Частичное обновление состояния с результатами ветки.
+    """
+    chunks = await find_relevant_chunks(
+        task["segment"],
+        get_collection(),
+        get_embedder(),
+        filters=task.get("filters"),
+        query_embedding=np.asarray(task["embedding"], dtype=np.float32),
+        deadline=task.get("deadline"),
     )
+    return {"segment_chunks": [chunks]}
+
+
+async def merge_chunks_node(state: LetterState) -> LetterState:
+    """
+    Объединяет результаты веток поиска и удаляет дубликаты.
+
+    Args:
+        state: Состояние конвейера с результатами поиска по сегментам.
+
+    Returns:
+        Обновленное состояние с итоговым списком чанков.
+    """
+    results = state.get("segment_chunks") or []
+    segment = state.get("search_query") or state.get("user_input") or ""
+
+    # Каждый сегмент получает место в контексте, итог ограничен MAX_CONTEXT_CHUNKS
+    limit = settings.MAX_CONTEXT_CHUNKS if len(results) > 1 else max((len(r) for r in results), default=0)
+    chunks = interleave_chunks(results, limit)
+
+    # Чанки, найденные ранее в сессии, конкурируют со свежими за место в контексте
+    pool = [chunk for chunk in state.get("session_chunks") or [] if chunk not in chunks]
+    if pool and segment:
+        try:
+            chunks = rerank(chunks + pool, segment, max(len(chunks), 3), deadline=state.get("deadline")) or chunks
+        except ValueError as e:
+            logger.warning(f"Не удалось переранжировать теплый пул сессии: {e}")
+
+    # Логирование потребления памяти (только на DEBUG)
+    log_memory(logger, "после поиска чанков")
 
     # Обновление состояния с найденными чанками
-    return {**state, "chunks": chunks}
+    return {"chunks": chunks}
 
 
 async def build_prompt_node(state: LetterState) -> LetterState:
@@ -79,7 +289,7 @@ async def build_prompt_node(state: LetterState) -> LetterState:
     # Проверка наличия необходимых данных
     if not isinstance(state.get("user_input"), str) or not state.get("chunks"):
         logger.error("Отсутствуют необходимые данные: user_input или chunks.")
-        return {**state, "prompt": ""}
+        return {"prompt": ""}
 
     user_input = state["user_input"]
     chunks = state["chunks"]
@@ -91,20 +301,44 @@ async def build_prompt_node(state: LetterState) -> LetterState:
     template = load_prompt_template()
 
     try:
-        prompt = template.format(question=user_input, chunks=context)
+        prompt = template.format(
+            question=user_input,
+            chunks=context,
+            history=format_history(state.get("history") or [], state.get("summary", "")),
+        )
     except KeyError as e:
         logger.error(f"Ошибка форматирования шаблона: отсутствует ключ {e}")
-        return {**state, "prompt": ""}
+        return {"prompt": ""}
 
     # Обновление состояния с промптом
-    logger.info(f"prompt: {prompt}")
-    return {**state, "prompt": prompt}
+    log_payload(logger, "prompt", prompt)
+    return {"prompt": prompt}
+
+
+def fallback_answer(state: LetterState, reason: str) -> LetterState:
+    """
+    Возвращает быстрый экстрактивный ответ по найденным чанкам вместо ответа LLM.
+
+    Args:
+        state: Состояние конвейера с вопросом и чанками.
+        reason: Причина перехода на запасной ответ (для лога).
+
+    Returns:
+        Обновленное состояние с экстрактивным ответом или пустым ответом без чанков.
+    """
+    chunks = state.get("chunks") or []
+    answer = extractive_answer(state.get("user_input") or "", chunks)
+    logger.warning(f"Запасной экстрактивный ответ ({reason}), фрагментов: {len(chunks)}")
+    return {"answer": attach_links(answer, chunks) if answer else ""}
 
 
 async def generate_letter_node(state: LetterState) -> LetterState:
     """
     Генерирует деловое письмо с помощью OpenAI API на основе промпта.
 
+    Генерация ограничена оставшимся временем до дедлайна запроса; если бюджет
+    исчерпан или API недоступно, возвращается экстрактивный ответ по чанкам.
+
     Args:
         state: Состояние конвейера с промптом.
 
@@ -114,44 +348,85 @@ async def generate_letter_node(state: LetterState) -> LetterState:
     # Проверка наличия промпта
     if not state.get("prompt"):
         logger.error("Отсутствует промпт для генерации письма.")
-        return {**state, "answer": ""}
+        return fallback_answer(state, "нет промпта")
+
+    # Бюджет времени на генерацию с запасом на запасной ответ
+    timeout = None
+    if state.get("deadline"):
+        timeout = state["deadline"] - time.time() - settings.GENERATION_RESERVE_S
+        if timeout <= 0:
+            return fallback_answer(state, "бюджет времени исчерпан до генерации")
 
     # Генерация письма через асинхронный OpenAI API
     try:
         start_time = time.perf_counter()
 
         logger.info("Отправляем запрос в OpenAI API")
-        response = await openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Ты — AI-эксперт по проектам компании EORA.",
-                },
-                {"role": "user", "content": state["prompt"]},
-            ],
-            temperature=0.7,
+        response = await asyncio.wait_for(
+            openai_client.chat.completions.create(
+                model="gpt-4o",
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "Ты — AI-эксперт по проектам компании EORA.",
+                    },
+                    {"role": "user", "content": state["prompt"]},
+                ],
+                temperature=0.7,
+            ),
+            timeout=timeout,
         )
         content = response.choices[0].message.content if response.choices else ""
+        if not content:
+            return fallback_answer(state, "пустой ответ модели")
+
         content_with_links = attach_links(content, state["chunks"])
         elapsed = time.perf_counter() - start_time
-        logger.info(f"📨 Ответ: {content_with_links}")
+        log_payload(logger, "📨 Ответ", content_with_links)
 
         # Логгирование времени генерации
         logger.info(f"📨 Ответ успешно сгенерирован за {elapsed:.2f} секунд.")
 
-        # Логирование потребления памяти
-        logger.info(
-            f"Потребление памяти после генерации письма: "
-            f"{psutil.Process().memory_info().rss / 1024**2:.2f} МБ"
-        )
+        # Логирование потребления памяти (только на DEBUG)
+        log_memory(logger, "после генерации письма")
 
         # Обновление состояния с сгенерированным ответом
-        return {**state, "answer": content_with_links}
+        return {"answer": content_with_links}
 
+    except asyncio.TimeoutError:
+        return fallback_answer(state, f"генерация не уложилась в {timeout:.2f} с")
     except Exception as e:
         logger.error(f"Ошибка при генерации письма: {e}")
-        return {**state, "answer": ""}
+        return fallback_answer(state, "ошибка API")
+
+
+async def remember_node(state: LetterState) -> LetterState:
+    """
+    Сохраняет реплику в ограниченной истории сессии и пополняет теплый пул чанков.
+
+    Args:
+        state: Состояние конвейера с вопросом, чанками и ответом.
+
+    Returns:
+        Обновленное состояние с историей, кратким содержанием и пулом чанков.
+    """
+    # Неудачные реплики в историю не попадают
+    if not state.get("answer") or not isinstance(state.get("user_input"), str):
+        return {}
+
+    history, summary = compact_history(
+        state.get("history") or [],
+        state.get("summary", ""),
+        state["user_input"],
+        state["answer"],
+        max_turns=settings.SESSION_MAX_TURNS,
+        max_summary_chars=settings.SESSION_SUMMARY_MAX_CHARS,
+        search_query=state.get("search_query") or "",
+    )
+    session_chunks = merge_chunk_pool(
+        state.get("session_chunks") or [], state.get("chunks") or [], settings.SESSION_CHUNK_POOL
+    )
+    return {"history": history, "summary": summary, "session_chunks": session_chunks}
 
 
 async def output_node(state: LetterState) -> LetterState:
@@ -167,7 +442,7 @@ async def output_node(state: LetterState) -> LetterState:
     # Проверка наличия письма
     if not state.get("answer"):
         logger.warning("Ответ отсутствует в состоянии.")
-        return {**state, "answer": ""}
+        return {"answer": ""}
 
-    # Возврат состояния для совместимости с LangGraph
-    return state
\ No newline at end of file
+    # Ответ уже в состоянии, обновлять нечего
+    return {}
\ No newline at end of file
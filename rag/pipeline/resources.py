@@ -0,0 +1,260 @@
+import gc
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict
+
+from chromadb.api.models import Collection
+from sentence_transformers import CrossEncoder, SentenceTransformer
+
+from data_ingestion.docstore import DocStore, docstore_version
+from data_ingestion.projection import PCAProjection
+from settings import settings
+from utils.chroma_client import (
+    evict_async_collections,
+    get_chroma_client,
+    get_chroma_collection,
+    get_collection_projection_path,
+)
+from utils.logger import setup_logger
+from utils.memory_profiler import MB, path_size_mb
+
+# Инициализация логгера
+logger = setup_logger("resources")
+
+# Коллекция открывается лениво и отдельно в каждом процессе:
+# SQLite-соединения Chroma нельзя переносить через fork()
+_collection: Collection | None = None
+_collection_pid: int | None = None
+_collection_lock = threading.Lock()
+
+# Докстор открывается через mmap и переоткрывается, когда коллекция начинает ссылаться на другую версию
+_docstore: DocStore | None = None
+_docstore_lock = threading.Lock()
+
+# Замененный докстор закрывается с задержкой: его могут дочитывать конкурентные запросы
+DOCSTORE_RETIRE_GRACE_S = 60.0
+
+# Проекция эмбеддингов запросов, если коллекция построена в пониженной размерности
+_projection: PCAProjection | None = None
+_projection_path: Path | None = None
+_projection_lock = threading.Lock()
+
+# Фоновая загрузка cross-encoder, чтобы первый запрос не ждал модель
+_cross_encoder_warmup: threading.Thread | None = None
+_cross_encoder_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def get_embedder() -> SentenceTransformer:
+    """
+    Возвращает общую для процесса модель эмбеддингов.
+
+    При запуске через gunicorn с preload модель загружается в мастер-процессе
+    до fork(), и воркеры разделяют её веса через copy-on-write.
+
+    Returns:
+        Загруженная модель SentenceTransformer в режиме инференса.
+    """
+    embedder = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
+    embedder.eval()
+    return embedder
+
+
+@lru_cache(maxsize=1)
+def get_cross_encoder() -> CrossEncoder:
+    """
+    Возвращает общую для процесса модель переранжирования (cross-encoder).
+
+    Returns:
+        Загруженная модель CrossEncoder на CPU.
+    """
+    model = CrossEncoder(settings.CROSS_ENCODER_MODEL, max_length=settings.CROSS_ENCODER_MAX_LENGTH, device="cpu")
+    model.model.eval()
+    return model
+
+
+def cross_encoder_ready() -> bool:
+    """
+    Проверяет, загружен ли cross-encoder, и при необходимости запускает загрузку в фоне.
+
+    Returns:
+        True, если модель можно использовать без ожидания загрузки.
+    """
+    global _cross_encoder_warmup
+
+    if get_cross_encoder.cache_info().currsize:
+        return True
+    with _cross_encoder_lock:
+        if _cross_encoder_warmup is None or not _cross_encoder_warmup.is_alive():
+            _cross_encoder_warmup = threading.Thread(target=get_cross_encoder, name="cross-encoder-warmup", daemon=True)
+            _cross_encoder_warmup.start()
+    return False
+
+
+def get_collection() -> Collection:
+    """
+    Возвращает коллекцию ChromaDB, открытую в текущем процессе.
+
+    Если процесс был форкнут после открытия коллекции, клиент создаётся заново.
+
+    Returns:
+        Коллекция ChromaDB для поиска.
+    """
+    global _collection, _collection_pid
+
+    pid = os.getpid()
+    if _collection is None or _collection_pid != pid:
+        with _collection_lock:
+            if _collection is None or _collection_pid != pid:
+                # Пустую коллекцию создает только процесс, которому разрешено наполнить индекс
+                _collection = get_chroma_collection(get_chroma_client(), create=not settings.READ_ONLY_INDEX)
+                _collection_pid = pid
+    return _collection
+
+
+def reset_collection() -> Collection:
+    """
+    Переоткрывает коллекцию, например после пересборки базы знаний.
+
+    Асинхронные коллекции режима http тоже забываются: они привязаны к id
+    прежней коллекции.
+
+    Returns:
+        Заново открытая коллекция ChromaDB.
+    """
+    global _collection
+
+    with _collection_lock:
+        _collection = None
+    evict_async_collections()
+    return get_collection()
+
+
+def get_docstore(version: str | None = None) -> DocStore | None:
+    """
+    Возвращает докстор с полными текстами документов для расширения контекста.
+
+    Args:
+        version: Версия докстора из метаданных опубликованной коллекции: смещения
+            её чанков указывают в тексты именно этой версии. None — коллекция
+            старого формата, открывается последняя опубликованная версия (CURRENT).
+
+    Returns:
+        Открытый докстор или None, если он ещё не создан ингестом.
+    """
+    global _docstore
+
+    requested = version
+    version = version or docstore_version(settings.DOCSTORE_PATH)
+    if version is None:
+        return None
+
+    if _docstore is None or _docstore.version != version:
+        with _docstore_lock:
+            if _docstore is None or _docstore.version != version:
+                try:
+                    fresh = DocStore(settings.DOCSTORE_PATH, requested)
+                except Exception as e:
+                    logger.error(f"Не удалось открыть докстор: {e}")
+                    return _docstore
+                retired, _docstore = _docstore, fresh
+                if retired is not None:
+                    timer = threading.Timer(DOCSTORE_RETIRE_GRACE_S, retired.close)
+                    timer.daemon = True
+                    timer.start()
+    return _docstore
+
+
+def get_projection(collection: Collection | None = None) -> PCAProjection | None:
+    """
+    Возвращает проекцию, которой ингест понизил размерность векторов коллекции.
+
+    Файл проекции указан в метаданных коллекции и публикуется вместе с ней,
+    поэтому запрос к коллекции всегда проецируется её собственной проекцией.
+
+    Args:
+        collection: Коллекция, к которой пойдет запрос; по умолчанию коллекция процесса.
+
+    Returns:
+        Проекция или None, если коллекция хранит исходные эмбеддинги.
+    """
+    global _projection, _projection_path
+
+    collection = collection if collection is not None else get_collection()
+    path = get_collection_projection_path(collection)
+    if path is None or not path.exists():
+        return None
+
+    if _projection is None or _projection_path != path:
+        with _projection_lock:
+            if _projection is None or _projection_path != path:
+                _projection = PCAProjection.load(path)
+                _projection_path = path
+                logger.info(f"Загружена проекция эмбеддингов {_projection.input_dim} -> {_projection.dim}")
+    return _projection
+
+
+def preload_shared_resources() -> None:
+    """
+    Загружает разделяемые ресурсы в мастер-процессе перед fork().
+
+    Загружает модели и замораживает текущие объекты для сборщика мусора,
+    чтобы gc в воркерах не трогал их страницы памяти и не ломал copy-on-write.
+    Коллекция Chroma здесь намеренно не открывается.
+    """
+    get_embedder()
+    if settings.RERANKER == "cross_encoder":
+        get_cross_encoder()
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Разделяемые ресурсы загружены до fork(), заморожено объектов: {gc.get_freeze_count()}")
+
+
+def memory_footprint() -> Dict[str, Any]:
+    """
+    Оценивает память, занятую моделью и индексом в текущем процессе.
+
+    Ресурсы, которые ещё не загружены, не загружаются ради отчета.
+
+    Returns:
+        Размер весов моделей, число векторов и оценка памяти HNSW-индекса,
+        размеры индекса и докстора на диске (докстор читается через mmap,
+        его страницы учитываются в page cache, а не в RSS).
+    """
+    report: Dict[str, Any] = {"model": {"loaded": False}, "index": {"opened": False}}
+
+    if get_embedder.cache_info().currsize:
+        embedder = get_embedder()
+        params = sum(p.numel() * p.element_size() for p in embedder.parameters())
+        buffers = sum(b.numel() * b.element_size() for b in embedder.buffers())
+        report["model"] = {
+            "loaded": True,
+            "name": settings.EMBEDDING_MODEL_NAME,
+            "weights_mb": round((params + buffers) / MB, 1),
+            # При preload веса общие для воркеров (copy-on-write)
+            "shared_after_fork": gc.get_freeze_count() > 0,
+        }
+
+    if get_cross_encoder.cache_info().currsize:
+        reranker = get_cross_encoder().model
+        report["reranker"] = {
+            "name": settings.CROSS_ENCODER_MODEL,
+            "weights_mb": round(sum(p.numel() * p.element_size() for p in reranker.parameters()) / MB, 1),
+        }
+
+    if _collection is not None and _collection_pid == os.getpid():
+        count = _collection.count()
+        projection = get_projection(_collection)
+        dimension = get_embedder().get_sentence_embedding_dimension() if report["model"]["loaded"] else None
+        dimension = projection.dim if projection is not None else dimension
+        report["index"] = {
+            "opened": True,
+            "vectors": count,
+            # float32-векторы HNSW без учета графа связей
+            "hnsw_vectors_mb_estimate": round(count * dimension * 4 / MB, 1) if dimension else None,
+            "chroma_disk_mb": round(path_size_mb(settings.CHROMA_DB_PATH), 1),
+        }
+    report["docstore_disk_mb"] = round(path_size_mb(settings.DOCSTORE_PATH), 1)
+    return report
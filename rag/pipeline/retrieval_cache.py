@@ -0,0 +1,356 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+from chromadb.api.models import Collection
+
+from rag.pipeline.resources import reset_collection
+from settings import settings
+from utils.chroma_client import (
+    get_chroma_client,
+    get_chroma_collection,
+    get_collection_docstore_version,
+    get_collection_version,
+)
+from utils.logger import setup_logger
+from utils.memory_profiler import MB, deep_sizeof, path_size_mb
+
+# Инициализация логгера
+logger = setup_logger("retrieval_cache")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Нормализует вопрос для использования в ключе кэша.
+
+    Аргументы:
+        question (str): Исходный вопрос пользователя.
+
+    Возвращает:
+        str: Вопрос в нижнем регистре, без лишних пробелов и концевой пунктуации.
+    """
+    text = question.lower().replace('ё', 'е')
+    text = ' '.join(text.split())
+    return re.sub(r'^[^\w]+|[^\w]+$', '', text)
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Строит стабильный ключ кэша из произвольных JSON-сериализуемых частей.
+
+    Аргументы:
+        *parts: Части ключа (вопрос, версия коллекции, параметры поиска).
+
+    Возвращает:
+        str: SHA-1 от сериализованных частей.
+    """
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограничением времени жизни записей."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """Возвращает значение или None, если записи нет или она устарела."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Сохраняет значение, вытесняя самые давние записи при переполнении."""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def approx_bytes(self) -> int:
+        """Приблизительный объем памяти, занятой записями."""
+        with self._lock:
+            values = list(self._data.values())
+        return deep_sizeof(values)
+
+
+class SQLiteCacheBackend:
+    """
+    Разделяемый между процессами и репликами кэш на SQLite.
+
+    Играет роль локального заменителя Redis: значения хранятся как байты
+    со временем истечения, устаревшие записи удаляются при чтении.
+    """
+
+    def __init__(self, path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)'
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                return None
+            return row[0]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, time.time() + ttl),
+            )
+
+
+class RetrievalCache:
+    """
+    Кэш детерминированной части поиска: эмбеддингов запросов и итоговых списков чанков.
+
+    Ключ списка чанков включает нормализованный вопрос, параметры поиска и версию
+    коллекции, поэтому после ингеста (смены версии) старые записи перестают находиться.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = settings.RETRIEVAL_CACHE_ENABLED
+        self.ttl = settings.RETRIEVAL_CACHE_TTL_S
+        self._embeddings = TTLCache(settings.RETRIEVAL_CACHE_SIZE, self.ttl)
+        self._chunks = TTLCache(settings.RETRIEVAL_CACHE_SIZE, self.ttl)
+        self._shared: Optional[SQLiteCacheBackend] = None
+        if self.enabled and settings.RETRIEVAL_CACHE_BACKEND == 'sqlite':
+            self._shared = SQLiteCacheBackend(settings.RETRIEVAL_CACHE_PATH)
+
+        self._version: Optional[str] = None
+        # Версия докстора, которую называет прочитанная вместе с _version коллекция
+        self.docstore_version: Optional[str] = None
+        self._collection_id: Optional[str] = None
+        self._version_checked_at = 0.0
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {
+            name: {'hits': 0, 'misses': 0, 'saved_ms': 0.0} for name in ('embeddings', 'chunks')
+        }
+
+    def resolve_collection(self, collection: Collection, force: bool = False) -> Tuple[Collection, str]:
+        """
+        Возвращает актуальную коллекцию и её версию.
+
+        Версия перечитывается не чаще раза в COLLECTION_VERSION_CHECK_S: метаданные
+        объекта коллекции в памяти не обновляются после ингеста в другом процессе,
+        поэтому коллекция запрашивается у клиента заново. Если за это время опубликована
+        новая коллекция (полный ингест, импорт снапшота), старый объект ссылается на
+        предыдущую, и коллекция процесса переоткрывается.
+
+        Аргументы:
+            collection (Collection): Коллекция, через которую идут запросы.
+            force (bool): Перечитать версию без учета интервала (например, после пересборки).
+
+        Возвращает:
+            Tuple[Collection, str]: Коллекция для запросов и её версия.
+        """
+        now = time.monotonic()
+        if force or self._version is None or now - self._version_checked_at > settings.COLLECTION_VERSION_CHECK_S:
+            try:
+                # Коллекция ищется через указатель: полный ингест публикует новую коллекцию
+                fresh = get_chroma_collection(get_chroma_client())
+                self._version = get_collection_version(fresh)
+                self.docstore_version = get_collection_docstore_version(fresh)
+                self._collection_id = str(fresh.id)
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать версию коллекции: {e}")
+                self._version = get_collection_version(collection)
+                self.docstore_version = get_collection_docstore_version(collection)
+            self._version_checked_at = now
+
+        if self._collection_id is not None and str(collection.id) != self._collection_id:
+            logger.info("Коллекция была пересоздана, переоткрываю её.")
+            collection = reset_collection()
+        return collection, self._version
+
+    def _record(self, name: str, hit: bool, saved_ms: float = 0.0) -> None:
+        with self._stats_lock:
+            stats = self._stats[name]
+            stats['hits' if hit else 'misses'] += 1
+            stats['saved_ms'] += saved_ms
+
+    def _lookup(self, name: str, local: TTLCache, key: str, decode: Callable[[bytes], Any]) -> Any:
+        """Ищет запись сначала в локальном кэше, затем в разделяемом."""
+        item = local.get(key)
+        if item is None and self._shared is not None:
+            raw = self._shared.get(f'{name}:{key}')
+            if raw is not None:
+                item = decode(raw)
+                local.set(key, item)
+        return item
+
+    def _store(self, name: str, local: TTLCache, key: str, item: Any, encode: Callable[[Any], bytes]) -> None:
+        local.set(key, item)
+        if self._shared is not None:
+            try:
+                self._shared.set(f'{name}:{key}', encode(item), self.ttl)
+            except Exception as e:
+                logger.warning(f"Не удалось записать в разделяемый кэш: {e}")
+
+    def get_embedding(self, question: str, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        """
+        Возвращает эмбеддинг запроса из кэша или вычисляет его.
+
+        Аргументы:
+            question (str): Текст запроса.
+            compute (Callable[[], np.ndarray]): Функция вычисления эмбеддинга при промахе.
+
+        Возвращает:
+            np.ndarray: Эмбеддинг запроса.
+        """
+        if not self.enabled:
+            return compute()
+
+        key = make_key(settings.EMBEDDING_MODEL_NAME, normalize_question(question))
+        item = self._lookup('embeddings', self._embeddings, key, _decode_embedding)
+        if item is not None:
+            cost_ms, embedding = item
+            self._record('embeddings', hit=True, saved_ms=cost_ms)
+            return embedding
+
+        start = time.perf_counter()
+        embedding = np.asarray(compute(), dtype=np.float32)
+        cost_ms = (time.perf_counter() - start) * 1000
+        self._store('embeddings', self._embeddings, key, (cost_ms, embedding), _encode_embedding)
+        self._record('embeddings', hit=False)
+        return embedding
+
+    def get_embeddings(
+        self, questions: List[str], compute_batch: Callable[[List[str]], np.ndarray]
+    ) -> List[np.ndarray]:
+        """
+        Возвращает эмбеддинги нескольких запросов, вычисляя промахи одним батчем.
+
+        Аргументы:
+            questions (List[str]): Тексты запросов.
+            compute_batch (Callable[[List[str]], np.ndarray]): Функция батчевого
+                вычисления эмбеддингов для промахнувшихся запросов.
+
+        Возвращает:
+            List[np.ndarray]: Эмбеддинги в порядке запросов.
+        """
+        if not self.enabled:
+            return list(np.asarray(compute_batch(questions), dtype=np.float32))
+
+        keys = [make_key(settings.EMBEDDING_MODEL_NAME, normalize_question(q)) for q in questions]
+        embeddings: List[Optional[np.ndarray]] = []
+        missing: List[int] = []
+        for i, key in enumerate(keys):
+            item = self._lookup('embeddings', self._embeddings, key, _decode_embedding)
+            if item is None:
+                embeddings.append(None)
+                missing.append(i)
+            else:
+                self._record('embeddings', hit=True, saved_ms=item[0])
+                embeddings.append(item[1])
+
+        if missing:
+            start = time.perf_counter()
+            computed = np.asarray(compute_batch([questions[i] for i in missing]), dtype=np.float32)
+            cost_ms = (time.perf_counter() - start) * 1000 / len(missing)
+            for i, embedding in zip(missing, computed):
+                self._store('embeddings', self._embeddings, keys[i], (cost_ms, embedding), _encode_embedding)
+                self._record('embeddings', hit=False)
+                embeddings[i] = embedding
+        return embeddings
+
+    def get_chunks(self, key: str) -> Optional[list]:
+        """Возвращает закэшированный список чанков или None."""
+        if not self.enabled:
+            return None
+        item = self._lookup('chunks', self._chunks, key, _decode_json)
+        if item is None:
+            self._record('chunks', hit=False)
+            return None
+        cost_ms, chunks = item
+        self._record('chunks', hit=True, saved_ms=cost_ms)
+        return [dict(chunk) for chunk in chunks]
+
+    def set_chunks(self, key: str, chunks: list, cost_ms: float) -> None:
+        """Сохраняет список чанков вместе со временем, затраченным на его получение."""
+        if self.enabled and chunks:
+            self._store('chunks', self._chunks, key, (cost_ms, chunks), _encode_json)
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает статистику попаданий и сэкономленного времени."""
+        with self._stats_lock:
+            result: Dict[str, Any] = {'backend': 'sqlite' if self._shared else 'memory'}
+            for name, stats in self._stats.items():
+                total = stats['hits'] + stats['misses']
+                result[name] = {
+                    **stats,
+                    'hit_ratio': stats['hits'] / total if total else 0.0,
+                    'size': len(self._embeddings if name == 'embeddings' else self._chunks),
+                }
+            return result
+
+    def memory_usage(self) -> Dict[str, Any]:
+        """Возвращает приблизительный объем локальных кэшей в памяти и разделяемого на диске."""
+        return {
+            'embeddings_mb': round(self._embeddings.approx_bytes() / MB, 2),
+            'chunks_mb': round(self._chunks.approx_bytes() / MB, 2),
+            'shared_disk_mb': round(path_size_mb(settings.RETRIEVAL_CACHE_PATH), 2) if self._shared else 0.0,
+        }
+
+    def clear(self) -> None:
+        self._embeddings.clear()
+        self._chunks.clear()
+        self._version = None
+        self._collection_id = None
+
+
+def _encode_embedding(item: tuple[float, np.ndarray]) -> bytes:
+    cost_ms, embedding = item
+    return np.float32(cost_ms).tobytes() + np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def _decode_embedding(raw: bytes) -> tuple[float, np.ndarray]:
+    data = np.frombuffer(raw, dtype=np.float32)
+    return float(data[0]), data[1:].copy()
+
+
+def _encode_json(item: Any) -> bytes:
+    return json.dumps(item, ensure_ascii=False).encode('utf-8')
+
+
+def _decode_json(raw: bytes) -> Any:
+    return json.loads(raw.decode('utf-8'))
+
+
+# Общий для процесса экземпляр кэша
+retrieval_cache = RetrievalCache()
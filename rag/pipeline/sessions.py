@@ -0,0 +1,140 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import aiosqlite
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from rag.pipeline.graph import graph
+from settings import settings
+from utils.logger import setup_logger
+
+# Инициализация логгера
+logger = setup_logger("sessions")
+
+
+class SessionManager:
+    """
+    Сессионный чат поверх графа конвейера с чекпойнтером LangGraph на локальном SQLite.
+
+    Состояние сессии (ограниченная история, краткое содержание, теплый пул чанков)
+    хранится в чекпойнтах по thread_id = session_id. Для каждой сессии оставляется
+    только последний чекпойнт, а сессии, неактивные дольше SESSION_TTL_S,
+    удаляются фоновой задачей.
+    """
+
+    def __init__(self) -> None:
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._saver: Optional[AsyncSqliteSaver] = None
+        self._evict_task: Optional[asyncio.Task] = None
+        self.chain = None
+
+    async def start(self) -> None:
+        """Открывает хранилище чекпойнтов, компилирует граф и запускает вытеснение."""
+        settings.SESSION_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = await aiosqlite.connect(str(settings.SESSION_DB_PATH))
+        await self._conn.execute("PRAGMA journal_mode=WAL")
+        self._saver = AsyncSqliteSaver(self._conn)
+        await self._saver.setup()
+        await self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_activity (thread_id TEXT PRIMARY KEY, last_seen REAL)"
+        )
+        await self._conn.commit()
+        self.chain = graph.compile(checkpointer=self._saver)
+        self._evict_task = asyncio.create_task(self._evict_loop())
+        logger.info(f"Хранилище сессий открыто: {settings.SESSION_DB_PATH}")
+
+    async def stop(self) -> None:
+        """Останавливает вытеснение и закрывает хранилище."""
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            self._evict_task = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+        self.chain = None
+
+    async def ask(self, session_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Выполняет конвейер в контексте сессии.
+
+        Args:
+            session_id: Идентификатор сессии (thread_id чекпойнтера).
+            payload: Входные данные конвейера (user_input, filters).
+
+        Returns:
+            Итоговое состояние конвейера.
+
+        Raises:
+            RuntimeError: Если менеджер сессий не запущен.
+        """
+        if self.chain is None:
+            raise RuntimeError("Менеджер сессий не запущен")
+
+        result = await self.chain.ainvoke(payload, {"configurable": {"thread_id": session_id}})
+        await self._touch(session_id)
+        await self._prune_checkpoints(session_id)
+        return result
+
+    async def _touch(self, session_id: str) -> None:
+        await self._conn.execute(
+            "INSERT OR REPLACE INTO session_activity (thread_id, last_seen) VALUES (?, ?)",
+            (session_id, time.time()),
+        )
+        await self._conn.commit()
+
+    async def _prune_checkpoints(self, session_id: str) -> None:
+        """Удаляет все чекпойнты сессии, кроме последнего (id чекпойнтов монотонны)."""
+        for table in ("checkpoints", "writes"):
+            await self._conn.execute(
+                f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_id < "
+                f"(SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ?)",
+                (session_id, session_id),
+            )
+        await self._conn.commit()
+
+    async def evict_idle(self) -> int:
+        """
+        Удаляет неактивные сессии и самые старые сессии сверх SESSION_MAX_COUNT.
+
+        Returns:
+            Число удаленных сессий.
+        """
+        cutoff = time.time() - settings.SESSION_TTL_S
+        async with self._conn.execute(
+            "SELECT thread_id FROM session_activity WHERE last_seen < ?", (cutoff,)
+        ) as cursor:
+            stale = {row[0] for row in await cursor.fetchall()}
+        async with self._conn.execute(
+            "SELECT thread_id FROM session_activity ORDER BY last_seen DESC LIMIT -1 OFFSET ?",
+            (settings.SESSION_MAX_COUNT,),
+        ) as cursor:
+            stale.update(row[0] for row in await cursor.fetchall())
+
+        for thread_id in stale:
+            await self._saver.adelete_thread(thread_id)
+            await self._conn.execute("DELETE FROM session_activity WHERE thread_id = ?", (thread_id,))
+        await self._conn.commit()
+        if stale:
+            logger.info(f"Вытеснено неактивных сессий: {len(stale)}")
+        return len(stale)
+
+    async def _evict_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.SESSION_EVICT_INTERVAL_S)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Ошибка при вытеснении сессий: {e}")
+
+    async def stats(self) -> Dict[str, Any]:
+        """Возвращает число активных сессий."""
+        if self._conn is None:
+            return {"active": 0}
+        async with self._conn.execute("SELECT COUNT(*) FROM session_activity") as cursor:
+            (count,) = await cursor.fetchone()
+        return {"active": count}
+
+
+# Общий для процесса менеджер сессий; запускается в lifespan приложения
+session_manager = SessionManager()
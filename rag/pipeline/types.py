@@ -1,4 +1,4 @@
-from typing import TypedDict, List
+from typing import Annotated, Any, Dict, TypedDict, List, Optional
 
 class Chunk(TypedDict):
     """
@@ -13,16 +13,75 @@ class Chunk(TypedDict):
     text: str
     source: str
 
+class Turn(TypedDict):
+    """
+    Одна реплика диалога в сессии.
+
+    Attributes:
+        question (str): Вопрос пользователя.
+        answer (str): Ответ ассистента.
+        search_query (str): Самостоятельный запрос, по которому шел поиск
+            (для уточнения — переписанный с учетом истории).
+    """
+    question: str
+    answer: str
+    search_query: str
+
+def merge_segment_results(
+    current: Optional[List[List[Chunk]]], update: Optional[List[List[Chunk]]]
+) -> List[List[Chunk]]:
+    """
+    Редьюсер результатов параллельных веток поиска по сегментам.
+
+    None сбрасывает накопленные результаты (узел input в начале каждого вопроса),
+    список результатов ветки добавляется к накопленным. Узлы конвейера возвращают
+    частичные обновления, поэтому значение поля передает только узел, который его меняет.
+    """
+    if update is None:
+        return []
+    return (current or []) + update
+
+class SegmentSearch(TypedDict):
+    """
+    Задание для одной параллельной ветки поиска.
+
+    Attributes:
+        segment (str): Сегмент вопроса.
+        embedding (List[float]): Эмбеддинг сегмента, вычисленный батчем для всех сегментов.
+        filters (Dict[str, Any]): Фильтры поиска по метаданным.
+        deadline (float): Дедлайн запроса (time.time()), 0 — без ограничения.
+    """
+    segment: str
+    embedding: List[float]
+    filters: Dict[str, Any]
+    deadline: float
+
 class LetterState(TypedDict):
     """
     Типизированное состояние для конвейера генерации ответа.
 
     Attributes:
         user_input: Вопрос пользователя.
+        filters: Фильтры поиска по метаданным чанков (например, {"industry": "retail"}).
+        deadline: Момент (time.time()), к которому должен быть готов ответ.
+        search_query: Самостоятельный запрос для поиска (уточняющий вопрос, переписанный с учетом истории).
+        segments: Сегменты составного вопроса, по которым поиск идет параллельно.
+        segment_chunks: Результаты поиска по каждому сегменту.
         chunks: Список релевантных чанков из базы знаний.
         prompt: Промпт для генерации ответа на вопрос.
-        answer: Сгенерированный ответ."""
+        answer: Сгенерированный ответ.
+        history: Последние реплики сессии (ограничены SESSION_MAX_TURNS).
+        summary: Краткое содержание более ранних реплик сессии.
+        session_chunks: Чанки, найденные ранее в сессии, — теплый пул кандидатов."""
     user_input: str
+    filters: Dict[str, Any]
+    deadline: float
+    search_query: str
+    segments: List[str]
+    segment_chunks: Annotated[List[List[Chunk]], merge_segment_results]
     chunks: List[Chunk]
     prompt: str
-    answer: str
\ No newline at end of file
+    answer: str
+    history: List[Turn]
+    summary: str
+    session_chunks: List[Chunk]
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+from typing import Dict, List
 
 from pydantic_settings import BaseSettings
 from pathlib import Path
@@ -14,16 +15,138 @@ class Settings(BaseSettings):
     PDF_PATH: Path = BASE_DIR / "data" / "raw" / "Тестовое задание EORA Разработчик.pdf"
     OUTPUT_JSON: Path = BASE_DIR / "data" / "eora_cases.json"
 
+    # Локальные документы (PDF, DOCX, HTML) как дополнительный источник базы знаний
+    SOURCES_DIR: Path = BASE_DIR / "data" / "sources"
+    DOCUMENTS_JSON: Path = BASE_DIR / "data" / "documents.json"
+    EXTRACTION_CACHE_PATH: Path = BASE_DIR / "cache" / "extraction.sqlite3"
+    EXTRACTION_WORKERS: int = 0  # 0 — по числу CPU
+    EXTRACTION_PAGES_PER_TASK: int = 16  # страниц PDF в одной задаче пула
+    DOCUMENTS_PUBLIC_URL: str = ""  # адрес, по которому пользователям доступен SOURCES_DIR; пусто — источник без ссылки
+
+    # Инкрементальный обход сайта по sitemap.xml: обрабатываются только новые и измененные страницы
+    CRAWL_BASE_URL: str = "https://eora.ru"
+    CRAWL_INCLUDE_PATTERN: str = r"^/cases/.+"  # регулярное выражение для пути страниц кейсов
+    CRAWL_STATE_PATH: Path = BASE_DIR / "data" / "crawl_state.json"
+    CRAWL_REPORT_PATH: Path = BASE_DIR / "data" / "crawl_report.json"
+    CRAWL_USER_AGENT: str = "EORA-RAG-Crawler/1.0"
+    CRAWL_MAX_WORKERS: int = 4
+    CRAWL_PER_HOST_CONCURRENCY: int = 2  # одновременных запросов к одному хосту
+    CRAWL_TIMEOUT_S: float = 15.0
+
+    # Скрейпинг: экономный рендеринг без картинок, шрифтов, видео и сторонних хостов
+    SCRAPER_LEAN_MODE: bool = True
+    SCRAPER_BLOCKED_RESOURCES: List[str] = ["image", "media", "font"]
+    SCRAPER_ALLOWED_HOSTS: List[str] = ["tildacdn.com"]  # сторонние хосты, без которых страница не рендерится
+    SCRAPER_IDLE_TIMEOUT_MS: int = 3000  # сколько ждать затишья сети в экономном режиме
+    SCRAPER_SETTLE_MS: int = 3000  # фиксированное ожидание рендеринга в полном режиме
+
     # Пути к базе данных
     CHROMA_DB_PATH: Path = BASE_DIR / "vector_store"
     CHROMA_COLLECTION_NAME: str = "eora_cases"
 
+    # Режим Chroma: embedded (локальное хранилище) | http (общий сервер `chroma run` для нескольких узлов)
+    CHROMA_MODE: str = "embedded"
+    CHROMA_HOST: str = "localhost"
+    CHROMA_PORT: int = 8001
+    CHROMA_SSL: bool = False
+    CHROMA_AUTH_TOKEN: str = ""
+    CHROMA_TIMEOUT_S: float = 5.0  # на одну попытку асинхронного запроса
+    CHROMA_RETRIES: int = 2  # повторов при сетевых ошибках
+    CHROMA_RETRY_BACKOFF_S: float = 0.2
+
     # Название модели эмбеддингов (с возможностью переопределить через .env)
     EMBEDDING_MODEL_NAME: str = "sberbank-ai/sbert_large_nlu_ru"
 
     CHUNK_SIZE: int = 150
     CHUNK_OVERLAP: int = 30
 
+    # Родительские фрагменты (разделы), до которых расширяются найденные чанки
+    PARENT_CHUNK_SIZE: int = 600
+    CONTEXT_EXPANSION: bool = True
+    DOCSTORE_PATH: Path = BASE_DIR / "vector_store" / "docstore"
+
+    # Понижение размерности эмбеддингов: PCA по корпусу в конце ингеста (0 — без проекции)
+    EMBEDDING_PROJECTION_DIM: int = 0  # например 256 или 384 вместо 1024
+    PROJECTION_PATH: Path = BASE_DIR / "vector_store" / "projection.npz"  # проекции коллекций лежат рядом: projection-<коллекция>.npz
+
+    # Снапшот индекса: ингест выгружает его, реплики загружают вместо пересборки
+    SNAPSHOT_PATH: Path = BASE_DIR / "snapshots" / "eora_cases"
+    SNAPSHOT_EXPORT_ON_INGEST: bool = False
+
+    # Офлайн-оценка поиска: кэш эмбеддингов чанков и вопросов
+    EVAL_CACHE_PATH: Path = BASE_DIR / "cache" / "eval_embeddings.sqlite3"
+
+    # Продакшн-запуск через gunicorn (см. gunicorn_conf.py)
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    WEB_CONCURRENCY: int = 2  # число воркеров
+    PRELOAD_MODEL: bool = True  # загружать модель в мастере до fork()
+    TORCH_THREADS_PER_WORKER: int = 1  # чтобы воркеры не делили ядра друг у друга
+
+    # Индекс только для чтения: API не пересобирает базу, запись — только через ингест
+    READ_ONLY_INDEX: bool = False
+
+    # Ограничение задержки: дедлайн запроса и контроль допуска (на воркер)
+    REQUEST_DEADLINE_S: float = 20.0
+    GENERATION_RESERVE_S: float = 0.3  # запас на запасной экстрактивный ответ
+    MAX_CONCURRENT_REQUESTS: int = 16
+    MAX_QUEUED_REQUESTS: int = 32
+
+    # Разнообразие выдачи: сколько кандидатов брать из Chroma, вес MMR и лимит чанков на источник
+    RETRIEVAL_MAX_DISTANCE: float = 1.3  # квадрат L2 между нормализованными векторами
+    RETRIEVAL_CANDIDATES: int = 30
+    RETRIEVAL_MMR_LAMBDA: float = 0.7
+    RETRIEVAL_PER_SOURCE_CAP: int = 2
+
+    # Переранжирование: tfidf | cross_encoder | none
+    RERANKER: str = "tfidf"
+    RERANK_TOP_K: int = 3
+
+    # Каскадный cross-encoder: дешевая оценка отсекает кандидатов, модель видит только лучших
+    CROSS_ENCODER_MODEL: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # многоязычная, работает на CPU
+    CROSS_ENCODER_CANDIDATES: int = 6  # сколько кандидатов после дешевой оценки получает модель
+    CROSS_ENCODER_MAX_LENGTH: int = 256  # токенов в паре (вопрос, чанк)
+    CROSS_ENCODER_BUDGET_MS: float = 150.0  # бюджет переранжирования на один поиск
+
+    # Составные вопросы: поиск по сегментам в параллельных ветках графа
+    MAX_SEGMENTS: int = 4
+    MAX_CONTEXT_CHUNKS: int = 6  # чанков в контексте, если сегментов несколько
+    SEGMENT_LLM_SPLIT: bool = False  # делить вопрос через LLM, если эвристика не нашла сегментов
+
+    # Сессии диалога: чекпойнты LangGraph в локальном SQLite
+    SESSION_DB_PATH: Path = BASE_DIR / "cache" / "sessions.sqlite3"
+    SESSION_MAX_TURNS: int = 4  # реплик, хранимых целиком; более ранние сворачиваются в summary
+    SESSION_SUMMARY_MAX_CHARS: int = 1000
+    SESSION_CHUNK_POOL: int = 9  # размер теплого пула чанков сессии
+    SESSION_TTL_S: float = 1800  # неактивные дольше сессии удаляются
+    SESSION_MAX_COUNT: int = 10000
+    SESSION_EVICT_INTERVAL_S: float = 60
+    SESSION_LLM_REWRITE: bool = False  # переписывать уточнения через LLM вместо эвристики
+    SESSION_REWRITE_MODEL: str = "gpt-4o-mini"
+    SESSION_REWRITE_TIMEOUT_S: float = 3.0
+
+    # Кэш поиска: эмбеддинги запросов и итоговые списки чанков
+    RETRIEVAL_CACHE_ENABLED: bool = True
+    RETRIEVAL_CACHE_SIZE: int = 1024
+    RETRIEVAL_CACHE_TTL_S: float = 3600
+    RETRIEVAL_CACHE_BACKEND: str = "memory"  # memory | sqlite (общий для воркеров и реплик)
+    RETRIEVAL_CACHE_PATH: Path = BASE_DIR / "cache" / "retrieval_cache.sqlite3"
+    COLLECTION_VERSION_CHECK_S: float = 5.0  # как часто перечитывать версию коллекции
+
+    # Логирование: асинхронная запись через очередь, уровни по имени логгера
+    LOG_LEVEL: str = "INFO"
+    LOG_LEVELS: Dict[str, str] = {}  # например {"chunks": "WARNING", "letter_pipeline": "DEBUG"}
+    LOG_FORMAT: str = "json"  # json | text
+    LOG_MAX_FIELD_CHARS: int = 2000
+    LOG_PAYLOAD_SAMPLE_RATE: float = 0.01  # доля запросов, для которых промпт и ответ пишутся на INFO
+    LOG_QUEUE_SIZE: int = 10000
+
+    # Профилирование памяти: tracemalloc по фазам ингеста и админский отчет API
+    MEMORY_PROFILING: bool = False
+    MEMORY_PROFILE_TOP: int = 10  # строк кода в отчете о крупнейших аллокациях
+    MEMORY_PROFILE_FRAMES: int = 1  # глубина стека, которую хранит tracemalloc
+    ADMIN_TOKEN: str = ""  # без токена админские эндпоинты отключены
+
     #OpenAI API_KEY
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY")
 
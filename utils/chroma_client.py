@@ -1,4 +1,12 @@
+import asyncio
 import os
+import threading
+import time
+import uuid
+import weakref
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
 import chromadb
 from chromadb import Settings
 from chromadb.api import Collection
@@ -9,15 +17,259 @@ from utils.logger import setup_logger
 # Инициализация логгера
 logger = setup_logger("chroma_client")
 
+# Ключ метаданных коллекции с меткой версии её содержимого
+COLLECTION_VERSION_KEY = "version"
+# Ключ метаданных коллекции с именем файла PCA-проекции, которой понижены её векторы
+COLLECTION_PROJECTION_KEY = "projection"
+# Ключ метаданных коллекции с версией докстора, на тексты которой ссылаются смещения её чанков
+COLLECTION_DOCSTORE_KEY = "docstore"
+
+# Коллекция-указатель: её метаданные называют опубликованную коллекцию с данными.
+# Ингест собирает новую коллекцию рядом и публикует её одной записью в указатель
+ALIAS_SUFFIX = "__alias"
+ALIAS_TARGET_KEY = "target"
+# Сколько предыдущих опубликованных коллекций хранить для запросов, начатых до публикации
+KEEP_PREVIOUS_COLLECTIONS = 1
+
+
+def _transient_errors() -> Tuple[type, ...]:
+    """Ошибки сети и таймауты, после которых запрос к Chroma имеет смысл повторить."""
+    errors: list = [ConnectionError, TimeoutError, asyncio.TimeoutError]
+    try:
+        import httpx
+
+        errors.append(httpx.TransportError)
+    except ImportError:
+        pass
+    try:
+        import requests
+
+        errors.extend([requests.exceptions.ConnectionError, requests.exceptions.Timeout])
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+TRANSIENT_ERRORS = _transient_errors()
+
+# Клиенты создаются один раз на процесс (HTTP-клиент держит пул соединений),
+# а асинхронные — ещё и на цикл событий, к которому привязан их пул
+_client: Optional[chromadb.ClientAPI] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+# Ключ — (pid, id цикла событий, имя коллекции), значение — слабая ссылка на цикл и коллекция:
+# по ней отсеиваются записи закрытых циклов, id которых может достаться новому
+_async_collections: Dict[Tuple[int, int, str], Tuple[weakref.ref, Any]] = {}
+_async_lock = threading.Lock()
+
+
+def _http_headers() -> Dict[str, str]:
+    return {"Authorization": f"Bearer {settings.CHROMA_AUTH_TOKEN}"} if settings.CHROMA_AUTH_TOKEN else {}
+
+
 def get_chroma_client() -> chromadb.ClientAPI:
-    os.makedirs(CHROMA_DB_PATH, exist_ok=True)  # создаёт, если не существует
-    return chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    """Возвращает клиент ChromaDB текущего процесса.
+
+    В режиме embedded (CHROMA_MODE) клиент работает с локальным хранилищем
+    CHROMA_DB_PATH, в режиме http — с сервером Chroma (`chroma run`) по адресу
+    CHROMA_HOST:CHROMA_PORT, который могут разделять несколько узлов API.
+
+    Returns:
+        Клиент Chroma DB.
+
+    Raises:
+        ValueError: Если задан неизвестный режим.
+    """
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            client_settings = Settings(anonymized_telemetry=False)
+            if settings.CHROMA_MODE == "embedded":
+                os.makedirs(settings.CHROMA_DB_PATH, exist_ok=True)  # создаёт, если не существует
+                _client = chromadb.PersistentClient(path=str(settings.CHROMA_DB_PATH), settings=client_settings)
+            elif settings.CHROMA_MODE == "http":
+                _client = call_with_retries(
+                    chromadb.HttpClient,
+                    host=settings.CHROMA_HOST,
+                    port=settings.CHROMA_PORT,
+                    ssl=settings.CHROMA_SSL,
+                    headers=_http_headers(),
+                    settings=client_settings,
+                )
+            else:
+                raise ValueError(f"Неизвестный режим Chroma: {settings.CHROMA_MODE} (ожидается embedded или http)")
+            _client_pid = pid
+    return _client
+
+
+def call_with_retries(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Вызывает операцию Chroma, повторяя её при сетевых ошибках с экспоненциальной паузой.
+
+    Args:
+        fn: Операция (например, collection.upsert).
+        *args: Позиционные аргументы операции.
+        **kwargs: Именованные аргументы операции.
+
+    Returns:
+        Результат операции.
+    """
+    for attempt in range(settings.CHROMA_RETRIES + 1):
+        try:
+            return fn(*args, **kwargs)
+        except TRANSIENT_ERRORS as e:
+            if attempt == settings.CHROMA_RETRIES:
+                raise
+            delay = settings.CHROMA_RETRY_BACKOFF_S * 2 ** attempt
+            logger.warning(f"Chroma недоступна ({e}), повтор через {delay:.2f} с")
+            time.sleep(delay)
+
+
+async def acall_with_retries(make_call: Callable[[], Any]) -> Any:
+    """Асинхронный вариант call_with_retries с таймаутом CHROMA_TIMEOUT_S на каждую попытку.
+
+    Args:
+        make_call: Функция без аргументов, создающая корутину операции.
+
+    Returns:
+        Результат операции.
+    """
+    for attempt in range(settings.CHROMA_RETRIES + 1):
+        try:
+            return await asyncio.wait_for(make_call(), timeout=settings.CHROMA_TIMEOUT_S)
+        except TRANSIENT_ERRORS as e:
+            if attempt == settings.CHROMA_RETRIES:
+                raise
+            delay = settings.CHROMA_RETRY_BACKOFF_S * 2 ** attempt
+            logger.warning(f"Chroma недоступна ({e!r}), повтор через {delay:.2f} с")
+            await asyncio.sleep(delay)
+
+
+async def get_async_collection(name: str = settings.CHROMA_COLLECTION_NAME) -> Any:
+    """Возвращает асинхронную коллекцию на HTTP-сервере Chroma.
+
+    Клиент (и его пул соединений httpx) создаётся один раз на процесс и цикл событий.
+    Записи закрытых циклов и других процессов при этом отбрасываются. Коллекция
+    только открывается: удаленная публикацией новой коллекция не пересоздается
+    пустой, а дает ошибку, после которой вызывающий заново читает указатель.
+
+    Args:
+        name: Имя коллекции.
+
+    Returns:
+        Коллекция AsyncHttpClient.
+    """
+    loop = asyncio.get_running_loop()
+    key = (os.getpid(), id(loop), name)
+    entry = _async_collections.get(key)
+    if entry is not None and entry[0]() is loop:
+        return entry[1]
+
+    _prune_async_collections()
+    client = await acall_with_retries(lambda: chromadb.AsyncHttpClient(
+        host=settings.CHROMA_HOST,
+        port=settings.CHROMA_PORT,
+        ssl=settings.CHROMA_SSL,
+        headers=_http_headers(),
+        settings=Settings(anonymized_telemetry=False),
+    ))
+    collection = await acall_with_retries(lambda: client.get_collection(name=name))
+    with _async_lock:
+        _async_collections[key] = (weakref.ref(loop), collection)
+    return collection
+
+
+def _prune_async_collections() -> None:
+    """Удаляет записи циклов событий, которые закрыты или собраны, и записи других процессов."""
+    pid = os.getpid()
+    with _async_lock:
+        for key, (loop_ref, _) in list(_async_collections.items()):
+            loop = loop_ref()
+            if key[0] != pid or loop is None or loop.is_closed():
+                del _async_collections[key]
+
+
+def evict_async_collections(name: Optional[str] = None) -> None:
+    """Забывает асинхронные коллекции, чтобы следующий запрос открыл их заново.
+
+    Вызывается, когда коллекция удалена или опубликована новая: закэшированный
+    объект ссылается на её прежний id.
+
+    Args:
+        name: Имя коллекции; по умолчанию забываются все.
+    """
+    with _async_lock:
+        for key in [key for key in _async_collections if name is None or key[2] == name]:
+            del _async_collections[key]
+
+
+async def aquery_collection(collection: Collection, **query: Any) -> Dict[str, Any]:
+    """Асинхронно выполняет collection.query.
+
+    В режиме http запрос идёт через асинхронный клиент с общим пулом соединений,
+    с таймаутом и повторами; в режиме embedded — в пуле потоков поверх локального клиента.
+
+    Args:
+        collection: Коллекция ChromaDB (синхронная).
+        **query: Аргументы collection.query.
+
+    Returns:
+        Результат collection.query.
+    """
+    if settings.CHROMA_MODE == "http":
+        async_collection = await get_async_collection(collection.name)
+        try:
+            return await acall_with_retries(lambda: async_collection.query(**query))
+        except Exception:
+            # Коллекция могла быть удалена публикацией новой: следующий запрос откроет её заново
+            evict_async_collections(collection.name)
+            raise
+    # Локальный запрос не ходит в сеть, а поток по таймауту не прервать — без повторов
+    return await asyncio.to_thread(collection.query, **query)
+
+def _alias_collection(client: chromadb.ClientAPI, create: bool = False) -> Optional[Collection]:
+    """Возвращает коллекцию-указатель; создает её только публикация (create=True)."""
+    name = f"{settings.CHROMA_COLLECTION_NAME}{ALIAS_SUFFIX}"
+    if create:
+        return call_with_retries(client.get_or_create_collection, name=name)
+    try:
+        return call_with_retries(client.get_collection, name=name)
+    except TRANSIENT_ERRORS:
+        raise
+    except Exception:
+        # Указателя нет: ингест ещё ни разу не публиковал коллекцию
+        return None
+
 
-def get_chroma_collection(client: chromadb.ClientAPI) -> Collection:
-    """Инициализирует и возвращает коллекцию ChromaDB.
+def live_collection_name(client: chromadb.ClientAPI) -> str:
+    """Возвращает имя опубликованной коллекции.
+
+    Args:
+        client: Клиент Chroma DB.
+
+    Returns:
+        Имя из коллекции-указателя или CHROMA_COLLECTION_NAME, если ингест
+        ещё ни разу не публиковал коллекцию через указатель.
+    """
+    alias = _alias_collection(client)
+    metadata = alias.metadata if alias is not None else None
+    return str((metadata or {}).get(ALIAS_TARGET_KEY) or settings.CHROMA_COLLECTION_NAME)
+
+
+def get_chroma_collection(client: chromadb.ClientAPI, create: bool = False) -> Collection:
+    """Инициализирует и возвращает опубликованную коллекцию ChromaDB.
+
+    Путь чтения коллекции не создает: опубликованная через указатель коллекция,
+    удаленная новой публикацией, не должна воскреснуть пустой.
 
     Args:
         client: Клиент Chroma DB
+        create: Создать коллекцию CHROMA_COLLECTION_NAME, если ничего ещё не опубликовано
+            (ингест и первичное наполнение индекса).
     Raises:
         RuntimeError: Если не удалось инициализировать коллекцию ChromaDB.
 
@@ -25,21 +277,175 @@ def get_chroma_collection(client: chromadb.ClientAPI) -> Collection:
         Коллекция ChromaDB для работы с данными.
     """
     try:
-        return client.get_or_create_collection(name=settings.CHROMA_COLLECTION_NAME)
+        name = live_collection_name(client)
+        if create and name == settings.CHROMA_COLLECTION_NAME:
+            return call_with_retries(client.get_or_create_collection, name=name)
+        return call_with_retries(client.get_collection, name=name)
     except Exception as e:
         raise RuntimeError(
-            f"Ошибка инициализации коллекции ChromaDB: {str(e)}"
+            f"Ошибка инициализации коллекции ChromaDB (запущен ли ингест?): {str(e)}"
         ) from e
 
 
+def create_staging_collection(client: chromadb.ClientAPI) -> Collection:
+    """Создает новую коллекцию для сборки индекса рядом с опубликованной.
+
+    Пока коллекция не опубликована (publish_collection), запросы её не видят.
+
+    Args:
+        client: Клиент Chroma DB.
+
+    Returns:
+        Пустая коллекция с уникальным именем.
+    """
+    name = f"{settings.CHROMA_COLLECTION_NAME}-{uuid.uuid4().hex[:12]}"
+    return call_with_retries(client.create_collection, name=name)
+
+
+def publish_collection(client: chromadb.ClientAPI, collection: Collection) -> List[str]:
+    """Делает коллекцию опубликованной одной записью в коллекцию-указатель.
+
+    Версия и проекция должны быть записаны в метаданные коллекции до публикации,
+    тогда читатели видят их вместе с данными. Предыдущая опубликованная коллекция
+    остается для запросов, начатых до переключения, более старые удаляются.
 
-def delete_collection():
-    """Удаляет указанную коллекцию в ChromaDB."""
+    Args:
+        client: Клиент Chroma DB.
+        collection: Собранная коллекция (см. create_staging_collection).
+
+    Returns:
+        Имена удаленных устаревших коллекций.
+    """
+    alias = _alias_collection(client, create=True)
+    previous = str((alias.metadata or {}).get(ALIAS_TARGET_KEY) or settings.CHROMA_COLLECTION_NAME)
+    call_with_retries(alias.modify, metadata={ALIAS_TARGET_KEY: collection.name})
+    logger.info(f"Опубликована коллекция '{collection.name}' (предыдущая — '{previous}')")
+
+    keep = {collection.name}
+    if KEEP_PREVIOUS_COLLECTIONS:
+        keep.add(previous)
+    retired = []
+    for item in call_with_retries(client.list_collections):
+        # В разных версиях chromadb list_collections возвращает имена или объекты коллекций
+        name = getattr(item, "name", item)
+        base = settings.CHROMA_COLLECTION_NAME
+        if name in keep or not (name == base or name.startswith(f"{base}-")):
+            continue
+        if delete_collection(client, name):
+            retired.append(name)
+    return retired
+
+
+def get_collection_version(collection: Collection) -> str:
+    """Возвращает метку версии коллекции из её метаданных.
+
+    Args:
+        collection: Коллекция ChromaDB.
+
+    Returns:
+        Метка версии или "0", если коллекция ещё ни разу не наполнялась через ингест.
+    """
+    return str((collection.metadata or {}).get(COLLECTION_VERSION_KEY, "0"))
+
+
+def get_collection_projection_path(collection: Collection) -> Optional[Path]:
+    """Возвращает файл PCA-проекции, которой понижены векторы коллекции.
+
+    Args:
+        collection: Коллекция ChromaDB.
+
+    Returns:
+        Путь к файлу проекции или None, если коллекция хранит исходные эмбеддинги.
+        Для коллекции старого формата (без ключа в метаданных) — PROJECTION_PATH, если он есть.
+    """
+    metadata = collection.metadata or {}
+    if COLLECTION_PROJECTION_KEY in metadata:
+        name = metadata[COLLECTION_PROJECTION_KEY]
+        return settings.PROJECTION_PATH.with_name(name) if name else None
+    if collection.name == settings.CHROMA_COLLECTION_NAME and settings.PROJECTION_PATH.exists():
+        return settings.PROJECTION_PATH
+    return None
+
+
+def get_collection_docstore_version(collection: Collection) -> Optional[str]:
+    """Возвращает версию докстора, с которой согласованы чанки коллекции.
+
+    Args:
+        collection: Коллекция ChromaDB.
+
+    Returns:
+        Версия докстора или None для коллекции старого формата (тогда читается CURRENT).
+    """
+    return (collection.metadata or {}).get(COLLECTION_DOCSTORE_KEY) or None
+
+
+def projection_path_for(collection_name: str) -> Path:
+    """Файл проекции коллекции: у каждой опубликованной коллекции своя проекция."""
+    path = settings.PROJECTION_PATH
+    return path.with_name(f"{path.stem}-{collection_name}{path.suffix}")
+
+
+def set_collection_version(
+    collection: Collection, version: str, projection: Optional[str] = None, docstore: Optional[str] = None
+) -> None:
+    """Записывает в метаданные коллекции заданную метку версии.
+
+    Args:
+        collection: Коллекция ChromaDB.
+        version: Метка версии.
+        projection: Имя файла проекции коллекции ("" — без проекции); None
+            оставляет записанное ранее значение.
+        docstore: Версия докстора, согласованная с чанками; None оставляет прежнюю.
+    """
+    # Параметры HNSW менять после создания коллекции нельзя, поэтому их не передаём
+    metadata = {
+        key: value for key, value in (collection.metadata or {}).items()
+        if not key.startswith("hnsw:")
+    }
+    metadata[COLLECTION_VERSION_KEY] = version
+    if projection is not None:
+        metadata[COLLECTION_PROJECTION_KEY] = projection
+    if docstore is not None:
+        metadata[COLLECTION_DOCSTORE_KEY] = docstore
+    # Версия, проекция и докстор меняются одной записью, читатель не увидит одно без другого
+    call_with_retries(collection.modify, metadata=metadata)
+    logger.info(f"Версия коллекции '{collection.name}' обновлена: {version}")
+
+
+def bump_collection_version(collection: Collection, docstore: Optional[str] = None) -> str:
+    """Записывает в метаданные коллекции новую метку версии.
+
+    Метка инвалидирует кэши поиска во всех процессах, читающих коллекцию.
+
+    Args:
+        collection: Коллекция ChromaDB.
+        docstore: Новая версия докстора коллекции; None оставляет прежнюю.
+
+    Returns:
+        Новая метка версии.
+    """
+    version = uuid.uuid4().hex
+    set_collection_version(collection, version, docstore=docstore)
+    return version
+
+
+def delete_collection(client: Optional[chromadb.ClientAPI] = None, name: Optional[str] = None) -> bool:
+    """Удаляет коллекцию в том же хранилище, что и get_chroma_client.
+
+    Args:
+        client: Клиент Chroma DB; по умолчанию клиент текущего процесса.
+        name: Имя коллекции; по умолчанию опубликованная коллекция.
+
+    Returns:
+        True, если коллекция удалена; False, если её не было или удалить не удалось.
+    """
+    client = client or get_chroma_client()
     try:
-        client = chromadb.Client(
-            Settings(persist_directory=settings.CHROMA_DB_PATH)
-        )
-        client.delete_collection(name=settings.CHROMA_COLLECTION_NAME)
-        logger.info(f"Коллекция '{settings.CHROMA_COLLECTION_NAME}' успешно удалена.")
+        name = name or live_collection_name(client)
+        call_with_retries(client.delete_collection, name=name)
+        evict_async_collections(name)
+        logger.info(f"Коллекция '{name}' успешно удалена.")
+        return True
     except Exception as e:
-        logger.error(f"Ошибка при удалении коллекции: {e}", exc_info=True)
+        logger.warning(f"Коллекция '{name or settings.CHROMA_COLLECTION_NAME}' не удалена: {e}")
+        return False
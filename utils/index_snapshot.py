@@ -0,0 +1,357 @@
+"""
+Переносимые снапшоты векторного индекса для быстрого старта реплик.
+
+Снапшот — каталог с колоночными файлами, которые читаются через mmap:
+
+    manifest.json      версия формата, модель, размерность, число записей, SHA-256 файлов
+    embeddings.npy     float32 (n, dim)
+    ids.npy            идентификаторы чанков
+    texts.bin          тексты чанков в UTF-8, склеенные подряд
+    text_offsets.npy   int64 (n + 1), границы текстов в texts.bin
+    metadatas.jsonl    метаданные чанков, по строке на запись
+    docstore/          докстор с полными текстами документов (если есть)
+    projection.npz     PCA-проекция запросов, если векторы в пониженной размерности
+
+Импорт восстанавливает коллекцию из сохраненных векторов (Chroma заново строит
+HNSW-индекс) без пересчета эмбеддингов. Коллекция собирается рядом с опубликованной
+и вместе с проекцией публикуется одним переключением указателя (см. publish_index).
+
+Запуск:
+    python -m utils.index_snapshot export <каталог>
+    python -m utils.index_snapshot import <каталог> [--if-empty]
+
+Реплику удобно поднимать импортом с --if-empty перед запуском gunicorn:
+коллекция заполняется отдельным процессом, до fork() воркеров.
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+from chromadb.api import Collection
+
+from data_ingestion.docstore import INDEX_FILE, TEXTS_FILE, current_dir, discard_docstore, publish_docstore, stage_docstore
+from data_ingestion.projection import PROJECTION_FILE, PCAProjection
+from settings import settings
+from utils.chroma_client import (
+    call_with_retries,
+    create_staging_collection,
+    delete_collection,
+    get_chroma_client,
+    get_chroma_collection,
+    get_collection_docstore_version,
+    get_collection_projection_path,
+    get_collection_version,
+    live_collection_name,
+    projection_path_for,
+    publish_collection,
+    set_collection_version,
+)
+from utils.logger import setup_logger
+
+# Инициализация логгера
+logger = setup_logger("index_snapshot")
+
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+DATA_FILES = ("embeddings.npy", "ids.npy", "texts.bin", "text_offsets.npy", "metadatas.jsonl")
+PAGE_SIZE = 1000  # записей за один запрос к Chroma
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _copy_docstore(source: Path, target: Path) -> None:
+    """Копирует докстор, подменяя файлы атомарно (тексты раньше индекса)."""
+    target.mkdir(parents=True, exist_ok=True)
+    for name in (TEXTS_FILE, INDEX_FILE):
+        shutil.copyfile(source / name, target / f"{name}.tmp")
+        os.replace(target / f"{name}.tmp", target / name)
+
+
+def publish_index(
+    collection: Collection,
+    version: str,
+    projection: Optional[PCAProjection] = None,
+    docstore: Optional[str] = None,
+) -> Collection:
+    """
+    Публикует собранную коллекцию вместе с её проекцией и докстором.
+
+    Проекция сохраняется в собственный файл коллекции, имя файла, версия
+    и версия докстора записываются в метаданные коллекции одной операцией,
+    после чего коллекция становится опубликованной. Читатель, открывший новую
+    коллекцию, всегда получает и её проекцию, и тексты, с которыми согласованы
+    смещения её чанков; файлы проекций удаленных коллекций удаляются.
+
+    Args:
+        collection: Собранная коллекция (см. create_staging_collection).
+        version: Метка версии содержимого.
+        projection: Проекция векторов коллекции или None.
+        docstore: Неопубликованная версия докстора (DocStoreWriter.version, stage_docstore) или None.
+
+    Returns:
+        Опубликованная коллекция.
+    """
+    projection_name = ""
+    if projection is not None:
+        path = projection_path_for(collection.name)
+        projection.save(path)
+        projection_name = path.name
+    set_collection_version(collection, version, projection=projection_name, docstore=docstore)
+
+    retired = publish_collection(get_chroma_client(), collection)
+    # Докстор публикуется только после коллекции, которая на него ссылается
+    if docstore is not None:
+        publish_docstore(docstore, settings.DOCSTORE_PATH)
+    for name in retired:
+        projection_path_for(name).unlink(missing_ok=True)
+        if name == settings.CHROMA_COLLECTION_NAME:
+            # Коллекция старого формата хранила проекцию прямо в PROJECTION_PATH
+            settings.PROJECTION_PATH.unlink(missing_ok=True)
+    return collection
+
+
+def export_snapshot(collection: Collection, snapshot_dir: Path) -> Dict[str, Any]:
+    """
+    Выгружает коллекцию в снапшот.
+
+    Args:
+        collection: Коллекция ChromaDB.
+        snapshot_dir: Каталог снапшота (создается; существующие файлы перезаписываются).
+
+    Returns:
+        Манифест снапшота.
+
+    Raises:
+        RuntimeError: Если коллекция пуста.
+    """
+    count = collection.count()
+    if count == 0:
+        raise RuntimeError(f"Коллекция '{collection.name}' пуста, снапшот не создан")
+
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    start_time = time.perf_counter()
+
+    embeddings = None
+    ids = []
+    offsets = [0]
+    with open(snapshot_dir / "texts.bin", "wb") as texts, \
+            open(snapshot_dir / "metadatas.jsonl", "w", encoding="utf-8") as metadatas:
+        for offset in range(0, count, PAGE_SIZE):
+            page = call_with_retries(
+                collection.get,
+                limit=PAGE_SIZE,
+                offset=offset,
+                include=["documents", "metadatas", "embeddings"],
+            )
+            page_embeddings = np.asarray(page["embeddings"], dtype=np.float32)
+            if embeddings is None:
+                # Матрица пишется сразу на диск, без накопления в памяти
+                embeddings = np.lib.format.open_memmap(
+                    snapshot_dir / "embeddings.npy",
+                    mode="w+",
+                    dtype=np.float32,
+                    shape=(count, page_embeddings.shape[1]),
+                )
+            embeddings[offset:offset + len(page_embeddings)] = page_embeddings
+
+            for doc, meta in zip(page["documents"], page["metadatas"]):
+                data = (doc or "").encode("utf-8")
+                texts.write(data)
+                offsets.append(offsets[-1] + len(data))
+                metadatas.write(json.dumps(meta or {}, ensure_ascii=False) + "\n")
+            ids.extend(page["ids"])
+
+    dimension = embeddings.shape[1]
+    embeddings.flush()
+    del embeddings
+    np.save(snapshot_dir / "ids.npy", np.asarray(ids))
+    np.save(snapshot_dir / "text_offsets.npy", np.asarray(offsets, dtype=np.int64))
+
+    # Докстор нужен репликам для расширения контекста до разделов: выгружается версия,
+    # с которой согласованы смещения чанков коллекции
+    files = list(DATA_FILES)
+    docstore = get_collection_docstore_version(collection)
+    docstore_dir = settings.DOCSTORE_PATH / docstore if docstore else current_dir(settings.DOCSTORE_PATH)
+    if docstore_dir is not None and (docstore_dir / INDEX_FILE).exists():
+        _copy_docstore(docstore_dir, snapshot_dir / "docstore")
+        files += [f"docstore/{TEXTS_FILE}", f"docstore/{INDEX_FILE}"]
+    # Без проекции реплика не сможет искать по векторам пониженной размерности
+    projection_dim = None
+    projection_path = get_collection_projection_path(collection)
+    if projection_path is not None:
+        shutil.copyfile(projection_path, snapshot_dir / PROJECTION_FILE)
+        projection_dim = PCAProjection.load(projection_path).dim
+        files.append(PROJECTION_FILE)
+    elif (snapshot_dir / PROJECTION_FILE).exists():
+        (snapshot_dir / PROJECTION_FILE).unlink()
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "created_at": time.time(),
+        "collection": collection.name,
+        "collection_version": get_collection_version(collection),
+        "embedding_model": settings.EMBEDDING_MODEL_NAME,
+        "dimension": int(dimension),
+        "projection_dim": projection_dim,
+        "count": len(ids),
+        "checksums": {name: _sha256(snapshot_dir / name) for name in files},
+    }
+    with open(snapshot_dir / MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    logger.info(
+        f"Снапшот из {len(ids)} записей (dim={dimension}) сохранен в {snapshot_dir} "
+        f"за {time.perf_counter() - start_time:.2f} с"
+    )
+    return manifest
+
+
+def load_manifest(snapshot_dir: Path, verify: bool = True) -> Dict[str, Any]:
+    """
+    Читает манифест снапшота и проверяет его совместимость и целостность.
+
+    Args:
+        snapshot_dir: Каталог снапшота.
+        verify: Сверять ли SHA-256 файлов.
+
+    Returns:
+        Манифест снапшота.
+
+    Raises:
+        FileNotFoundError: Если манифест не найден.
+        ValueError: Если формат, модель или контрольные суммы не совпадают.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    manifest_path = snapshot_dir / MANIFEST_FILE
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"Манифест {manifest_path} не найден")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Неподдерживаемая версия формата снапшота: {manifest.get('format_version')}")
+    if manifest.get("embedding_model") != settings.EMBEDDING_MODEL_NAME:
+        raise ValueError(
+            f"Снапшот построен моделью {manifest.get('embedding_model')}, "
+            f"а сервис использует {settings.EMBEDDING_MODEL_NAME}"
+        )
+    if verify:
+        for name, checksum in manifest["checksums"].items():
+            if _sha256(snapshot_dir / name) != checksum:
+                raise ValueError(f"Контрольная сумма файла {name} не совпадает")
+    return manifest
+
+
+def import_snapshot(
+    snapshot_dir: Path, verify: bool = True, projection: Optional[PCAProjection] = None, publish: bool = True
+) -> Collection:
+    """
+    Восстанавливает коллекцию из снапшота без пересчета эмбеддингов.
+
+    Коллекция собирается рядом с опубликованной, которая обслуживает запросы
+    до конца загрузки. Коллекция получает версию из снапшота, поэтому кэши
+    поиска на всех репликах согласованы; проекция и докстор из снапшота публикуются
+    вместе с ней одной записью в метаданные (см. publish_index), докстор — не раньше коллекции.
+
+    Args:
+        snapshot_dir: Каталог снапшота.
+        verify: Сверять ли контрольные суммы перед загрузкой.
+        projection: Проекция, которую нужно применить к векторам снапшота при загрузке
+            (ингест так понижает размерность свежей коллекции).
+        publish: Публиковать ли коллекцию; ингест публикует её сам вместе с проекцией.
+
+    Returns:
+        Восстановленная коллекция.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    manifest = load_manifest(snapshot_dir, verify=verify)
+    start_time = time.perf_counter()
+
+    embeddings = np.load(snapshot_dir / "embeddings.npy", mmap_mode="r")
+    ids = np.load(snapshot_dir / "ids.npy")
+    offsets = np.load(snapshot_dir / "text_offsets.npy", mmap_mode="r")
+    if embeddings.shape != (manifest["count"], manifest["dimension"]) or len(ids) != manifest["count"]:
+        raise ValueError("Размеры данных снапшота не совпадают с манифестом")
+
+    client = get_chroma_client()
+    collection = create_staging_collection(client)
+
+    try:
+        with open(snapshot_dir / "texts.bin", "rb") as texts, \
+                open(snapshot_dir / "metadatas.jsonl", encoding="utf-8") as metadatas:
+            blob = mmap.mmap(texts.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] else b""
+            for start in range(0, manifest["count"], PAGE_SIZE):
+                end = min(start + PAGE_SIZE, manifest["count"])
+                batch = np.asarray(embeddings[start:end])
+                call_with_retries(
+                    collection.add,
+                    ids=ids[start:end].tolist(),
+                    embeddings=projection.transform(batch) if projection is not None else batch,
+                    documents=[
+                        blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(start, end)
+                    ],
+                    metadatas=[json.loads(metadatas.readline()) for _ in range(start, end)],
+                )
+
+            if isinstance(blob, mmap.mmap):
+                blob.close()
+    except BaseException:
+        # Недособранная коллекция не публикуется, опубликованная не меняется
+        delete_collection(client, collection.name)
+        raise
+
+    if not publish:
+        return collection
+
+    docstore = None
+    try:
+        # Докстор снапшота копируется в неопубликованную версию, её публикует коллекция
+        if (snapshot_dir / "docstore" / INDEX_FILE).exists():
+            docstore = stage_docstore(snapshot_dir / "docstore", settings.DOCSTORE_PATH)
+
+        # Векторы снапшота уже спроецированы его проекцией (или хранятся в исходной размерности)
+        snapshot_projection = None
+        if (snapshot_dir / PROJECTION_FILE).exists():
+            snapshot_projection = PCAProjection.load(snapshot_dir / PROJECTION_FILE)
+        publish_index(collection, manifest["collection_version"], projection or snapshot_projection, docstore)
+    except BaseException:
+        # Пока указатель не переключен, опубликованные коллекция и докстор не меняются
+        if live_collection_name(client) != collection.name:
+            delete_collection(client, collection.name)
+            if docstore is not None:
+                discard_docstore(docstore, settings.DOCSTORE_PATH)
+        raise
+    logger.info(
+        f"Снапшот {snapshot_dir} ({manifest['count']} записей) загружен "
+        f"за {time.perf_counter() - start_time:.2f} с"
+    )
+    return collection
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Экспорт и импорт снапшотов векторного индекса")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", type=Path, help="Каталог снапшота")
+    parser.add_argument("--no-verify", action="store_true", help="Не сверять контрольные суммы при импорте")
+    parser.add_argument("--if-empty", action="store_true", help="Импортировать, только если коллекция пуста")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_snapshot(get_chroma_collection(get_chroma_client()), args.path)
+    elif args.if_empty and get_chroma_collection(get_chroma_client(), create=True).count() > 0:
+        logger.info("Коллекция уже заполнена, импорт снапшота пропущен")
+    else:
+        import_snapshot(args.path, verify=not args.no_verify)
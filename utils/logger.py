@@ -1,9 +1,163 @@
+import atexit
+import contextvars
+import json
 import logging
+import os
+import queue
+import random
 import sys
+import threading
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+
+from settings import settings
+
+# Идентификатор текущего запроса; выставляется middleware в main.py
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет в запись идентификатор текущего запроса."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+def truncate(text: Any, limit: Optional[int] = None) -> str:
+    """Обрезает длинное значение для лога, оставляя пометку об исходной длине."""
+    text = str(text)
+    limit = limit or settings.LOG_MAX_FIELD_CHARS
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}… [+{len(text) - limit} симв.]"
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись как одну строку JSON с обрезкой больших полей."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": truncate(record.getMessage()),
+        }
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            payload[key] = value if isinstance(value, (int, float, bool)) or value is None else truncate(value)
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Текстовый формат с идентификатором запроса и обрезкой сообщения."""
+
+    def __init__(self) -> None:
+        super().__init__(
+            "[%(asctime)s] [%(name)s] [%(levelname)s] [%(request_id)s] %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = truncate(record.message)
+        return super().formatMessage(record)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Кладет записи в ограниченную очередь, не блокируя вызывающий код.
+
+    Сообщение не форматируется в вызывающем потоке (это делает поток
+    QueueListener), а при переполнении очереди запись отбрасывается и учитывается.
+    """
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Форматирование откладывается до потока-слушателя
+        record.request_id = getattr(record, "request_id", request_id_var.get())
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        _ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+_handler = NonBlockingQueueHandler(_queue)
+_handler.addFilter(RequestIdFilter())
+_listener: Optional[QueueListener] = None
+_listener_pid: Optional[int] = None
+_listener_lock = threading.Lock()
+
+
+def _build_output_handler() -> logging.Handler:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if settings.LOG_FORMAT == "json" else TextFormatter())
+    return handler
+
+
+def _ensure_listener() -> None:
+    """Запускает поток записи логов в текущем процессе (потоки не переживают fork())."""
+    global _listener, _listener_pid
+
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_lock:
+        if _listener_pid != pid:
+            _listener = QueueListener(_queue, _build_output_handler(), respect_handler_level=False)
+            _listener.start()
+            _listener_pid = pid
+
+
+def _reset_after_fork() -> None:
+    """
+    Пересоздает очередь и блокировку в дочернем процессе после fork().
+
+    Очередь родителя могла быть скопирована с захваченной внутренней блокировкой
+    (ее держал поток-слушатель, которого в ребенке нет), поэтому ребенок получает
+    свою пустую очередь; поток записи запустится при первой записи.
+    """
+    global _queue, _listener, _listener_pid, _listener_lock
+
+    _queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    _handler.queue = _queue
+    _listener = None
+    _listener_pid = None
+    _listener_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def flush_logs() -> None:
+    """Дописывает накопленные записи и останавливает поток записи."""
+    global _listener_pid
+
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener_pid = None
+
+
+atexit.register(flush_logs)
+
 
 def setup_logger(name: str) -> logging.Logger:
     """Настраивает и возвращает логгер с заданным именем.
 
+    Записи уходят в общую очередь и пишутся в stdout отдельным потоком.
+    Уровень берется из settings.LOG_LEVELS[name] или settings.LOG_LEVEL.
+
     Args:
         name: Имя логгера.
 
@@ -11,15 +165,49 @@ def setup_logger(name: str) -> logging.Logger:
         Настроенный объект логгера.
     """
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(settings.LOG_LEVELS.get(name, settings.LOG_LEVEL).upper())
+    logger.propagate = False
 
     if not logger.handlers:
-        handler = logging.StreamHandler(sys.stdout)
-        formatter = logging.Formatter(
-            "[%(asctime)s] [%(name)s] [%(levelname)s] %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        logger.addHandler(_handler)
+
+    return logger
+
+
+def log_payload(logger: logging.Logger, label: str, payload: Any) -> None:
+    """
+    Логирует большое значение (промпт, ответ) с сэмплированием и обрезкой.
+
+    На уровне DEBUG значение пишется всегда, на INFO — для доли
+    settings.LOG_PAYLOAD_SAMPLE_RATE запросов. Решение выводится из идентификатора
+    запроса, поэтому промпт и ответ одного запроса попадают в лог вместе.
+
+    Args:
+        logger: Логгер.
+        label: Подпись значения.
+        payload: Значение.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s: %s", label, payload)
+    elif logger.isEnabledFor(logging.INFO) and is_sampled(request_id_var.get()):
+        logger.info("%s (сэмпл): %s", label, payload)
+
+
+def is_sampled(request_id: str) -> bool:
+    """Детерминированно решает, попадает ли запрос в сэмпл (вне запроса — случайно)."""
+    if request_id == "-":
+        return random.random() < settings.LOG_PAYLOAD_SAMPLE_RATE
+    return zlib.crc32(request_id.encode("utf-8")) / 2**32 < settings.LOG_PAYLOAD_SAMPLE_RATE
+
+
+def log_memory(logger: logging.Logger, label: str) -> None:
+    """Логирует RSS процесса; psutil опрашивается только при включенном DEBUG."""
+    if logger.isEnabledFor(logging.DEBUG):
+        import psutil
+
+        logger.debug(f"Потребление памяти {label}: {psutil.Process().memory_info().rss / 1024**2:.2f} МБ")
+
 
-    return logger
\ No newline at end of file
+def dropped_records() -> int:
+    """Число записей, отброшенных из-за переполнения очереди."""
+    return _handler.dropped
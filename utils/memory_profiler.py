@@ -0,0 +1,196 @@
+import gc
+import logging
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import psutil
+
+from settings import settings
+from utils.logger import setup_logger
+
+# Инициализация логгера
+logger = setup_logger("memory")
+
+MB = 1024 ** 2
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса в мегабайтах."""
+    return psutil.Process().memory_info().rss / MB
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса за всё время работы в мегабайтах."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS — байты
+    return peak / MB if sys.platform == "darwin" else peak / 1024
+
+
+def deep_sizeof(obj: Any, seen: Optional[set] = None) -> int:
+    """
+    Приблизительный размер объекта вместе с вложенными объектами в байтах.
+
+    Массивы NumPy учитываются по размеру буфера, общие объекты — один раз.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + sys.getsizeof(obj)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def path_size_mb(path: Path) -> float:
+    """Размер файла или каталога на диске в мегабайтах (0, если его нет)."""
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size / MB
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file()) / MB
+    return 0.0
+
+
+def top_allocations(snapshot: tracemalloc.Snapshot, top: int) -> List[Dict[str, Any]]:
+    """Возвращает строки кода с наибольшим объемом живых аллокаций."""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    return [
+        {
+            "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_mb": round(stat.size / MB, 3),
+            "count": stat.count,
+        }
+        for stat in snapshot.statistics("lineno")[:top]
+    ]
+
+
+def heap_snapshot(top: int = 20) -> Dict[str, Any]:
+    """
+    Снимает снапшот кучи Python и возвращает крупнейшие места аллокаций.
+
+    tracemalloc видит только аллокации, сделанные после его запуска, поэтому
+    первый вызов включает трассировку, а данные появляются в следующих вызовах.
+
+    Аргументы:
+        top (int): Сколько строк кода вернуть.
+
+    Возвращает:
+        Dict[str, Any]: Объем отслеживаемой памяти и список крупнейших аллокаций.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(settings.MEMORY_PROFILE_FRAMES)
+        return {"tracing_started": True, "top": []}
+
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "tracing_started": False,
+        "traced_mb": round(current / MB, 2),
+        "traced_peak_mb": round(peak / MB, 2),
+        "top": top_allocations(tracemalloc.take_snapshot(), top),
+    }
+
+
+def stop_heap_tracing() -> None:
+    """Выключает tracemalloc: трассировка замедляет аллокации в разы."""
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+class MemoryProfiler:
+    """
+    Профилировщик памяти ингеста по фазам (load / chunk / embed / write).
+
+    В выключенном состоянии фазы ничего не стоят, а RSS батча пишется только на DEBUG.
+    Во включенном состоянии работает tracemalloc: для каждой фазы запоминается
+    пик отслеживаемой памяти (peak_mb) и крупнейшие аллокации, еще живые в конце
+    прохода с этим пиком (top_at_end), — временные буферы, освобожденные до конца
+    прохода, в пик входят, а в снапшот нет. Для батча пишется текущий RSS и
+    максимальный RSS с запуска процесса (ru_maxrss), а не пик самого батча.
+    """
+
+    def __init__(self, enabled: bool = False, top: int = 10) -> None:
+        self.enabled = enabled
+        self.top = top
+        self.phases: Dict[str, Dict[str, Any]] = {}
+        self._started_tracing = False
+
+    def start(self) -> None:
+        """Запускает tracemalloc, если профилирование включено."""
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(settings.MEMORY_PROFILE_FRAMES)
+            self._started_tracing = True
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Учитывает время и пик памяти одного прохода фазы."""
+        if not self.enabled:
+            yield
+            return
+
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            stats = self.phases.setdefault(name, {"calls": 0, "seconds": 0.0, "peak_mb": 0.0, "top_at_end": []})
+            stats["calls"] += 1
+            stats["seconds"] += time.perf_counter() - start
+            # Снапшот дорогой, поэтому снимается только при новом максимуме фазы
+            # (в конце прохода: момент самого пика tracemalloc не фиксирует)
+            if peak / MB > stats["peak_mb"]:
+                stats["peak_mb"] = peak / MB
+                stats["top_at_end"] = top_allocations(tracemalloc.take_snapshot(), self.top)
+
+    def record_batch(self, label: str, size: int) -> None:
+        """Логирует текущий RSS и максимальный RSS процесса с его запуска после батча."""
+        if self.enabled:
+            logger.info(
+                f"Батч {label} ({size} чанков): RSS {rss_mb():.1f} МБ, "
+                f"максимальный RSS с запуска процесса {peak_rss_mb():.1f} МБ"
+            )
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Батч {label}: RSS {rss_mb():.1f} МБ")
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Логирует итог по фазам и останавливает трассировку.
+
+        Возвращает:
+            Dict[str, Any]: Пиковый RSS процесса и статистика фаз.
+        """
+        summary = {"peak_rss_mb": round(peak_rss_mb(), 1), "phases": self.phases}
+        logger.info(f"Итоговый RSS: {rss_mb():.1f} МБ, пиковый RSS: {summary['peak_rss_mb']} МБ")
+
+        for name, stats in self.phases.items():
+            logger.info(
+                f"Фаза {name}: {stats['calls']} вызовов, {stats['seconds']:.1f} с, "
+                f"пик Python-аллокаций {stats['peak_mb']:.1f} МБ"
+            )
+            if stats["top_at_end"]:
+                logger.info(f"  Живые аллокации в конце прохода с пиком фазы {name}:")
+            for item in stats["top_at_end"]:
+                logger.info(f"  {item['location']}: {item['size_mb']} МБ в {item['count']} блоках")
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return summary